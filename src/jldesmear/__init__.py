@@ -24,6 +24,8 @@ __install_requires__ = ['Sphinx>=0.6',
 __console_scripts__ = [
                        'jldsmear = jldesmear.ui:desmear_cli', 
                        'jldsmear_gui = jldsmear.ui:desmear_gui', 
+                       'jldsmear_batch = jldesmear.ui:desmear_batch', 
+                       'jldsmear_run = jldesmear.ui:desmear_run', 
                        ]
 
 
@@ -11,6 +11,8 @@ The available routines are::
      def  Subtract(x, y):                 remove an X,Y pair
      def  AddWeighted(x, y, z):           add an X,Y pair with weight Z
      def  SubtractWeighted(x, y, z):      remove an X,Y pair with weight Z
+     def  AddArrays(x, y, weights):       add arrays of X,Y pairs (optional weights)
+     def  SubtractArrays(x, y, weights):  remove arrays of X,Y pairs (optional weights)
      def  Mean():                         arithmetic mean of X & Y
      def  StdDev():                       standard deviation on X & Y
      def  StdErr():                       standard error on X & Y
@@ -30,6 +32,7 @@ Source code documentation
 
 
 import math
+import numpy
 
 
 version = '0.1a'
@@ -139,6 +142,54 @@ class StatsRegClass:
         self.sumXY  -= xWt*yWt
         return self.count
 
+    def  AddArrays(self, x, y, weights=None):
+        '''
+        add arrays of X,Y pairs to the statistics registers
+        
+        Same as :meth:`AddWeighted` for each pair, 
+        using NumPy reductions rather than a Python loop.
+
+        :param numpy.ndarray x: values to accumulate
+        :param numpy.ndarray y: values to accumulate
+        :param numpy.ndarray weights: weight of each pair (``1/z^2`` in :meth:`AddWeighted`), 
+            default: 1 for each pair
+        '''
+        return self._AccumulateArrays_(x, y, weights, 1)
+
+    def  SubtractArrays(self, x, y, weights=None):
+        '''
+        remove arrays of X,Y pairs from the statistics registers
+
+        :param numpy.ndarray x: values to remove
+        :param numpy.ndarray y: values to remove
+        :param numpy.ndarray weights: weight of each pair (``1/z^2`` in :meth:`SubtractWeighted`), 
+            default: 1 for each pair
+        '''
+        return self._AccumulateArrays_(x, y, weights, -1)
+
+    def  _AccumulateArrays_(self, x, y, weights, sign):
+        '''
+        internal routine: add (``sign=1``) or remove (``sign=-1``) 
+        arrays of X,Y pairs using the same register terms as :meth:`AddWeighted`
+        '''
+        self._ClearResults_()
+        x = numpy.asarray(x, dtype=float)
+        y = numpy.asarray(y, dtype=float)
+        if weights is None:
+            weights = numpy.ones_like(x)
+        else:
+            weights = numpy.asarray(weights, dtype=float)
+        xWt = x*weights
+        yWt = y*weights
+        self.count  += sign * x.size
+        self.weight += sign * numpy.sum(weights)
+        self.sumX   += sign * numpy.sum(xWt)
+        self.sumXX  += sign * numpy.sum(xWt**2)
+        self.sumY   += sign * numpy.sum(yWt)
+        self.sumYY  += sign * numpy.sum(yWt**2)
+        self.sumXY  += sign * numpy.sum(xWt*yWt)
+        return self.count
+
     def  Mean(self):
         '''
 		arithmetic mean of X & Y
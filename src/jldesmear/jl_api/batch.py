@@ -0,0 +1,353 @@
+#!/usr/bin/env python
+
+'''
+Desmear many datasets at once
+
+Each dataset is described by a command input file
+(``.inp``, see :mod:`~jldesmear.jl_api.fileio_inp`).
+The ``.inp`` files are found in the given files or directories
+and each is desmeared to completion (``NumItr`` iterations)
+in a pool of worker processes (or threads).  The desmeared data are written
+to the ``.dsm`` file named in the ``.inp`` file
+(or to a different directory, if requested).
+A summary table of the final ChiSqr, number of iterations, and
+wall time is reported for each file.
+
+HDF5 (NeXus) files (see :mod:`~jldesmear.jl_api.fileio_nexus`) may also
+be given: each of their scans is desmeared and the results are appended
+to the scan in the same file (or a file of the same name in the output directory).
+With ``--hdf5 FILE``, the results of the ``.inp`` files are also
+written to a single HDF5 file (one scan per ``.inp`` file) rather than ``.dsm`` files.
+HDF5 files are written only by the main process, once the workers have finished.
+
+Run from the command line with::
+
+    jldsmear batch [-n PROCESSES] [-t] [-o OUTPUT_DIR] [-r] [-s STOP] [--hdf5 FILE] path [path ...]
+
+Iterations stop after the ``NumItr`` of each ``.inp`` file
+(or ``--max-iterations``) or when any of the ``--stop`` criteria
+(see :data:`~jldesmear.jl_api.desmear.Stopping_Criteria`) is met.
+
+Source Code Documentation
+^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^
+'''
+
+
+import argparse
+import glob
+import multiprocessing
+import multiprocessing.pool
+import os
+import sys
+import time
+import desmear
+import fileio_inp
+import fileio_nexus
+
+
+INPUT_EXTENSION = '.inp'
+HDF5_EXTENSIONS = tuple([os.path.splitext(ext)[1] for ext in fileio_nexus.NeXus.extensions])
+
+
+def find_inputs(paths, recursive=False):
+    '''
+    list the command input files in the given paths
+
+    :param [str] paths: names of ``.inp`` files or directories containing them
+    :param bool recursive: if True, also search subdirectories
+    :return: sorted list of absolute file names, without duplicates
+    :rtype: [str]
+    '''
+    found = set()
+    for path in paths:
+        path = os.path.abspath(path)
+        if os.path.isdir(path):
+            if recursive:
+                for root, _dirs, files in os.walk(path):
+                    for name in files:
+                        if name.endswith(INPUT_EXTENSION):
+                            found.add(os.path.join(root, name))
+            else:
+                found.update(glob.glob(os.path.join(path, '*' + INPUT_EXTENSION)))
+        elif path.endswith(INPUT_EXTENSION) and os.path.exists(path):
+            found.add(path)
+    return sorted(found)
+
+
+def find_scans(paths, output_dir=None):
+    '''
+    list the scans of the HDF5 (NeXus) files in the given paths
+
+    :param [str] paths: file names, those with ``HDF5_EXTENSIONS`` are used
+    :param str output_dir: (optional) container for the results of each file:
+        a file of the same name in this directory (default: the file itself)
+    :return: list of (HDF5 file, scan name, container) of each scan
+    :rtype: [(str, str, str)]
+    :raises ImportError: (naming the file) if there are HDF5 files but no ``h5py`` package
+    '''
+    scans = []
+    for path in paths:
+        path = os.path.abspath(path)
+        if os.path.splitext(path)[1] not in HDF5_EXTENSIONS or not os.path.isfile(path):
+            continue
+        container = path
+        if output_dir is not None:
+            container = os.path.join(os.path.abspath(output_dir), os.path.basename(path))
+        try:
+            names = fileio_nexus.scan_names(path)
+        except ImportError, exc:
+            raise ImportError, '%s: %s' % (path, str(exc))
+        for name in names:
+            scans.append((path, name, container))
+    return scans
+
+
+def scan_name(filename):
+    ''':return: name of the scan of an ``.inp`` file in an HDF5 container'''
+    return os.path.splitext(os.path.basename(filename))[0]
+
+
+def desmear_file(filename, output_dir=None, overrides=None, container=None):
+    '''
+    desmear the dataset described by one command input file (or one HDF5 scan)
+
+    Runs in a worker process, so all results are returned
+    in a (picklable) dictionary.  Exceptions are reported in
+    the ``error`` item rather than raised.
+    Results for an HDF5 *container* are not written here
+    but returned in the ``data`` item (see :func:`~jldesmear.jl_api.fileio_nexus.results()`),
+    to be written by :func:`run()`.
+
+    :param filename: name of the ``.inp`` file, 
+        or (HDF5 file, scan name, container) from :func:`find_scans()`
+    :param str output_dir: (optional) write the ``.dsm`` file into this directory
+    :param dict overrides: (optional) :class:`~jldesmear.jl_api.info.Info` 
+        attributes to replace those from the ``.inp`` file, such as ``stopping``
+    :param str container: (optional) HDF5 file for the results of an ``.inp`` file,
+        rather than its ``.dsm`` file
+    :return: dictionary with keys: ``filename``, ``outfile``,
+        ``iterations``, ``ChiSqr``, ``stop_reason``, ``time``, ``error``,
+        and (for HDF5 results) ``container``, ``scan``, and ``data``
+    :rtype: dict
+    '''
+    t0 = time.time()
+    result = dict(filename=filename, outfile=None,
+                  iterations=None, ChiSqr=None, stop_reason=None, 
+                  time=None, error=None)
+    try:
+        if isinstance(filename, tuple):
+            h5file, scan, container = filename
+            cmd_inp = fileio_nexus.NeXus()
+            params = cmd_inp.read(h5file, scan)
+            params.outfile = os.path.splitext(container)[0] + '_' + scan + '.dsm'
+        else:
+            cmd_inp = fileio_inp.CommandInput()
+            params = cmd_inp.read(filename)
+            if params is None:
+                raise RuntimeError, "could not read command input file"
+            scan = scan_name(filename)
+        params.quiet = True
+        params.callback = None
+        for key, value in (overrides or {}).items():
+            setattr(params, key, value)
+        desmear.check_iterations(params)
+        if output_dir is not None:
+            params.outfile = os.path.join(os.path.abspath(output_dir),
+                                          os.path.basename(params.outfile))
+        result['outfile'] = params.outfile
+        if container is not None:
+            result.update(container=container, scan=scan, outfile='%s:/%s' % (container, scan))
+
+        data = cmd_inp.read_SMR(params.infile)
+        if data is None:
+            raise IOError, "data file not found: " + params.infile
+        q, E, dE = data
+        checkpoint = desmear.checkpoint_filename(params)
+        dsm = desmear.resume_desmearing(q, E, dE, params)
+        while dsm.more_iterations_ok():
+            dsm.iteration()
+            if desmear.checkpoint_due(dsm):
+                dsm.save_state(checkpoint)
+        if params.uncertainty == 'montecarlo':
+            desmear.monte_carlo_uncertainty(dsm)
+        if container is None:
+            cmd_inp.save_DSM(params.outfile, dsm, quiet=True)
+        else:
+            result['data'] = fileio_nexus.results(dsm)
+        if params.checkpoint_interval and os.path.exists(checkpoint):
+            os.remove(checkpoint)
+
+        result['iterations'] = dsm.iteration_count
+        result['ChiSqr'] = dsm.ChiSqr[-1]
+        result['stop_reason'] = dsm.stop_reason
+    except Exception, exc:
+        result['error'] = '%s: %s' % (exc.__class__.__name__, str(exc))
+    result['time'] = time.time() - t0
+    return result
+
+
+def _desmear_file_star(args):
+    '''unpack the arguments for :func:`desmear_file()` (used by the process pool)'''
+    return desmear_file(*args)
+
+
+def run(filenames, processes=None, output_dir=None, overrides=None, container=None,
+        threads=False):
+    '''
+    desmear each of the command input files, in a pool of worker processes (or threads)
+
+    The results for HDF5 containers are then written, 
+    one scan at a time, by this process.
+
+    :param [str] filenames: names of the ``.inp`` files 
+        (or HDF5 scans, from :func:`find_scans()`)
+    :param int processes: number of worker processes
+        (default: number of CPUs, 1: desmear in this process)
+    :param str output_dir: (optional) write the ``.dsm`` files into this directory
+    :param dict overrides: (optional) :class:`~jldesmear.jl_api.info.Info` 
+        attributes to replace those from each ``.inp`` file
+    :param str container: (optional) HDF5 file for the results of the ``.inp`` files
+    :param bool threads: if True, use a pool of threads in this process
+        (*processes* threads) rather than worker processes
+    :return: list of results from :func:`desmear_file()`, in the order of *filenames*
+    :rtype: [dict]
+    '''
+    jobs = [(fn, output_dir, overrides, container) for fn in filenames]
+    if processes == 1 or len(jobs) < 2:
+        results = map(_desmear_file_star, jobs)
+    else:
+        if threads:
+            pool = multiprocessing.pool.ThreadPool(processes)
+        else:
+            pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(_desmear_file_star, jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    for result in results:
+        data = result.pop('data', None)
+        if data is not None and result['error'] is None:
+            try:
+                fileio_nexus.write_results(result['container'], result['scan'], data)
+            except Exception, exc:
+                result['error'] = '%s: %s' % (exc.__class__.__name__, str(exc))
+    return results
+
+
+def summary(results):
+    '''
+    table of the final ChiSqr, number of iterations, and wall time for each file
+
+    :param [dict] results: list of results from :func:`desmear_file()`
+    :return: text of the table
+    :rtype: str
+    '''
+    fmt = '%-30s %10s %14s %10s  %s'
+    lines = [fmt % ('file', 'iterations', 'ChiSqr', 'time, s', 'status')]
+    lines.append('-' * len(lines[0]))
+    for result in results:
+        if isinstance(result['filename'], tuple):
+            name = '%s:%s' % (os.path.basename(result['filename'][0]), result['filename'][1])
+        else:
+            name = os.path.basename(result['filename'])
+        if result['error'] is None:
+            iterations = '%d' % result['iterations']
+            chisqr = '%g' % result['ChiSqr']
+            status = 'ok (%s)' % result['stop_reason']
+        else:
+            iterations, chisqr = '-', '-'
+            status = result['error']
+        lines.append(fmt % (name, iterations, chisqr, '%.3f' % result['time'], status))
+    return '\n'.join(lines)
+
+
+def main(args=None):
+    '''
+    command-line program: desmear all the ``.inp`` files (and HDF5 scans) found
+
+    :param [str] args: command-line arguments (default: ``sys.argv[1:]``)
+    :return: exit status, 0 if all datasets were desmeared
+    :rtype: int
+    '''
+    doc = 'Desmear many datasets described by command input (.inp) files'
+    parser = argparse.ArgumentParser(prog='jldsmear batch', description=doc)
+    parser.add_argument('paths', nargs='+',
+                        help='.inp files or directories containing them, or HDF5 files')
+    parser.add_argument('-n', '--processes', type=int, default=None,
+                        help='number of worker processes (default: number of CPUs)')
+    parser.add_argument('-t', '--threads', action='store_true', default=False,
+                        help='desmear in a pool of threads in this process rather than processes')
+    parser.add_argument('-o', '--output-dir', default=None, dest='output_dir',
+                        help='write .dsm files here rather than as named in each .inp file')
+    parser.add_argument('-r', '--recursive', action='store_true', default=False,
+                        help='also search subdirectories for .inp files')
+    parser.add_argument('-s', '--stop', action='append', default=[], dest='stopping',
+                        choices=sorted(desmear.Stopping_Criteria.keys()),
+                        help='stop iterating when this criterion is met (may be repeated)')
+    parser.add_argument('--max-iterations', type=int, default=None, dest='NumItr',
+                        help='replace the number of iterations given in each .inp file')
+    parser.add_argument('-a', '--acceleration', default=None,
+                        choices=sorted(desmear.Acceleration_Methods.keys()),
+                        help='acceleration of the Lake iteration')
+    parser.add_argument('-m', '--method', default=None, dest='desmear_method',
+                        choices=sorted(desmear.Desmearing_Methods.keys()),
+                        help='desmearing method')
+    parser.add_argument('-u', '--uncertainty', default=None,
+                        choices=sorted(desmear.Uncertainty_Methods.keys()),
+                        help='estimate of the uncertainties of the desmeared intensities')
+    parser.add_argument('--checkpoint', type=int, default=None, dest='checkpoint_interval',
+                        help='save the state of each dataset every CHECKPOINT iterations, '
+                        'next to its output file, and resume from it')
+    parser.add_argument('--sidecar', action='store_true', default=False, dest='data_sidecar',
+                        help='keep a binary copy of each data file, read instead of the text when up to date')
+    parser.add_argument('--hdf5', default=None, dest='container',
+                        help='write the results of the .inp files to this HDF5 (NeXus) file '
+                        'rather than .dsm files')
+    parser.add_argument('--kernel-cache', default=None, dest='kernel_cache_dir',
+                        help='directory of smearing kernels shared by the workers and later runs')
+    results = parser.parse_args(args)
+    overrides = {}
+    if len(results.stopping) > 0:
+        overrides['stopping'] = tuple(results.stopping)
+    if results.NumItr is not None:
+        overrides['NumItr'] = results.NumItr
+    if results.acceleration is not None:
+        overrides['acceleration'] = results.acceleration
+    if results.desmear_method is not None:
+        overrides['desmear_method'] = results.desmear_method
+    if results.uncertainty is not None:
+        overrides['uncertainty'] = results.uncertainty
+    if results.checkpoint_interval is not None:
+        overrides['checkpoint_interval'] = results.checkpoint_interval
+    if results.data_sidecar:
+        overrides['data_sidecar'] = True
+    if results.kernel_cache_dir is not None:
+        overrides['kernel_cache_dir'] = os.path.abspath(results.kernel_cache_dir)
+
+    filenames = find_inputs(results.paths, results.recursive)
+    try:
+        filenames += find_scans(results.paths, results.output_dir)
+    except ImportError, exc:
+        print(str(exc))
+        return 1
+    if len(filenames) == 0:
+        print("no %s or HDF5 files found" % INPUT_EXTENSION)
+        return 1
+    if results.output_dir is not None and not os.path.exists(results.output_dir):
+        os.makedirs(results.output_dir)
+    container = results.container
+    if container is not None:
+        container = os.path.abspath(container)
+
+    t0 = time.time()
+    reports = run(filenames, results.processes, results.output_dir, overrides, container,
+                  results.threads)
+    print(summary(reports))
+    failures = len([r for r in reports if r['error'] is not None])
+    print("%d file(s), %d failed, %.3f s" % (len(reports), failures, time.time() - t0))
+    return int(failures > 0)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
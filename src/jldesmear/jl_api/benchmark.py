@@ -0,0 +1,499 @@
+#!/usr/bin/env python
+
+'''
+Benchmark the smearing and desmearing computations
+
+Times file loading (:func:`~jldesmear.jl_api.toolbox.GetDat`),
+:func:`~jldesmear.jl_api.smear.prepare_extrapolation`,
+:func:`~jldesmear.jl_api.smear.Smear`, and
+:meth:`~jldesmear.jl_api.desmear.Desmearing.iteration`
+for each smearing engine (``smear.Smearing_Engines``)
+on every dataset (``.inp`` file) in the package ``data`` directory
+and on synthetic scans of increasing size.
+Each case runs in its own worker process so that its peak memory
+can be reported.  The scaling exponent *b* of
+:math:`t \\propto N^b` is fitted for each engine
+from the synthetic scans.  Results are saved as JSON
+so that releases may be compared.
+
+Run from the command line with::
+
+    python -m jldesmear.jl_api.benchmark -o results.json
+    python -m jldesmear.jl_api.benchmark --sizes 10000 100000 --engines vectorized
+
+Cases estimated to exceed ``--max-memory`` (or ``loop`` cases with more
+than ``--max-loop-points``) are skipped and reported as such.
+
+With ``--accuracy``, the smeared intensity computed with each of the
+slit quadratures (``smear.Slit_Quadratures``) is compared with
+that of the traditional trapezoid rule on the data abscissae 
+(the ``data`` rule) and with a converged result 
+(Gauss-Legendre, ``REFERENCE_NODES`` nodes)::
+
+    python -m jldesmear.jl_api.benchmark --accuracy --nodes 16 32 64 128
+
+With ``--loading``, the time to read each data file in the package ``data`` 
+directory with :func:`~jldesmear.jl_api.toolbox.ReadColumns` is compared
+with that of ``numpy.loadtxt``::
+
+    python -m jldesmear.jl_api.benchmark --loading
+
+Source Code Documentation
+^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^
+'''
+
+
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import time
+import timeit
+import numpy
+import jldesmear
+import desmear
+import fileio_inp
+import info
+import smear
+import toolbox
+
+
+DATA_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'data'))
+DATA_EXTENSIONS = ('.smr', '.dsm', '.dl', '.pin')
+SYNTHETIC_SIZES = (10000, 30000, 100000)
+ACCURACY_NODES = (16, 32, 64, 128, 256)
+REFERENCE_NODES = 2048
+timer = timeit.default_timer
+
+
+def estimated_memory(engine, NumPts, nodes=None, density=1.0):
+    '''
+    rough estimate of the memory (bytes) used by a smearing engine
+
+    :param str engine: one of the keys of ``smear.Smearing_Engines``
+    :param int NumPts: number of data points
+    :param int nodes: number of abscissae along the slit (default: *NumPts*)
+    :param float density: fraction of the kernel matrix that is nonzero
+        (see ``smear.kernel_density()``)
+    :rtype: float
+    '''
+    grid = float(NumPts) * (nodes or NumPts)
+    matrix = float(NumPts)**2 * 8
+    if density < smear.SPARSE_DENSITY:
+        matrix *= density * 1.5         # CSR: value and column index
+    block = 2**20 * 8 * 8.         # temporary arrays of one block of rows
+    estimates = {
+        'loop':       (nodes or NumPts) * 8 * 16.,
+        'vectorized': block,
+        'kernel':     2 * matrix + grid * 8 + block,     # matrix, extrapolated terms
+        'cached':     grid * 80 + block,
+        'tiled':      min(grid * 48, smear.TILE_CACHE_MB * 2.**20) + 2 * block,
+    }
+    return estimates.get(engine, grid * 40)
+
+
+def peak_memory_MB():
+    '''peak resident memory of this process, MB'''
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        maxrss /= 1024.         # bytes on macOS, kB elsewhere
+    return maxrss / 1024.
+
+
+def synthetic_dataset(NumPts):
+    '''
+    synthetic scan with *NumPts* points, log-spaced in *q*
+
+    :return: (q, I, dI, params)
+    '''
+    q = numpy.logspace(-4, -0.5, NumPts)
+    Rg = 200.0
+    I = 1e6 / (1 + (q*Rg)**2 / 3)**2 + 1.0
+    dI = 0.02 * I + 0.01
+    params = info.Info()
+    params.infile = 'synthetic'
+    params.slitlength = 0.02
+    params.sFinal = q[int(0.9 * NumPts)]
+    params.extrapname = 'Porod'
+    params.LakeWeighting = 'fast'
+    return q, I, dI, params
+
+
+def bundled_datasets(data_dir=DATA_DIR):
+    '''
+    command input files of the datasets in the package ``data`` directory
+
+    :return: dictionary of ``.inp`` file names, keyed by dataset name
+    :rtype: dict
+    '''
+    datasets = {}
+    for filename in sorted(glob.glob(os.path.join(data_dir, '*.inp'))):
+        datasets[os.path.splitext(os.path.basename(filename))[0]] = filename
+    return datasets
+
+
+def time_loading(filename, repeat=5):
+    '''
+    best time (s) to read the data of one command input file
+
+    :return: (seconds, q, I, dI, params)
+    '''
+    params = fileio_inp.CommandInput().read(filename)
+    best = None
+    for _ in range(repeat):
+        t0 = timer()
+        q, I, dI = toolbox.GetDat(params.infile)
+        elapsed = timer() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best, q, I, dI, params
+
+
+def compare_loading(data_dir=DATA_DIR, repeat=5, quiet=False):
+    '''
+    best times (s) to read each data file with ``numpy.loadtxt`` and with
+    :func:`~jldesmear.jl_api.toolbox.ReadColumns`
+    
+    :param str data_dir: directory of the data files (extensions ``DATA_EXTENSIONS``)
+    :param int repeat: number of times each file is read
+    :param bool quiet: if True, then no printed output from this routine
+    :return: dictionary with keys ``NumPts``, ``columns``, ``loadtxt``, and ``ReadColumns``,
+        keyed by file name
+    :rtype: dict
+    '''
+    def best(read, filename):
+        times = []
+        for _ in range(repeat):
+            t0 = timer()
+            read(filename)
+            times.append(timer() - t0)
+        return min(times)
+
+    def loadtxt(filename):
+        return numpy.loadtxt(filename, dtype=float, comments='#', unpack=True)
+
+    report = {}
+    for extension in DATA_EXTENSIONS:
+        for filename in sorted(glob.glob(os.path.join(data_dir, '*' + extension))):
+            columns = toolbox.ReadColumns(filename)
+            name = os.path.basename(filename)
+            report[name] = dict(NumPts=len(columns[0]), columns=len(columns),
+                                loadtxt=best(loadtxt, filename),
+                                ReadColumns=best(toolbox.ReadColumns, filename))
+            if not quiet:
+                r = report[name]
+                print('%-16s %6d x %d  loadtxt=%8.5f  ReadColumns=%8.5f  speedup=%5.1f' % (
+                    name, r['NumPts'], r['columns'], r['loadtxt'], r['ReadColumns'],
+                    r['loadtxt'] / r['ReadColumns']))
+    return report
+
+
+def time_engine(q, I, dI, params, engine, iterations):
+    '''
+    time the smearing computations for one dataset and engine
+
+    :return: dictionary of times (s): ``extrapolation``, ``smear``,
+        ``first_step``, ``iteration`` (mean of *iterations*)
+    :rtype: dict
+    '''
+    params.smear_engine = engine
+    params.quiet = True
+    params.callback = None
+    result = {}
+
+    t0 = timer()
+    extrap = smear.prepare_extrapolation(q, I, dI, params.extrapname, params.sFinal)
+    result['extrapolation'] = timer() - t0
+
+    t0 = timer()
+    smear.Smear(q, I, dI, params.extrapname, params.sFinal, params.slitlength,
+                quiet=True, engine=engine, block_size=params.smear_block_size,
+                extrap=extrap, quadrature=params.slit_quadrature, nodes=params.slit_nodes,
+                n_threads=params.n_threads)
+    result['smear'] = timer() - t0
+
+    t0 = timer()
+    dsm = desmear.Desmearing(q, I, dI, params)
+    result['first_step'] = timer() - t0
+
+    t0 = timer()
+    for _ in range(iterations):
+        dsm.iteration()
+    result['iteration'] = (timer() - t0) / max(1, iterations)
+    result['ChiSqr'] = float(dsm.ChiSqr[-1])
+    return result
+
+
+def _case(args):
+    '''run one benchmark case (in a worker process)'''
+    source, engine, iterations, quadrature, nodes, n_threads = args
+    baseline = peak_memory_MB()
+    try:
+        if isinstance(source, int):
+            load = None
+            q, I, dI, params = synthetic_dataset(source)
+        else:
+            load, q, I, dI, params = time_loading(source)
+        params.slit_quadrature = quadrature
+        params.slit_nodes = nodes
+        params.n_threads = n_threads
+        result = time_engine(q, I, dI, params, engine, iterations)
+        result['load'] = load
+        result['error'] = None
+    except Exception, exc:
+        result = dict(error='%s: %s' % (exc.__class__.__name__, str(exc)))
+    result['peak_MB'] = peak_memory_MB() - baseline
+    return result
+
+
+def run_isolated(func, args):
+    '''
+    call ``func(args)`` in a new worker process
+
+    :return: result of ``func(args)``
+    '''
+    pool = multiprocessing.Pool(1, maxtasksperchild=1)
+    try:
+        return pool.apply(func, (args,))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def scaling_exponents(results, key='iteration'):
+    '''
+    fit :math:`t \\propto N^b` for each engine, from the synthetic cases
+
+    :param [dict] results: benchmark results
+    :param str key: which time to fit
+    :return: dictionary of exponent *b*, keyed by engine
+    :rtype: dict
+    '''
+    exponents = {}
+    engines = set([r['engine'] for r in results])
+    for engine in sorted(engines):
+        cases = [r for r in results
+                 if r['engine'] == engine and r['synthetic'] and r.get(key)]
+        if len(cases) < 2:
+            continue
+        N = numpy.log([r['NumPts'] for r in cases])
+        t = numpy.log([r[key] for r in cases])
+        exponents[engine] = float(numpy.polyfit(N, t, 1)[0])
+    return exponents
+
+
+def quadrature_accuracy(q, C, dC, params, nodes=ACCURACY_NODES, engine='vectorized'):
+    '''
+    compare the smeared intensity from each slit quadrature 
+
+    The relative differences are measured from the traditional 
+    ``data`` rule and from a converged result 
+    (``gauss`` rule with ``REFERENCE_NODES`` nodes).
+    
+    :param [int] nodes: numbers of abscissae along the slit to try
+    :param str engine: smearing engine to use
+    :return: list of dictionaries with keys: ``quadrature``, ``nodes``,
+        ``time``, ``max_vs_data``, ``rms_vs_data``, 
+        ``max_vs_converged``, ``rms_vs_converged``
+    :rtype: [dict]
+    '''
+    extrap = smear.prepare_extrapolation(q, C, dC, params.extrapname, params.sFinal)
+
+    def smeared(quadrature, M):
+        t0 = timer()
+        S = smear.Smear(q, C, dC, params.extrapname, params.sFinal, params.slitlength,
+                        quiet=True, engine=engine, extrap=extrap,
+                        quadrature=quadrature, nodes=M)[0]
+        return S, timer() - t0
+
+    S_data, t_data = smeared('data', None)
+    S_converged = smeared('gauss', REFERENCE_NODES)[0]
+
+    def record(quadrature, M, S, elapsed):
+        vs_data = S / S_data - 1
+        vs_converged = S / S_converged - 1
+        return dict(quadrature=quadrature, nodes=M, time=elapsed,
+                    max_vs_data = float(numpy.abs(vs_data).max()),
+                    rms_vs_data = float(numpy.sqrt(numpy.mean(vs_data**2))),
+                    max_vs_converged = float(numpy.abs(vs_converged).max()),
+                    rms_vs_converged = float(numpy.sqrt(numpy.mean(vs_converged**2))),
+                    )
+
+    report = [record('data', len(q), S_data, t_data)]
+    for quadrature in sorted(smear.Slit_Quadratures.keys()):
+        if quadrature == 'data':
+            continue
+        for M in nodes:
+            S, elapsed = smeared(quadrature, M)
+            report.append(record(quadrature, M, S, elapsed))
+    return report
+
+
+def format_accuracy(dataset, record):
+    '''one line of text describing a quadrature accuracy result'''
+    fmt = '%-16s %-10s %6d  time=%8.4f  vs data: max=%.2e rms=%.2e  vs converged: max=%.2e rms=%.2e'
+    return fmt % (dataset, record['quadrature'], record['nodes'], record['time'],
+                  record['max_vs_data'], record['rms_vs_data'],
+                  record['max_vs_converged'], record['rms_vs_converged'])
+
+
+def accuracy(nodes=ACCURACY_NODES, quiet=False):
+    '''
+    slit quadrature accuracy report for the datasets in the package ``data`` directory
+    
+    :param [int] nodes: numbers of abscissae along the slit to try
+    :param bool quiet: if True, then no printed output from this routine
+    :return: results of :func:`quadrature_accuracy()`, keyed by dataset name
+    :rtype: dict
+    '''
+    report = {}
+    for name, filename in sorted(bundled_datasets().items()):
+        _load, q, I, dI, params = time_loading(filename, repeat=1)
+        report[name] = quadrature_accuracy(q, I, dI, params, nodes)
+        if not quiet:
+            for record in report[name]:
+                print(format_accuracy(name, record))
+    return report
+
+
+def run(engines=None, sizes=SYNTHETIC_SIZES, iterations=3,
+        max_memory=2e9, max_loop_points=5000, bundled=True, quiet=False,
+        quadrature='data', nodes=None, n_threads=1):
+    '''
+    run the benchmark cases
+
+    :param [str] engines: smearing engines (default: all)
+    :param [int] sizes: numbers of points in the synthetic scans
+    :param int iterations: number of desmearing iterations to time
+    :param float max_memory: skip cases estimated to need more memory (bytes)
+    :param int max_loop_points: skip ``loop`` cases with more points
+    :param bool bundled: include the datasets in the package ``data`` directory
+    :param bool quiet: if True, then no printed output from this routine
+    :param str quadrature: integration rule along the slit, see ``smear.Slit_Quadratures``
+    :param int nodes: number of abscissae along the slit (not used by the ``data`` rule)
+    :param int n_threads: number of threads to smear blocks of *q*
+    :return: dictionary with the results and system description
+    :rtype: dict
+    '''
+    if engines is None:
+        engines = sorted(smear.Smearing_Engines.keys())
+    sources = []
+    if bundled:
+        for name, filename in sorted(bundled_datasets().items()):
+            params = fileio_inp.CommandInput().read(filename)
+            q = toolbox.GetDat(params.infile)[0]
+            density = smear.kernel_density(q, params.slitlength)
+            sources.append((name, filename, len(q), False, density))
+    for NumPts in sizes:
+        q, _I, _dI, params = synthetic_dataset(NumPts)
+        density = smear.kernel_density(q, params.slitlength)
+        sources.append(('synthetic_%d' % NumPts, NumPts, NumPts, True, density))
+
+    results = []
+    for name, source, NumPts, synthetic, density in sources:
+        for engine in engines:
+            record = dict(dataset=name, engine=engine, NumPts=NumPts, synthetic=synthetic)
+            M = None if quadrature == 'data' else nodes
+            if estimated_memory(engine, NumPts, M, density) > max_memory:
+                record['error'] = 'skipped: estimated memory'
+            elif engine == 'loop' and NumPts > max_loop_points:
+                record['error'] = 'skipped: too many points for loop'
+            else:
+                args = (source, engine, iterations, quadrature, nodes, n_threads)
+                record.update(run_isolated(_case, args))
+            results.append(record)
+            if not quiet:
+                print(format_result(record))
+
+    report = dict(
+        project = jldesmear.__project__,
+        version = jldesmear.__version__,
+        date = time.strftime('%Y-%m-%d %H:%M:%S'),
+        python = platform.python_version(),
+        numpy = numpy.__version__,
+        platform = platform.platform(),
+        processor = platform.processor(),
+        iterations = iterations,
+        quadrature = quadrature,
+        nodes = nodes,
+        n_threads = n_threads,
+        results = results,
+        scaling = scaling_exponents(results),
+    )
+    return report
+
+
+def format_result(record):
+    '''one line of text describing a benchmark result'''
+    text = '%-16s %7d %-12s' % (record['dataset'], record['NumPts'], record['engine'])
+    if record.get('error') is not None:
+        return text + ' ' + record['error']
+    load = record.get('load')
+    load = '%9.4f' % load if load is not None else '%9s' % '-'
+    text += ' load=%s extrap=%9.6f smear=%9.4f iteration=%9.4f peak=%8.1f MB' % (
+        load, record['extrapolation'], record['smear'],
+        record['iteration'], record['peak_MB'])
+    return text
+
+
+def main(args=None):
+    '''
+    command-line program: run the benchmarks and save the results as JSON
+
+    :param [str] args: command-line arguments (default: ``sys.argv[1:]``)
+    :return: exit status
+    :rtype: int
+    '''
+    doc = 'Benchmark the smearing and desmearing computations'
+    parser = argparse.ArgumentParser(description=doc)
+    parser.add_argument('-o', '--output', default=None,
+                        help='save results to this JSON file')
+    parser.add_argument('-e', '--engines', nargs='+', default=None,
+                        choices=sorted(smear.Smearing_Engines.keys()),
+                        help='smearing engines to benchmark (default: all)')
+    parser.add_argument('-s', '--sizes', nargs='*', type=int, default=list(SYNTHETIC_SIZES),
+                        help='numbers of points of synthetic scans')
+    parser.add_argument('-n', '--iterations', type=int, default=3,
+                        help='desmearing iterations to time')
+    parser.add_argument('--max-memory', type=float, default=2.0, dest='max_memory',
+                        help='skip cases estimated to need more memory (GB)')
+    parser.add_argument('--max-loop-points', type=int, default=5000, dest='max_loop_points',
+                        help='skip loop engine cases with more points')
+    parser.add_argument('-q', '--quadrature', default='data',
+                        choices=sorted(smear.Slit_Quadratures.keys()),
+                        help='integration rule along the slit')
+    parser.add_argument('--nodes', nargs='+', type=int, default=None,
+                        help='number of abscissae along the slit (several with --accuracy)')
+    parser.add_argument('-j', '--threads', type=int, default=1, dest='n_threads',
+                        help='number of threads to smear blocks of Q')
+    parser.add_argument('--accuracy', action='store_true', default=False,
+                        help='report the accuracy of the slit quadratures, rather than timing')
+    parser.add_argument('--loading', action='store_true', default=False,
+                        help='compare the times to read the data files, rather than smearing')
+    parser.add_argument('--no-bundled', action='store_false', dest='bundled', default=True,
+                        help='do not benchmark the datasets in the package data directory')
+    options = parser.parse_args(args)
+
+    if options.accuracy:
+        report = dict(accuracy=accuracy(options.nodes or ACCURACY_NODES))
+    elif options.loading:
+        report = dict(loading=compare_loading())
+    else:
+        nodes = (options.nodes or [64])[0]
+        report = run(options.engines, options.sizes, options.iterations,
+                     options.max_memory * 1e9, options.max_loop_points, options.bundled,
+                     quadrature=options.quadrature, nodes=nodes, n_threads=options.n_threads)
+        for engine, exponent in sorted(report['scaling'].items()):
+            print('scaling exponent, %s: %.2f' % (engine, exponent))
+    if options.output is not None:
+        with open(options.output, 'w') as fp:
+            json.dump(report, fp, indent=2, sort_keys=True)
+        print('results saved in ' + options.output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
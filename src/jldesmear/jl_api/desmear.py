@@ -10,11 +10,17 @@ Source Code Documentation
 '''
 
 
+import copy
+import json
 import math
 import pprint             #@UnusedImport
 import os                 #@UnusedImport
 import sys
 import numpy
+import scipy.linalg
+import scipy.optimize
+import extrapolation
+import kernel_cache
 import smear
 import textplots
 import toolbox
@@ -27,8 +33,319 @@ Weighting_Methods = {
     'fast':       'weight = 2*SQRT(ChiSqr(0) / ChiSqr(i))',
 }
 
+Acceleration_Methods = {
+    'none':       'apply each Lake correction as computed',
+    'anderson':   'Anderson mixing of the last acceleration_depth Lake corrections',
+}
+
+Extrapolation_Updates = {
+    'always':     'refit the extrapolation every iteration',
+    'interval':   'refit the extrapolation every extrap_interval iterations',
+    'tolerance':  'refit when C(q >= sFinal) has moved more than extrap_tolerance since the last fit',
+    'frozen':     'fit the extrapolation only once, at iteration 0',
+}
+
+Stopping_Criteria = {
+    'converged':      'relative change of ChiSqr over the last stop_window iterations < stop_tolerance',
+    'reduced_ChiSqr': 'ChiSqr / (number of points) <= stop_reduced_ChiSqr',
+    'rising':         'ChiSqr increased from the previous iteration',
+}
+
+Desmearing_Methods = {
+    'lake':       'iterative method of Lake (Desmearing)',
+    'direct':     'regularized least squares with the smearing kernel matrix (DirectDesmearing)',
+}
+
+Uncertainty_Methods = {
+    'none':       'dC = dI',
+    'montecarlo': 'dC = standard deviation of C desmeared from mc_replicas resamplings of I +/- dI',
+}
+
+Regularization_Criteria = {
+    'gcv':        'minimum of the generalized cross-validation function',
+    'lcurve':     'corner (largest curvature) of the L-curve',
+}
+
+CHECKPOINT_FORMAT = 1       # change when the state kept by Desmearing.save_state() changes
+CHECKPOINT_EXTENSION = '.ckpt'
+
+# Info attributes that are not desmearing settings, not kept in checkpoints
+UNSAVED_SETTINGS = ('callback', 'extrap', 'fileio_class')
+
+# Info attributes that may differ when a run is resumed from a checkpoint
+RESUME_SETTINGS = ('NumItr', 'stopping', 'stop_window', 'stop_tolerance', 'stop_reduced_ChiSqr',
+                   'quiet', 'n_threads', 'uncertainty', 'mc_replicas', 'mc_seed',
+                   'checkpoint_interval', 'checkpoint_file')
+
+# interpolation of C used by smearing engines that keep a SmearingKernel
+Kernel_Interpolation = {
+    'kernel': 'linear',
+    'cached': 'log',
+    'tiled': 'log',
+}
+
+
+class AndersonMixing(object):
+    '''
+    Anderson acceleration of the Lake iteration
+    
+    The Lake iteration is a fixed-point iteration, :math:`C_{k+1} = g(C_k)`,
+    where :math:`g(C) = C + f(C)` and the correction *f* is ``weight * (I - S)``
+    (for any of the ``Weighting_Methods``).  Anderson mixing
+    keeps the last *depth* iterates and corrections and takes as 
+    the next iterate the combination of the :math:`g(C_i)` that 
+    minimizes the combined correction in a least-squares sense
+    
+    .. math::
+    
+        \gamma = \arg\min \| r_k - \Delta R \gamma \|, \quad
+        C_{k+1} = g(C_k) - \Delta G \gamma
+    
+    where :math:`r = f / C` is the correction relative to *C*
+    (so that all *q* count, whatever their intensity) and the columns of
+    :math:`\Delta R` and :math:`\Delta G` are the differences between
+    successive *r* and :math:`g(C)`.  
+    Since *C* is interpolated in log(C), a combination that is not
+    positive everywhere is not used: the plain Lake update is taken 
+    instead and the history is cleared (also when the correction is not finite).  The history is also cleared 
+    (see :meth:`reset()`) when ChiSqr rises.
+    
+    :param int depth: number of previous corrections to combine
+    '''
+    
+    def __init__(self, depth=5):
+        self.depth = depth
+        self.reset()
+
+    def reset(self):
+        '''forget the previous iterates'''
+        self.G = []     # g(C) of recent iterates
+        self.R = []     # relative corrections of recent iterates
+
+    def update(self, C, correction):
+        '''
+        next iterate
+        
+        :param numpy.ndarray C: current iterate (desmeared intensity)
+        :param numpy.ndarray correction: Lake correction, ``weight * (I - S)``
+        :return: next iterate
+        :rtype: numpy.ndarray
+        '''
+        g = C + correction
+        r = correction / numpy.where(C != 0, numpy.abs(C), 1)
+        if not numpy.all(numpy.isfinite(r)):
+            self.reset()
+            return g
+        self.G = (self.G + [g])[-(self.depth + 1):]
+        self.R = (self.R + [r])[-(self.depth + 1):]
+        if self.depth < 1 or len(self.G) < 2:
+            return g
+        dG = numpy.diff(numpy.array(self.G), axis=0).T
+        dR = numpy.diff(numpy.array(self.R), axis=0).T
+        gamma = numpy.linalg.lstsq(dR, r, rcond=-1)[0]
+        C_next = g - dG.dot(gamma)
+        if not numpy.all(C_next > 0):
+            self.reset()
+            return g
+        return C_next
+
+
+def make_kernel(q, params, engine, analytic_tail):
+    '''
+    smearing kernel for the desmearing parameters
+    
+    Taken from (or saved in) the persistent kernel cache
+    (:class:`~jldesmear.jl_api.kernel_cache.KernelCache`) 
+    when ``params.kernel_cache_dir`` is given.
+    
+    :param numpy.ndarray q: magnitude of scattering vector
+    :param obj params: Info object with desmearing parameters
+    :param str engine: ``kernel``, ``cached``, or ``tiled``
+    :param bool analytic_tail: integrate linear extrapolations exactly beyond qMax
+    :return: :class:`smear.SmearingKernel` object
+    '''
+    p = params
+    build = smear.make_kernel
+    if p.kernel_cache_dir is not None:
+        build = kernel_cache.KernelCache(p.kernel_cache_dir, p.kernel_cache_MB).kernel
+    return build(engine, q, p.slitlength, p.sFinal, 
+                 block_size=p.smear_block_size,
+                 quadrature=p.slit_quadrature,
+                 nodes=p.slit_nodes,
+                 analytic_tail=analytic_tail,
+                 storage=p.kernel_storage,
+                 cache_MB=p.smear_cache_MB)
+
+
+def accelerator(mixing, params, ChiSqr):
+    '''
+    Anderson mixing for the next iteration
+    
+    :param obj mixing: :class:`AndersonMixing` object (or None) used so far
+    :param obj params: Info object with desmearing parameters
+    :param [float] ChiSqr: ChiSqr vs. iterations
+    :return: *mixing*, cleared if ChiSqr has risen, 
+        or a new :class:`AndersonMixing` object
+    '''
+    if mixing is None or mixing.depth != params.acceleration_depth:
+        return AndersonMixing(params.acceleration_depth)
+    if len(ChiSqr) > 1 and ChiSqr[-1] > ChiSqr[-2]:
+        mixing.reset()
+    return mixing
+
+
+def stopping_criterion(params, ChiSqr, NumPts):
+    '''
+    test a ChiSqr history against the ``params.stopping`` criteria
+    
+    :param obj params: Info object with desmearing parameters
+    :param [float] ChiSqr: ChiSqr vs. iterations
+    :param int NumPts: number of data points
+    :return: name of the first criterion met (from ``Stopping_Criteria``) or None
+    :rtype: str
+    '''
+    for criterion in params.stopping:
+        if criterion not in Stopping_Criteria:
+            msg = "stopping criteria must be from " + str(sorted(Stopping_Criteria.keys()))
+            msg += ", got " + str(criterion)
+            raise ValueError, msg
+    if 'reduced_ChiSqr' in params.stopping:
+        if ChiSqr[-1] / NumPts <= params.stop_reduced_ChiSqr:
+            return 'reduced_ChiSqr'
+    if 'rising' in params.stopping and len(ChiSqr) > 1:
+        if ChiSqr[-1] > ChiSqr[-2]:
+            return 'rising'
+    if 'converged' in params.stopping and len(ChiSqr) > params.stop_window:
+        change = abs(ChiSqr[-1-params.stop_window] - ChiSqr[-1]) / ChiSqr[-1]
+        if change < params.stop_tolerance:
+            return 'converged'
+    return None
+
+
+def refit_due(params, iteration, last_fit, C_tail, C_tail_at_fit):
+    '''
+    Is it time to refit the extrapolation, according to ``params.extrap_update``?
+    
+    :param obj params: Info object with desmearing parameters
+    :param int iteration: iteration about to be computed
+    :param int last_fit: iteration at which the extrapolation was last fitted
+    :param numpy.ndarray C_tail: current C in the fit range (q > sFinal)
+    :param numpy.ndarray C_tail_at_fit: C in the fit range at the last fit
+    :rtype: bool
+    '''
+    policy = params.extrap_update
+    if policy not in Extrapolation_Updates:
+        msg = "extrap_update must be one of " + str(sorted(Extrapolation_Updates.keys()))
+        msg += ", got " + str(policy)
+        raise ValueError, msg
+    if policy == 'always':
+        return True
+    if policy == 'interval':
+        return iteration - last_fit >= max(1, params.extrap_interval)
+    if policy == 'tolerance':
+        # relative change, without dividing by zero where C was zero at the fit
+        change = numpy.abs(C_tail - C_tail_at_fit)
+        return bool(numpy.any(change > params.extrap_tolerance * numpy.abs(C_tail_at_fit)))
+    return False        # frozen
+
 
-class Desmearing():
+def info_settings(params):
+    '''
+    desmearing parameters that can be saved, by name
+    
+    :param obj params: Info object with desmearing parameters
+    :return: all attributes of *params* but those in ``UNSAVED_SETTINGS``
+    :rtype: dict
+    '''
+    settings = {}
+    for key in dir(params):
+        value = getattr(params, key)
+        if key.startswith('_') or key in UNSAVED_SETTINGS or callable(value):
+            continue
+        settings[key] = value
+    return settings
+
+
+def extrapolation_state(extrap):
+    '''
+    name and coefficients of a fitted extrapolation
+    
+    :param obj extrap: fitted extrapolation function object (or None)
+    :rtype: dict
+    '''
+    if extrap is None:
+        return None
+    return dict(name=extrap.name, coefficients=extrap.coefficients)
+
+
+def restore_extrapolation(state):
+    '''
+    fitted extrapolation function object from :func:`extrapolation_state()`
+    '''
+    if state is None:
+        return None
+    extrap = extrapolation.discover_extrapolations()[state['name']]()
+    extrap.coefficients = dict(state['coefficients'])
+    return extrap
+
+
+def checkpoint_filename(params):
+    '''
+    name of the checkpoint file: ``params.checkpoint_file`` 
+    or the output file name with extension ``CHECKPOINT_EXTENSION``
+    '''
+    if params.checkpoint_file:
+        return params.checkpoint_file
+    return os.path.splitext(params.outfile)[0] + CHECKPOINT_EXTENSION
+
+
+def resume_desmearing(q, I, dI, params):
+    '''
+    desmearing object for the data, resumed from its checkpoint if there is one
+    
+    The checkpoint (see :func:`checkpoint_filename()`) is used if
+    ``params.checkpoint_interval`` is not zero, the checkpoint
+    has the same data *(q, I, dI)*, and it was made with the same desmearing
+    parameters (apart from those in ``RESUME_SETTINGS``, such as *NumItr*).
+    
+    :param obj params: Info object with desmearing parameters
+    :return: :class:`Desmearing` object (or as :func:`new_desmearing()`)
+    '''
+    filename = checkpoint_filename(params)
+    if params.checkpoint_interval and params.desmear_method == 'lake' \
+       and os.path.exists(filename):
+        try:
+            dsm = Desmearing.load_state(filename)
+        except (IOError, ValueError, KeyError):
+            dsm = None          # not a usable checkpoint, start again
+        if dsm is not None:
+            saved = info_settings(dsm.params)
+            current = info_settings(params)
+            for key in RESUME_SETTINGS:
+                saved.pop(key, None)
+                current.pop(key, None)
+            same_data = all([numpy.array_equal(a, b) for a, b in 
+                             ((dsm.q, q), (dsm.I, I), (dsm.dI, dI))])
+            if same_data and saved == current:
+                dsm.params = params
+                dsm.SetExtrap(dsm.extrap)
+                dsm.stop_reason = None
+                return dsm
+    return new_desmearing(q, I, dI, params)
+
+
+def checkpoint_due(dsm):
+    '''
+    Is it time for an automatic checkpoint (every ``params.checkpoint_interval`` iterations)?
+    
+    :param obj dsm: :class:`Desmearing` object
+    :rtype: bool
+    '''
+    interval = dsm.params.checkpoint_interval
+    return bool(interval) and isinstance(dsm, Desmearing) and dsm.iteration_count % interval == 0
+
+
+class Desmearing(object):
     ''' 
     desmear the 1-D SAS data *(q, I, dI)* by method of Jemian/Lake
     
@@ -50,6 +367,8 @@ class Desmearing():
        Alternative feedback methods are available
        (see :func:`SetLakeWeighting`).
        It is suggested to **always** use the fast method.
+       Any of them may be accelerated by Anderson mixing
+       (``params.acceleration``, see :class:`AndersonMixing`).
 
     '''
     
@@ -58,6 +377,7 @@ class Desmearing():
         self.q = q
         self.I = I
         self.dI = dI
+        self.kernel = None
         self.first_step()
 
     def first_step(self):
@@ -89,10 +409,15 @@ class Desmearing():
         self.S = 1+numpy.zeros( (n,) )      # smeared intensity from most recent C +/- dC
         self.z = numpy.zeros( (n,) )        # standardized residuals
         self.ChiSqr = []                    # ChiSqr vs. iterations
+        self.extrap = None                  # fitted extrapolation, see Extrapolation_Updates
+        self.extrap_fits = []               # iterations at which the extrapolation was fitted
+        self._extrap_C = None               # C(q >= sFinal) at the most recent fit
+        self.accelerator = None             # AndersonMixing, see Acceleration_Methods
         self._smear()
         self.z = (self.S - self.I) / self.dI
         self.ChiSqr.append( numpy.sum(self.z*self.z) )
         self.iteration_count = len(self.ChiSqr)-1
+        self.stop_reason = None             # why the iterations stopped
 
     def traditional(self):
         '''
@@ -114,8 +439,37 @@ class Desmearing():
             quit_requested = False
             if self.params.callback != None:
                 quit_requested = self.params.callback(self)
-            more_steps = self.params.moreIterationsOk(self.iteration_count)
-            done = quit_requested or not more_steps
+                if quit_requested:
+                    self.stop_reason = 'callback'
+            done = quit_requested or not self.more_iterations_ok()
+
+    def more_iterations_ok(self):
+        '''
+        Is it OK to take more iterations?
+        
+        Stops at ``params.NumItr`` iterations or when one of the
+        ``params.stopping`` criteria (see ``Stopping_Criteria``) is met.
+        The reason for stopping is recorded in ``self.stop_reason``.
+        
+        :rtype: bool
+        '''
+        if not self.params.moreIterationsOk(self.iteration_count):
+            self.stop_reason = 'NumItr'
+            return False
+        reason = self.converged()
+        if reason is not None:
+            self.stop_reason = reason
+            return False
+        return True
+
+    def converged(self):
+        '''
+        test the ChiSqr history against the ``params.stopping`` criteria
+        
+        :return: name of the first criterion met or None
+        :rtype: str
+        '''
+        return stopping_criterion(self.params, self.ChiSqr, len(self.q))
 
     def iteration(self):
         '''
@@ -153,13 +507,73 @@ class Desmearing():
                 self.params.extrapname, 
                 self.params.sFinal, 
                 self.params.slitlength, 
-                self.params.quiet
+                self.params.quiet,
+                engine = self.params.smear_engine,
+                kernel = self._get_kernel(),
+                block_size = self.params.smear_block_size,
+                extrap = self._fit_extrapolation(),
+                quadrature = self.params.slit_quadrature,
+                nodes = self.params.slit_nodes,
+                analytic_tail = self.params.analytic_tail,
+                storage = self.params.kernel_storage,
+                cache_MB = self.params.smear_cache_MB,
+                n_threads = self.params.n_threads,
             )
-            # TODO: this interface looks inefficient now, unless extrap could change each iteration (?possible new feature?)
             self.SetExtrap(extrap)
         except:
             raise Exception, "Smearing failed: " + str(sys.exc_info())
 
+    def _fit_extrapolation(self):
+        '''
+        fit the extrapolation to the current C, as directed by ``params.extrap_update``
+        
+        The fitted extrapolation is kept in ``self.extrap`` and reused
+        for iterations where no new fit is needed.
+        
+        :return: fitted extrapolation function object
+        '''
+        p = self.params
+        iteration = len(self.ChiSqr)        # iteration about to be computed
+        start = smear.fit_range_start(self.q, p.sFinal)
+        C_tail = self.C[start:]
+        if self.extrap is None:
+            refit = True
+        else:
+            refit = refit_due(p, iteration, self.extrap_fits[-1], C_tail, self._extrap_C)
+
+        if refit:
+            self.extrap = smear.prepare_extrapolation(
+                self.q, self.C, self.dC, 
+                p.extrapname, 
+                p.sFinal)
+            self.extrap_fits.append(iteration)
+            self._extrap_C = numpy.array(C_tail)
+        return self.extrap
+
+    def _get_kernel(self):
+        '''
+        smearing kernel for the ``kernel``, ``cached``, and ``tiled`` engines, 
+        computed once and kept while q, slitlength, and sFinal are unchanged
+        (the ``tiled`` engine keeps its tiles from one iteration to the next)
+        
+        :return: :class:`smear.SmearingKernel` object or None
+        '''
+        p = self.params
+        interpolation = Kernel_Interpolation.get(p.smear_engine)
+        if interpolation is None:
+            return None
+        tiled = p.smear_engine == 'tiled'
+        analytic_tail = p.analytic_tail and not tiled
+        if self.kernel is None \
+           or isinstance(self.kernel, smear.TiledKernel) != tiled \
+           or not self.kernel.agrees(self.q, p.slitlength, p.sFinal, 
+                                     interpolation=interpolation,
+                                     quadrature=p.slit_quadrature,
+                                     nodes=p.slit_nodes,
+                                     analytic_tail=analytic_tail):
+            self.kernel = make_kernel(self.q, p, p.smear_engine, analytic_tail)
+        return self.kernel
+
     def _refine_desmeared(self):
         '''
         calculate the next desmeared intensity
@@ -174,7 +588,95 @@ class Desmearing():
             weight = self.C / self.S
         
         # apply the weight to get the corrected terms
-        self.C += weight * (self.I - self.S)
+        correction = weight * (self.I - self.S)
+        if self.params.acceleration == 'anderson':
+            self.accelerator = accelerator(self.accelerator, self.params, self.ChiSqr)
+            self.C = self.accelerator.update(self.C, correction)
+        else:
+            self.C += correction
+
+    def save_state(self, filename):
+        '''
+        write a checkpoint: everything needed to continue the iterations
+        
+        The checkpoint is a NumPy ``.npz`` file with the data, C, dC, S, z,
+        the ChiSqr history, the history of the Anderson mixing,
+        and (as JSON) the fitted extrapolation and the desmearing parameters
+        (all but the callback).  It is written to a temporary file 
+        that is then renamed, so an interrupted write leaves the previous
+        checkpoint in place.
+        
+        :param str filename: name of the checkpoint file
+        '''
+        state = dict(
+            format = CHECKPOINT_FORMAT,
+            iteration_count = self.iteration_count,
+            stop_reason = self.stop_reason,
+            extrap_fits = self.extrap_fits,
+            extrap = extrapolation_state(self.extrap),
+            acceleration_depth = None,
+            settings = info_settings(self.params),
+        )
+        arrays = dict(q=self.q, I=self.I, dI=self.dI, 
+                      C=self.C, dC=self.dC, S=self.S, z=self.z,
+                      ChiSqr=numpy.array(self.ChiSqr))
+        if self._extrap_C is not None:
+            arrays['extrap_C'] = self._extrap_C
+        if self.accelerator is not None:
+            state['acceleration_depth'] = self.accelerator.depth
+            NumPts = len(self.q)
+            arrays['anderson_G'] = numpy.reshape(self.accelerator.G, (-1, NumPts))
+            arrays['anderson_R'] = numpy.reshape(self.accelerator.R, (-1, NumPts))
+        arrays['state'] = numpy.array(json.dumps(state, sort_keys=True))
+        temporary = filename + '.tmp'
+        with open(temporary, 'wb') as fp:
+            numpy.savez(fp, **arrays)
+        if os.path.exists(filename) and sys.platform == 'win32':
+            os.remove(filename)         # rename does not replace a file on Windows
+        os.rename(temporary, filename)
+
+    @classmethod
+    def load_state(cls, filename, params=None):
+        '''
+        continue from a checkpoint written by :meth:`save_state()`
+        
+        The next :meth:`iteration()` gives exactly the result 
+        it would have given in the run that wrote the checkpoint.
+        
+        :param str filename: name of the checkpoint file
+        :param obj params: Info object with desmearing parameters
+            (default: the parameters saved in the checkpoint, with no callback)
+        :return: Desmearing object
+        '''
+        with open(filename, 'rb') as fp:
+            arrays = dict(numpy.load(fp).items())
+        state = json.loads(str(arrays['state']))
+        if state.get('format') != CHECKPOINT_FORMAT:
+            raise ValueError, "unknown checkpoint format in " + filename
+        if params is None:
+            params = info.Info()
+            for key, value in state['settings'].items():
+                setattr(params, key, value)
+            params.stopping = tuple(params.stopping)
+
+        self = cls.__new__(cls)
+        self.params = params
+        self.q, self.I, self.dI = arrays['q'], arrays['I'], arrays['dI']
+        self.kernel = None
+        self.C, self.dC, self.S, self.z = arrays['C'], arrays['dC'], arrays['S'], arrays['z']
+        self.ChiSqr = list(arrays['ChiSqr'])
+        self.iteration_count = state['iteration_count']
+        self.stop_reason = state['stop_reason']
+        self.extrap = restore_extrapolation(state['extrap'])
+        self.extrap_fits = state['extrap_fits']
+        self._extrap_C = arrays.get('extrap_C')
+        self.accelerator = None
+        if state['acceleration_depth'] is not None:
+            self.accelerator = AndersonMixing(state['acceleration_depth'])
+            self.accelerator.G = list(arrays['anderson_G'])
+            self.accelerator.R = list(arrays['anderson_R'])
+        self.SetExtrap(self.extrap)
+        return self
 
     def SetExtrap(self, extrapolation_object = None):
         '''
@@ -205,6 +707,447 @@ class Desmearing():
         self.params.quiet = suppress_output
 
 
+class BatchDesmearing(object):
+    '''
+    desmear many 1-D SAS datasets that share the same *q* and slit length
+    
+    The datasets (a time series or a sample-changer run, for example)
+    are held as 2-D arrays, ``(number of datasets, number of q)``, 
+    and each Lake iteration is computed for all datasets at once
+    using one :class:`~jldesmear.jl_api.smear.SmearingKernel`
+    (interpolation between data points is log-linear, as in 
+    :func:`~jldesmear.jl_api.smear.get_Ic()`, with the ``cached`` 
+    and ``tiled`` engines).  The ``cached`` engine, without an analytic tail,
+    stands in for engines that keep no kernel (``loop`` and ``vectorized``),
+    so one row gives the same result as :class:`Desmearing`.
+    Each dataset has its own extrapolation (``self.extrap[i]``),
+    ChiSqr history (``self.ChiSqr[i]``), and iteration count.
+    A dataset stops updating when it reaches ``params.NumItr`` iterations
+    or meets one of the ``params.stopping`` criteria (``self.active[i]`` is then False).
+    
+    :param numpy.ndarray q: magnitude of scattering vector, shared by all datasets
+    :param numpy.ndarray I: SAS data I(q), one row per dataset
+    :param numpy.ndarray dI: estimated uncertainties of I(q), one row per dataset
+    :param obj params: Info object with desmearing parameters (shared by all datasets)
+    '''
+    
+    def __init__(self, q, I, dI, params):
+        self.params = params
+        self.q = numpy.array(q, dtype=float)
+        self.I = numpy.atleast_2d(numpy.array(I, dtype=float))
+        self.dI = numpy.atleast_2d(numpy.array(dI, dtype=float))
+        if self.I.shape != self.dI.shape or self.I.shape[1] != len(self.q):
+            raise ValueError, "I and dI must be arrays of shape (number of datasets, number of q)"
+        p = params
+        if p.smear_engine in Kernel_Interpolation:
+            self.kernel = make_kernel(self.q, p, p.smear_engine, p.analytic_tail)
+        else:
+            # the same operator as get_Ic(): log-linear interpolation, no analytic tail
+            self.kernel = make_kernel(self.q, p, 'cached', False)
+        self.first_step()
+
+    def first_step(self):
+        '''
+        the first step: assume C = I for all datasets, smear, and compute ChiSqr
+        '''
+        n = self.I.shape[0]
+        self.C = numpy.array(self.I)        # desmeared intensities after current iteration
+        self.dC = numpy.array(self.dI)      # estimated uncertainties of C
+        self.S = numpy.ones_like(self.I)    # smeared intensities from most recent C
+        self.z = numpy.zeros_like(self.I)   # standardized residuals
+        self.ChiSqr = [[] for _ in range(n)]    # ChiSqr vs. iterations, for each dataset
+        self.iteration_count = numpy.zeros((n,), dtype=int)
+        self.active = numpy.ones((n,), dtype=bool)  # datasets still iterating
+        self.stop_reason = [None] * n
+        self.extrap = [None] * n
+        self.extrap_fits = [[] for _ in range(n)]
+        self._extrap_C = [None] * n
+        self.accelerator = [None] * n       # AndersonMixing of each dataset
+        self._update(numpy.arange(n))
+
+    def traditional(self):
+        '''iterate until every dataset has stopped'''
+        if max(self.iteration_count) > 0:
+            self.first_step()
+        while self.more_iterations_ok():
+            self.iteration()
+
+    def more_iterations_ok(self):
+        '''
+        Check each active dataset against ``params.NumItr`` 
+        and the ``params.stopping`` criteria, deactivating those that are done.
+        
+        :return: Is it OK to take more iterations for any dataset?
+        :rtype: bool
+        '''
+        for i in numpy.flatnonzero(self.active):
+            reason = None
+            if not self.params.moreIterationsOk(self.iteration_count[i]):
+                reason = 'NumItr'
+            else:
+                reason = stopping_criterion(self.params, self.ChiSqr[i], len(self.q))
+            if reason is not None:
+                self.stop_reason[i] = reason
+                self.active[i] = False
+        return self.active.any()
+
+    def iteration(self):
+        '''
+        Compute one iteration of the Lake algorithm for all active datasets.
+        '''
+        rows = numpy.flatnonzero(self.active)
+        if rows.size == 0:
+            return
+        self._refine_desmeared(rows)
+        self._update(rows)
+
+    def _update(self, rows):
+        '''smear C and compute residuals and ChiSqr for the given datasets'''
+        extraps = [self._fit_extrapolation(i) for i in rows]
+        self.S[rows] = self.kernel.smear_many(self.C[rows], extraps, self.params.n_threads)
+        self.z[rows] = (self.S[rows] - self.I[rows]) / self.dI[rows]
+        chisqr = numpy.sum(self.z[rows]**2, axis=1)
+        for i, value in zip(rows, chisqr):
+            self.ChiSqr[i].append(value)
+            self.iteration_count[i] = len(self.ChiSqr[i]) - 1
+
+    def _fit_extrapolation(self, i):
+        '''
+        fit the extrapolation of dataset *i*, as directed by ``params.extrap_update``
+        
+        :return: fitted extrapolation function object
+        '''
+        p = self.params
+        iteration = len(self.ChiSqr[i])        # iteration about to be computed
+        start = smear.fit_range_start(self.q, p.sFinal)
+        C_tail = self.C[i, start:]
+        if self.extrap[i] is None:
+            refit = True
+        else:
+            refit = refit_due(p, iteration, self.extrap_fits[i][-1], C_tail, self._extrap_C[i])
+        if refit:
+            self.extrap[i] = smear.prepare_extrapolation(
+                self.q, self.C[i], self.dC[i], 
+                p.extrapname, 
+                p.sFinal)
+            self.extrap_fits[i].append(iteration)
+            self._extrap_C[i] = numpy.array(C_tail)
+        return self.extrap[i]
+
+    def _refine_desmeared(self, rows):
+        '''
+        calculate the next desmeared intensities of the given datasets
+        from their current desmeared and smeared intensities
+        '''
+        C = self.C[rows]
+        S = self.S[rows]
+        if self.params.LakeWeighting == "constant":
+            weight = numpy.ones_like(C)
+        elif self.params.LakeWeighting == "ChiSqr":
+            ratio = numpy.array([self.ChiSqr[i][0]/self.ChiSqr[i][-1] for i in rows])
+            weight = 2*numpy.sqrt(ratio)[:, None] * numpy.ones_like(C)
+        elif self.params.LakeWeighting == "fast":
+            weight = C / S
+        correction = weight * (self.I[rows] - S)
+        if self.params.acceleration == 'anderson':
+            for j, i in enumerate(rows):
+                self.accelerator[i] = accelerator(self.accelerator[i], self.params, self.ChiSqr[i])
+                C[j] = self.accelerator[i].update(C[j], correction[j])
+            self.C[rows] = C
+        else:
+            self.C[rows] = C + correction
+
+
+class DirectDesmearing(object):
+    '''
+    desmear the 1-D SAS data *(q, I, dI)* by regularized least squares
+    
+    Apart from the extrapolation, slit smearing is linear in *C*.
+    With the matrix *K* of the ``kernel`` smearing engine 
+    (:class:`~jldesmear.jl_api.smear.SmearingKernel`, 
+    linear interpolation between data points), 
+    the smeared intensity is :math:`S = K C + t`, where *t* is the
+    smearing of the extrapolation.  For extrapolations that are linear
+    in their coefficients (those with a ``basis``, such as ``constant``,
+    ``linear``, and ``Porod``), the coefficients fitted to *C* are 
+    :math:`c = P C` and :math:`t = T c` (see ``SmearingKernel.tail_matrix()``)
+    so that :math:`S = (K + T P) C` is linear in *C*.  
+    For other extrapolations, *t* is that of the extrapolation
+    fitted to the measured data and is held fixed.
+    *C* is then found directly by minimizing
+    
+    .. math::
+    
+        \chi^2 + \lambda^2 \| L x \|^2, \quad x = C / I
+    
+    where *L* is the second difference (so that the ratio of the desmeared
+    to the smeared intensity is smooth) and the weight
+    :math:`\lambda` is chosen by one of the ``Regularization_Criteria``
+    (``params.regularization``) unless given (``params.regularization_weight``).
+    The generalized eigenvectors of :math:`(A^T A, L^T L)`, with 
+    :math:`A = (K + T P) I / dI`, are computed once so that the solution, 
+    the criterion, and the uncertainties *dC* of each :math:`\lambda`
+    are inexpensive.  If ``params.direct_nonnegative`` and the solution
+    is not positive everywhere, it is found again by non-negative 
+    least squares (``scipy.optimize.nnls``) with the same :math:`\lambda`.
+    
+    The solution is the single iteration.  *C*, *dC*, *S*, *z*, *ChiSqr*, 
+    and *iteration_count* have the same meaning as in :class:`Desmearing`.
+    The work and memory grow as N^3 and N^2, so this is
+    practical for up to a few thousand points.
+    
+    :param numpy.ndarray q: magnitude of scattering vector
+    :param numpy.ndarray I: SAS data I(q) +/- dI(q)
+    :param numpy.ndarray dI: estimated uncertainties of I(q)
+    :param obj params: Info object with desmearing parameters
+    '''
+    
+    def __init__(self, q, I, dI, params):
+        self.params = params
+        self.q = numpy.array(q, dtype=float)
+        self.I = numpy.array(I, dtype=float)
+        self.dI = numpy.array(dI, dtype=float)
+        self.kernel = make_kernel(self.q, params, 'kernel', True)
+        self.first_step()
+        self._decompose()
+
+    def first_step(self):
+        '''
+        the first step: assume C = I, smear, and compute ChiSqr
+        '''
+        self.C = numpy.array(self.I)        # desmeared intensity after current iteration
+        self.dC = numpy.array(self.dI)      # estimated uncertainty of C
+        self.ChiSqr = []                    # ChiSqr vs. iterations
+        self.extrap_fits = []               # iterations at which the extrapolation was fitted
+        self.regularization_weight = None   # lambda of the solution
+        self.criterion = None               # (lambda, criterion) used to choose lambda
+        self.stop_reason = None
+        self._smear()
+
+    def _extrapolation_operator(self):
+        '''
+        *P*, such that the coefficients of the extrapolation fitted to *C* are ``P C``
+        
+        :return: *P*, shape ``(len(extrap.basis), len(q))``, 
+            or None if the extrapolation is not linear in its coefficients
+        '''
+        if self.extrap.basis is None:
+            return None
+        NumPts = len(self.q)
+        start = smear.fit_range_start(self.q, self.params.sFinal)
+        P = numpy.zeros((len(self.extrap.basis), NumPts))
+        for j in range(start, NumPts - 1):      # same range as smear.prepare_extrapolation()
+            unit = numpy.zeros((NumPts,))
+            unit[j] = 1
+            extrap = self.extrap.__class__()
+            extrap.fit(self.q[start:-1], unit[start:-1], self.dI[start:-1])
+            P[:, j] = extrap.coefficient_vector()
+        return P
+
+    def _decompose(self):
+        '''generalized eigenvectors of the normal equations and the regularization'''
+        K = self.kernel.matrix
+        if self.kernel.sparse:
+            K = K.toarray()
+        P = self._extrapolation_operator()
+        self.linear = P is not None
+        if self.linear:
+            K = K + self.kernel.tail_matrix(self.extrap).dot(P)
+        NumPts = len(self.q)
+        self.scale = numpy.where(self.I != 0, numpy.abs(self.I), self.dI)    # C = scale * x
+        self.A = K * self.scale[None, :] / self.dI[:, None]
+        L = numpy.diff(numpy.eye(NumPts), 2, axis=0)
+        M = L.T.dot(L) + 1e-8 * numpy.eye(NumPts)
+        self.R = scipy.linalg.cholesky(M)       # M = R^T R
+        s, self.V = scipy.linalg.eigh(self.A.T.dot(self.A), M)
+        self.s = numpy.clip(s, 0, None)
+        self.tail = 0
+        if not self.linear:
+            self.tail = self.S - self.kernel.matrix.dot(self.C)     # smeared extrapolation
+
+    def traditional(self):
+        '''solve'''
+        if len(self.ChiSqr) > 1:
+            self.first_step()
+        while self.more_iterations_ok():
+            self.iteration()
+
+    def more_iterations_ok(self):
+        '''
+        Is it OK to take more iterations?  (Only until solved.)
+        
+        :rtype: bool
+        '''
+        if self.iteration_count > 0:
+            self.stop_reason = 'solved'
+            return False
+        return True
+
+    def iteration(self):
+        '''
+        Solve for C
+        '''
+        b = (self.I - self.tail) / self.dI
+        x, variance = self._solve(b)
+        self.C = self.scale * x
+        self.dC = self.scale * numpy.sqrt(variance)
+        self._smear()
+
+    def _smear(self):
+        '''fit the extrapolation to C, smear C, and compute residuals and ChiSqr'''
+        p = self.params
+        self.extrap = smear.prepare_extrapolation(self.q, self.C, self.dC, p.extrapname, p.sFinal)
+        self.extrap_fits.append(len(self.ChiSqr))
+        p.extrap = self.extrap
+        self.S = self.kernel.smear(self.C, self.extrap)
+        self.z = (self.S - self.I) / self.dI
+        self.ChiSqr.append(numpy.sum(self.z*self.z))
+        self.iteration_count = len(self.ChiSqr) - 1
+
+    def _solve(self, b):
+        '''
+        regularized solution for the weighted data *b*
+        
+        :return: (x, variance of x)
+        '''
+        p = self.params
+        s, V = self.s, self.V
+        beta = V.T.dot(self.A.T.dot(b))
+        if p.regularization_weight is not None:
+            lam2 = float(p.regularization_weight)**2
+        else:
+            lambdas, values = regularization_criterion(s, beta, b.dot(b), p.regularization)
+            self.criterion = (lambdas, values)
+            if p.regularization == 'lcurve':
+                lam2 = lambdas[numpy.argmax(values)]**2
+            else:
+                lam2 = lambdas[numpy.argmin(values)]**2
+        self.regularization_weight = math.sqrt(lam2)
+        x = V.dot(beta / (s + lam2))
+        variance = (V*V).dot(s / (s + lam2)**2)
+        if p.direct_nonnegative and not numpy.all(x > 0):
+            A = numpy.vstack((self.A, self.regularization_weight * self.R))
+            x = scipy.optimize.nnls(A, numpy.concatenate((b, numpy.zeros_like(b))))[0]
+        return x, variance
+
+
+def regularization_criterion(s, beta, bb, criterion='gcv', points=121):
+    '''
+    criterion for choosing the regularization weight
+    
+    For the generalized eigenvalues *s* of :math:`(A^T A, L^T L)` and 
+    :math:`\beta = V^T A^T b`, the solution for each :math:`\lambda` is
+    :math:`x = V \beta / (s + \lambda^2)`.  Its residual and
+    regularization norms follow without computing *x*.
+    
+    :param numpy.ndarray s: generalized eigenvalues
+    :param numpy.ndarray beta: :math:`V^T A^T b`
+    :param float bb: :math:`b^T b`
+    :param str criterion: one of the keys of ``Regularization_Criteria``
+    :param int points: number of weights, evenly spaced in log
+    :return: (lambda, criterion): ``gcv`` is to be minimized, ``lcurve`` (curvature) maximized
+    :rtype: (numpy.ndarray, numpy.ndarray)
+    '''
+    if criterion not in Regularization_Criteria:
+        msg = "regularization must be one of " + str(sorted(Regularization_Criteria.keys()))
+        raise ValueError, msg + ", got " + str(criterion)
+    top = math.log10(max(s.max(), sys.float_info.min))
+    lam2 = numpy.logspace(top - 14, top, points)
+    denominator = s[:, None] + lam2[None, :]
+    residual = bb - numpy.sum(beta[:, None]**2 * (2 * denominator - s[:, None]) / denominator**2, axis=0)
+    residual = numpy.clip(residual, bb * 1e-15, None)
+    if criterion == 'gcv':
+        dof = len(s) - numpy.sum(s[:, None] / denominator, axis=0)
+        values = residual / numpy.clip(dof, 1e-12, None)**2
+    else:
+        # curvature of the L-curve, (log residual norm, log regularization norm)
+        penalty = numpy.sum((beta[:, None] / denominator)**2, axis=0)
+        t = numpy.log(lam2)
+        rho, eta = numpy.log(residual), numpy.log(penalty)
+        drho, deta = numpy.gradient(rho, t), numpy.gradient(eta, t)
+        d2rho, d2eta = numpy.gradient(drho, t), numpy.gradient(deta, t)
+        values = (drho * d2eta - d2rho * deta) / numpy.clip(drho**2 + deta**2, 1e-300, None)**1.5
+    return numpy.sqrt(lam2), values
+
+
+def new_desmearing(q, I, dI, params):
+    '''
+    desmearing object for ``params.desmear_method`` (see ``Desmearing_Methods``)
+    
+    :return: :class:`Desmearing` or :class:`DirectDesmearing` object
+    '''
+    if params.desmear_method not in Desmearing_Methods:
+        msg = "desmear_method must be one of " + str(sorted(Desmearing_Methods.keys()))
+        raise ValueError, msg + ", got " + str(params.desmear_method)
+    if params.desmear_method == 'direct':
+        return DirectDesmearing(q, I, dI, params)
+    return Desmearing(q, I, dI, params)
+
+
+def check_iterations(params):
+    '''
+    raise ValueError if desmearing with *params* would iterate without end
+    
+    Without a number of iterations (``params.NumItr`` is 
+    ``info.INFINITE_ITERATIONS``), the Lake iteration needs at least one
+    of the ``params.stopping`` criteria.  (The ``direct`` method always ends.)
+    
+    :param obj params: Info object with desmearing parameters
+    '''
+    if params.desmear_method == 'direct':
+        return
+    if params.NumItr == info.INFINITE_ITERATIONS and len(params.stopping) == 0:
+        raise ValueError, "no number of iterations and no stopping criteria, desmearing would not end"
+
+
+def monte_carlo_uncertainty(dsm, replicas=None, seed=None):
+    '''
+    estimate the uncertainties of the desmeared intensities by resampling
+    
+    The measured intensities are resampled *replicas* times from 
+    normal distributions, *I +/- dI*, and each replica is desmeared
+    with the same parameters and number of iterations as *dsm*.
+    ``dsm.dC`` is replaced by the standard deviation of the
+    replicas at each *q*.  All replicas are desmeared at once, as the rows
+    of a 2-D problem: by :class:`BatchDesmearing`, with the same smearing operator
+    as *dsm*, for :class:`Desmearing` or by the regularized solution, with the same weight,
+    for :class:`DirectDesmearing`.
+    
+    :param obj dsm: :class:`Desmearing` or :class:`DirectDesmearing` object, after the final iteration
+    :param int replicas: number of replicas (default: ``params.mc_replicas``)
+    :param int seed: seed of the random numbers (default: ``params.mc_seed``)
+    :return: dC
+    :rtype: numpy.ndarray
+    '''
+    p = dsm.params
+    if replicas is None:
+        replicas = p.mc_replicas
+    if seed is None:
+        seed = p.mc_seed
+    if replicas < 2:
+        raise ValueError, "at least 2 replicas are needed, got " + str(replicas)
+    I = numpy.array(dsm.I, dtype=float)
+    dI = numpy.array(dsm.dI, dtype=float)
+    random = numpy.random.RandomState(seed)
+    I_replicas = I + dI * random.standard_normal((replicas, len(I)))
+
+    if isinstance(dsm, DirectDesmearing):
+        b = (I_replicas - dsm.tail) / dI
+        lam2 = dsm.regularization_weight**2
+        beta = dsm.A.dot(dsm.V).T.dot(b.T)
+        C = (dsm.scale[:, None] * dsm.V.dot(beta / (dsm.s + lam2)[:, None])).T
+    else:
+        params = copy.copy(p)
+        params.NumItr = dsm.iteration_count
+        params.stopping = ()
+        params.callback = None
+        batch = BatchDesmearing(dsm.q, I_replicas, numpy.resize(dI, I_replicas.shape), params)
+        batch.traditional()
+        C = batch.C
+    dsm.dC = numpy.std(C, axis=0, ddof=1)
+    return dsm.dC
+
+
 def __callback (dsm):
     '''
     this function is called after every desmearing iteration
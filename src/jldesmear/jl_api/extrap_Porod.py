@@ -7,7 +7,6 @@ Extrapolate as:  I(q) = B + Cp / q^4
 
 import extrapolation
 import toolbox
-import math
 import pprint
 import os       #@UnusedImport
 import numpy    #@UnusedImport
@@ -16,6 +15,7 @@ import numpy    #@UnusedImport
 class Extrapolation(extrapolation.Extrapolation):
     '''I(q) = B + Cp / q^4'''
     name = 'Porod'
+    basis = ('B', 'Cp')
 
     def __init__(self):
         '''set up things'''
@@ -43,21 +43,38 @@ class Extrapolation(extrapolation.Extrapolation):
         result = B + Cp / (q*q*q*q)
         return result
 
-    def fit_add(self, reg, x, y, z):
+    def basis_functions(self, q):
+        ''':return: columns of :math:`1` and :math:`q^{-4}`'''
+        return numpy.column_stack((numpy.ones_like(q), 1 / (q*q*q*q)))
+
+    def basis_integrals(self, q, a, b):
+        '''
+        columns of :math:`b - a` and 
+
+        .. math::
+        
+            \\int_a^b \\frac{dx}{(q^2+x^2)^2} 
+            = \\left[ \\frac{x}{2q^2(q^2+x^2)} + \\frac{\\tan^{-1}(x/q)}{2q^3} \\right]_a^b
+        '''
+        def antiderivative(x):
+            return x / (2*q*q*(q*q + x*x)) + numpy.arctan(x / q) / (2*q*q*q)
+
+        return numpy.column_stack((b - a, antiderivative(b) - antiderivative(a)))
+
+    def fit_transform(self, x, y, z):
         ''' 
-        Add a data point to the statistics registers.
+        Transform the data for linear regression: :math:`q^4 I = C_p + B q^4`.
         Called from :meth:`fit_loop()`.
         
         :note: *might* override in subclass
-        :param obj reg: statistics registers (created in 
-                        :meth:`~jldesmear.api.extrapolation.Extrapolation.fit()`), instance of StatsRegClass
-        :param float x: independent axis
-        :param float y: dependent axis
-        :param float z: estimated uncertainty of y
+        :param numpy.ndarray x: independent axis
+        :param numpy.ndarray y: dependent axis
+        :param numpy.ndarray z: estimated uncertainty of y
+        :return: (q^4, q^4 * I)
+        :rtype: (numpy.ndarray, numpy.ndarray)
         '''
-        #reg.AddWeighted(x, y, z)
-        q4 = math.pow(x, 4)
-        reg.Add(q4, q4 * y)
+        q4 = x**4
+        return q4, q4 * y
 
     def fit_result(self, reg):
         ''' 
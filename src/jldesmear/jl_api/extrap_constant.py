@@ -15,6 +15,7 @@ import numpy    #@UnusedImport
 class Extrapolation(extrapolation.Extrapolation):
     '''I(q) = B'''
     name = 'constant'
+    basis = ('B', )
 
     def __init__(self):
         '''set up things'''
@@ -41,6 +42,14 @@ class Extrapolation(extrapolation.Extrapolation):
             basis = 1.0
         return self.coefficients['B'] * basis
 
+    def basis_functions(self, q):
+        ''':return: :math:`f(q) = 1`, one column'''
+        return numpy.ones((len(q), 1))
+
+    def basis_integrals(self, q, a, b):
+        ''':return: :math:`\\int_a^b dx = b - a`, one column'''
+        return numpy.reshape(b - a, (len(q), 1))
+
     def fit_result(self, reg):
         ''' 
         Determine the results of the fit and store them
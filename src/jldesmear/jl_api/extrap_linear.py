@@ -15,6 +15,7 @@ import numpy    #@UnusedImport
 class Extrapolation(extrapolation.Extrapolation):
     '''I(q) = B + m*q'''
     name = 'linear'
+    basis = ('B', 'm')
 
     def __init__(self):
         '''set up things'''
@@ -41,6 +42,26 @@ class Extrapolation(extrapolation.Extrapolation):
         result = B + m * q
         return result
 
+    def basis_functions(self, q):
+        ''':return: columns of :math:`1` and :math:`q`'''
+        return numpy.column_stack((numpy.ones_like(q), q))
+
+    def basis_integrals(self, q, a, b):
+        '''
+        columns of :math:`b - a` and 
+
+        .. math::
+        
+            \\int_a^b \\sqrt{q^2+x^2} dx 
+            = \\frac{1}{2} \\left[ x \\sqrt{q^2+x^2} + q^2 \\sinh^{-1}(x/q) \\right]_a^b
+        '''
+        safe_q = numpy.where(q > 0, q, 1)
+
+        def antiderivative(x):
+            return 0.5 * (x * numpy.sqrt(q*q + x*x) + q*q * numpy.arcsinh(x / safe_q))
+
+        return numpy.column_stack((b - a, antiderivative(b) - antiderivative(a)))
+
     def fit_result(self, reg):
         ''' 
         Determine the results of the fit and store them
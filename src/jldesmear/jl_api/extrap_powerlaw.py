@@ -48,20 +48,19 @@ class Extrapolation(extrapolation.Extrapolation):
         result = A * basis
         return result
 
-    def fit_add(self, reg, x, y, z):
+    def fit_transform(self, x, y, z):
         ''' 
-        Add a data point to the statistics registers.
+        Transform the data for linear regression: :math:`\\ln I = \\ln A + p \\ln q`.
         Called from :meth:`fit_loop()`.
         
         :note: *might* override in subclass
-        :param reg: statistics registers (created in :meth:`fit()`)
-        :type reg: StatsRegClass object
-        :param float x: independent axis
-        :param float y: dependent axis
-        :param float z: estimated uncertainty of y
+        :param numpy.ndarray x: independent axis
+        :param numpy.ndarray y: dependent axis
+        :param numpy.ndarray z: estimated uncertainty of y
+        :return: (ln(q), ln(I))
+        :rtype: (numpy.ndarray, numpy.ndarray)
         '''
-        #reg.AddWeighted(x, y, z)
-        reg.Add(math.log(x), math.log(y))
+        return numpy.log(x), numpy.log(y)
 
     def fit_result(self, reg):
         ''' 
@@ -5,13 +5,15 @@ superclass of functions for extrapolation of SAS data past available range
 '''
 
 import os
-import importlib
 import glob
-import sys
+import threading
+import numpy
 import StatsReg
+import toolbox
 
 
 functions = None
+_discovery_lock = threading.RLock()     # one thread discovers, the others wait for it
 
 
 def discover_extrapolations():
@@ -31,25 +33,28 @@ def discover_extrapolations():
 
     * *Extrapolation*: a subclass of :class:`~jldesmear.api.extrapolation.Extrapolation`
     
+    The modules are imported as part of this package 
+    (see :func:`~jldesmear.jl_api.toolbox.import_plugin()`),
+    without changing the working directory or ``sys.path``,
+    so this may be called from many threads at once.
     '''
     # TODO: allow user to provide additional extrapolation plugins
     global functions
     if functions is None:
-        functions = {}
-        owd = os.getcwd()
-        path = os.path.dirname(os.path.abspath(__file__))
-        sys.path.insert(0, path)
-        os.chdir(path)
-        for item in glob.glob('extrap_*.py'):
-            modulename = os.path.splitext(item)[0]
-            mod = importlib.import_module(modulename)
-            if mod.Extrapolation.name is None:
-                raise ValueError, 'class Extrapolation in ' + item + ' must define value for "name"'
-            if mod.Extrapolation.name in functions:
-                raise RuntimeError, modulename + ' extrapolation previously defined'
-            functions[mod.Extrapolation.name] = mod.__dict__['Extrapolation']
-        os.chdir(owd)
-        sys.path.pop(0)
+        with _discovery_lock:
+            if functions is None:
+                path = os.path.dirname(os.path.abspath(__file__))
+                discovered = {}
+                for item in sorted(glob.glob(os.path.join(path, 'extrap_*.py'))):
+                    item = os.path.basename(item)
+                    modulename = os.path.splitext(item)[0]
+                    mod = toolbox.import_plugin(modulename)
+                    if mod.Extrapolation.name is None:
+                        raise ValueError, 'class Extrapolation in ' + item + ' must define value for "name"'
+                    if mod.Extrapolation.name in discovered:
+                        raise RuntimeError, modulename + ' extrapolation previously defined'
+                    discovered[mod.Extrapolation.name] = mod.__dict__['Extrapolation']
+                functions = discovered      # only complete results are seen by other threads
     return functions
 
 
@@ -139,18 +144,32 @@ class Extrapolation(object):
     * :meth:`~fit`
     * :meth:`~fit_setup`
     * :meth:`~fit_loop`
+    * :meth:`~fit_transform`
     * :meth:`~fit_add`
     * :meth:`~fit_result`
     * :meth:`~calc`
     * :meth:`~show`
     * :meth:`~format_coefficient`
     
+    .. rubric:: Linear in the coefficients:
+    
+    When :math:`I(q) = \\sum_k c_k f_k(q)` is linear in its coefficients,
+    the extrapolated part of the slit-smearing integral may be computed
+    once for all iterations, as a matrix of integrals of the basis 
+    functions :math:`f_k` times the vector of the coefficients :math:`c_k`.
+    To support this, define:
+    
+    * :attr:`basis` : names of the coefficients, in order
+    * :meth:`basis_functions()` : :math:`f_k(q)`
+    * :meth:`basis_integrals()` : :math:`\\int_a^b f_k(\\sqrt{q^2+x^2}) dx`
+    
     See the source code of :mod:`~jldesmear.api.extrap_Porod.Extrapolation` for an example.
     
     .. rubric:: documentation from source code:
     '''
 
     name = None                              # subclass must define: will be used as keyname to identify this class
+    basis = None                             # names of coefficients, if I(q) is linear in them
 
     def __init__(self):
         '''
@@ -223,9 +242,36 @@ class Extrapolation(object):
         :param numpy.ndarray x: independent axis
         :param numpy.ndarray y: dependent axis
         :param numpy.ndarray z: estimated uncertainties of y
+        
+        The data arrays are transformed by :meth:`fit_transform()`
+        and added to the registers all at once.  
+        A subclass that overrides :meth:`fit_add()` instead
+        has its data added one point at a time.
+        '''
+        if type(self).fit_add != Extrapolation.fit_add:
+            for i in range(len(x)):
+                self.fit_add(reg, x[i], y[i], z[i])
+            return
+        X, Y = self.fit_transform(numpy.asarray(x), numpy.asarray(y), numpy.asarray(z))
+        reg.AddArrays(X, Y)
+
+    def fit_transform(self, x, y, z):
+        ''' 
+        Transform the data arrays into the (X, Y) pairs 
+        for linear regression.  Called from :meth:`fit_loop()`.
+        
+        :note: *might* override in subclass, such as::
+
+            def fit_transform(self, x, y, z):
+                return numpy.log(x), numpy.log(y)
+
+        :param numpy.ndarray x: independent axis
+        :param numpy.ndarray y: dependent axis
+        :param numpy.ndarray z: estimated uncertainties of y
+        :return: (X, Y) arrays to add to the statistics registers
+        :rtype: (numpy.ndarray, numpy.ndarray)
         '''
-        for i in range(len(x)):
-            self.fit_add(reg, x[i], y[i], z[i])
+        return x, y
 
     def fit_add(self, reg, x, y, z):
         ''' 
@@ -287,6 +333,44 @@ class Extrapolation(object):
         '''
         return "coefficient: %s = %g\n" % (key, value)
 
+    def basis_functions(self, q):
+        '''
+        evaluate each basis function :math:`f_k` at the given q
+        
+        :note: override in subclass that defines :attr:`basis`
+
+        :param numpy.ndarray q: magnitude of scattering vector
+        :return: array of shape ``(len(q), len(basis))``
+        :rtype: numpy.ndarray
+        '''
+        raise NotImplementedError, self.__class__.__name__ + " is not linear in its coefficients"
+
+    def basis_integrals(self, q, a, b):
+        '''
+        integrals of each basis function along the slit:
+        
+        .. math::
+        
+            \\int_a^b f_k(\\sqrt{q^2+x^2}) dx
+        
+        :note: override in subclass that defines :attr:`basis`
+
+        :param numpy.ndarray q: magnitude of scattering vector
+        :param numpy.ndarray a: lower limit of integration, for each *q*
+        :param numpy.ndarray b: upper limit of integration, for each *q*
+        :return: array of shape ``(len(q), len(basis))``
+        :rtype: numpy.ndarray
+        '''
+        raise NotImplementedError, self.__class__.__name__ + " is not linear in its coefficients"
+
+    def coefficient_vector(self):
+        '''
+        coefficients in the order of :attr:`basis`
+
+        :rtype: numpy.ndarray
+        '''
+        return numpy.array([self.coefficients[key] for key in self.basis], dtype=float)
+
     def GetCoefficients(self):
         '''return the function coefficients'''
         return self.coefficients
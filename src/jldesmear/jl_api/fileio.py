@@ -5,10 +5,13 @@ superclass of modules supporting different file formats
 '''
 
 import os
+import threading
+import toolbox
 
 
-formats = None      # dict: file format support classes, by format class name
+formats = None      # dict: file format support classes, by format class name (see discover_support())
 ext_xref = None     # dict: cross-reference from extension to format class name
+_discovery_lock = threading.RLock()     # one thread discovers, the others wait for it
 
 
 class FileIO(object):
@@ -48,40 +51,47 @@ def discover_support():
     Support modules must be in a file in 
     the **jl_api** directory package in the source tree
     and begin with the prefix ``fileio_``.
+    They are imported as part of this package 
+    (see :func:`~jldesmear.jl_api.toolbox.import_plugin()`),
+    without changing the working directory,
+    so this may be called from many threads at once.
+    It is not called when this module is imported:
+    a support module that imports this module would
+    not yet be complete and its classes would be missed.
     '''
     global formats, ext_xref
     if formats is None:
-        owd = os.getcwd()
-        path = os.path.dirname(os.path.abspath(__file__))
-        os.chdir(path)
-        formats = {}
-        prefix = 'fileio_'
-        ext = '.py'
-        for filename in os.listdir('.'):
-            if filename.startswith(prefix) and filename.endswith(ext):
-                modulename = os.path.splitext(filename)[0]
-                if modulename in ('__init__', 'fileio', ):
-                    continue
-                exec 'import ' + modulename
-                contents = locals()[modulename].__dict__
-                for key, value in contents.items():
-                    if isinstance(value, type) and 'fileio_kind' in dir(value):
-                        if key in ('FileIO', ):
-                            continue    # do not include the superclass
-                        if key in formats:
-                            msg = 'Duplicate file format defined: ' + key 
-                            msg += ' in ' + filename
-                            raise RuntimeError, msg
-                        formats[key] = value
-                        continue
-        os.chdir(owd)
-        
-        ext_xref = {}
-        for fmt in formats:
-            obj = formats[fmt]()
-            for item in obj.extensions:
-                ext = os.path.splitext(item)[1]
-                ext_xref[ext] = fmt
+        with _discovery_lock:
+            if formats is None:
+                path = os.path.dirname(os.path.abspath(__file__))
+                discovered = {}
+                prefix = 'fileio_'
+                ext = '.py'
+                for filename in sorted(os.listdir(path)):
+                    if filename.startswith(prefix) and filename.endswith(ext):
+                        modulename = os.path.splitext(filename)[0]
+                        if modulename in ('__init__', 'fileio', ):
+                            continue
+                        contents = toolbox.import_plugin(modulename).__dict__
+                        for key, value in contents.items():
+                            if isinstance(value, type) and 'fileio_kind' in dir(value):
+                                if key in ('FileIO', ):
+                                    continue    # do not include the superclass
+                                if key in discovered:
+                                    msg = 'Duplicate file format defined: ' + key 
+                                    msg += ' in ' + filename
+                                    raise RuntimeError, msg
+                                discovered[key] = value
+                                continue
+                
+                xref = {}
+                for fmt in discovered:
+                    obj = discovered[fmt]()
+                    for item in obj.extensions:
+                        ext = os.path.splitext(item)[1]
+                        xref[ext] = fmt
+                ext_xref = xref
+                formats = discovered    # only complete results are seen by other threads
     return formats
 
 
@@ -92,9 +102,6 @@ def makeFilters():
     return filters
 
 
-discover_support()  # automatically initialize
-
-
 def main():
     global formats
     formats = discover_support()
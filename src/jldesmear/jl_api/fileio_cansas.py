@@ -0,0 +1,363 @@
+#!/usr/bin/env python
+
+'''
+fileio support for canSAS 1-D XML files (version 1.1)
+
+A canSAS 1-D XML file (``urn:cansas1d:1.1``) holds one or more
+``SASentry`` elements, each with one or more ``SASdata`` blocks
+of ``Idata`` points (*Q*, *I*, *Idev*).  See ``data/test1.xml``.
+
+The file is read with ``iterparse``: each ``SASentry`` is parsed,
+used, and cleared before the next is read, so files of many
+thousands of entries are processed in memory bounded by
+the size of one entry.  The desmeared intensities are written as
+a new ``SASdata`` block (named ``dsm``) in each entry
+of a new file, also one entry at a time.
+
+Example::
+
+    for entry in fileio_cansas.iter_entries('many.xml'):
+        q, I, dI = entry.data(fileio_cansas.SMEARED_DATA)
+
+    fileio_cansas.desmear_entries('many.xml', 'many_dsm.xml', overrides=dict(NumItr=20))
+
+Source Code Documentation
+^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^
+'''
+
+import copy
+import os
+import sys
+import numpy
+try:
+    import xml.etree.cElementTree as ElementTree
+except ImportError:
+    import xml.etree.ElementTree as ElementTree
+import desmear
+import extrapolation
+import fileio
+import info
+import toolbox
+
+
+NAMESPACE = 'urn:cansas1d:1.1'
+XSI_NAMESPACE = 'http://www.w3.org/2001/XMLSchema-instance'
+SCHEMA_LOCATION = NAMESPACE + ' http://www.cansas.org/formats/1.1/cansas1d.xsd'
+SMEARED_DATA = 'smr'        # name of the SASdata block with the measured (smeared) data
+DESMEARED_DATA = 'dsm'      # name of the SASdata block written with the desmeared data
+OUTPUT_SUFFIX = '_dsm'      # default output file: input file name with this suffix
+
+# SASnote "parameters": desmearing parameters (Info attribute, type), by element
+PARAMETERS = {
+    'slit_length':          ('slitlength', float),
+    'start_extrapolation':  ('sFinal', float),
+    'extrapolation_form':   ('extrapname', str),
+    'num_iterations':       ('NumItr', int),
+    'feedback_method':      ('LakeWeighting', str),
+}
+
+ElementTree.register_namespace('', NAMESPACE)
+
+
+def tag(name):
+    ''':return: name of a canSAS element with its namespace'''
+    return '{%s}%s' % (NAMESPACE, name)
+
+
+class Entry(object):
+    '''
+    one ``SASentry`` of a canSAS 1-D XML file
+
+    :param obj element: the ``SASentry`` element, valid only until
+        :func:`iter_entries()` reads the next entry
+    '''
+
+    def __init__(self, element):
+        self.element = element
+        self.name = element.get('name')
+        self.title = element.findtext(tag('Title'))
+
+    def __str__(self):
+        return 'SASentry %s: %s' % (self.name, self.title)
+
+    def sasdata(self, name=None):
+        '''
+        ``SASdata`` element by name (default: the first)
+
+        :return: element or None
+        '''
+        blocks = self.element.findall(tag('SASdata'))
+        for block in blocks:
+            if name is None or block.get('name') == name:
+                return block
+        return None
+
+    def data(self, name=None):
+        '''
+        the points of a ``SASdata`` block as arrays
+
+        :param str name: name of the block (default: ``SMEARED_DATA``,
+            or the first block if there is none of that name)
+        :return: q, I, dI
+        :rtype: (numpy.ndarray, numpy.ndarray, numpy.ndarray)
+        '''
+        block = self.sasdata(name or SMEARED_DATA)
+        if block is None and name is None:
+            block = self.sasdata()
+        if block is None:
+            raise KeyError, 'no SASdata %s in %s' % (name or SMEARED_DATA, self.name)
+        points = block.findall(tag('Idata'))
+        columns = numpy.empty((3, len(points)))
+        for i, field in enumerate(('Q', 'I', 'Idev')):
+            try:
+                columns[i] = [float(point.findtext(tag(field))) for point in points]
+            except (TypeError, ValueError):
+                raise ValueError, 'SASentry %s: missing or not a number: %s' % (self.name, field)
+        return tuple(columns)
+
+    def parameters(self, defaults=None):
+        '''
+        desmearing parameters from the ``parameters`` SASnote
+
+        :param obj defaults: Info object with the other parameters (copied)
+        :rtype: obj
+        '''
+        params = copy.copy(defaults) if defaults is not None else info.Info()
+        params.callback = None
+        for note in self.element.findall(tag('SASnote')):
+            if note.get('name') != 'parameters':
+                continue
+            for element, (key, kind) in PARAMETERS.items():
+                text = note.findtext(tag(element))
+                if text is not None and len(text.strip()) > 0:
+                    setattr(params, key, kind(text.strip()))
+        return params
+
+    def add_sasdata(self, q, I, dI, name=DESMEARED_DATA):
+        '''
+        add a ``SASdata`` block (replacing any of the same name) after the last one
+
+        The units are those of the ``SMEARED_DATA`` (or first) block.
+        '''
+        source = self.sasdata(SMEARED_DATA) or self.sasdata()
+        units = {}
+        if source is not None:
+            point = source.find(tag('Idata'))
+            if point is not None:
+                for field in ('Q', 'I', 'Idev'):
+                    element = point.find(tag(field))
+                    if element is not None and element.get('unit'):
+                        units[field] = element.get('unit')
+        old = self.sasdata(name)
+        if old is not None:
+            self.element.remove(old)
+        children = list(self.element)
+        position = 0
+        for i, child in enumerate(children):
+            if child.tag == tag('SASdata'):
+                position = i + 1
+        block = ElementTree.Element(tag('SASdata'), name=name)
+        block.text = '\n' + ' '*6
+        for values in zip(q, I, dI):
+            point = ElementTree.SubElement(block, tag('Idata'))
+            point.text = '\n' + ' '*8
+            for field, value in zip(('Q', 'I', 'Idev'), values):
+                element = ElementTree.SubElement(point, tag(field))
+                element.text = repr(float(value))
+                if field in units:
+                    element.set('unit', units[field])
+                element.tail = '\n' + ' '*8
+            element.tail = '\n' + ' '*6
+            point.tail = '\n' + ' '*6
+        if len(block) > 0:
+            block[-1].tail = '\n' + ' '*4
+        block.tail = '\n' + ' '*4
+        self.element.insert(position, block)
+        return block
+
+
+def iter_entries(filename):
+    '''
+    each ``SASentry`` of a canSAS 1-D XML file, read one at a time
+
+    The entries are parsed with ``iterparse`` and each is
+    cleared once the next is requested.
+
+    :param str filename: name of the canSAS XML file
+    :return: generator of :class:`Entry` objects
+    '''
+    root = None
+    for event, element in ElementTree.iterparse(filename, events=('start', 'end')):
+        if event == 'start':
+            if root is None:
+                root = element
+                if root.tag != tag('SASroot'):
+                    raise ValueError, filename + ': not a canSAS 1-D XML (' + NAMESPACE + ') file'
+            continue
+        if element.tag == tag('SASentry'):
+            yield Entry(element)
+            element.clear()
+            root.clear()        # drop the references to entries already read
+
+
+def write_entries(filename, entries):
+    '''
+    write a canSAS 1-D XML file, one ``SASentry`` at a time
+
+    The file is written to a temporary file that is then renamed,
+    so *entries* may be read from the file being replaced.
+
+    :param str filename: name of the canSAS XML file
+    :param entries: iterable of ``SASentry`` elements (or :class:`Entry` objects)
+    :return: number of entries written
+    '''
+    temporary = filename + '.tmp'
+    count = 0
+    try:
+        with open(temporary, 'w') as fp:
+            fp.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+            fp.write('<SASroot version="1.1" xmlns="%s"\n' % NAMESPACE)
+            fp.write('    xmlns:xsi="%s"\n' % XSI_NAMESPACE)
+            fp.write('    xsi:schemaLocation="%s">\n' % SCHEMA_LOCATION)
+            for entry in entries:
+                element = getattr(entry, 'element', entry)
+                element.tail = '\n'
+                fp.write('  ' + ElementTree.tostring(element))
+                count += 1
+            fp.write('</SASroot>\n')
+        if os.path.exists(filename) and sys.platform == 'win32':
+            os.remove(filename)         # rename does not replace a file on Windows
+        os.rename(temporary, filename)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+    return count
+
+
+def desmear_entries(infile, outfile=None, params=None, overrides=None, quiet=True):
+    '''
+    desmear every ``SASentry`` of a canSAS 1-D XML file, one at a time
+
+    Each entry is desmeared with the parameters of its ``parameters``
+    SASnote (on top of *params*, then *overrides*) and written to *outfile*
+    with the desmeared intensities as a new ``SASdata`` block.
+    Entries that fail are written unchanged.  An entry without a number
+    of iterations fails unless ``params.stopping`` has criteria
+    (see :func:`~jldesmear.jl_api.desmear.check_iterations()`).
+
+    :param str infile: name of the canSAS XML file
+    :param str outfile: name of the new file (default: *infile* with ``OUTPUT_SUFFIX``)
+    :param obj params: Info object with default desmearing parameters
+    :param dict overrides: (optional) Info attributes to replace those of each entry
+    :param bool quiet: if True, then no printed output from this routine
+    :return: dictionary with keys ``iterations``, ``ChiSqr``, ``stop_reason``, and ``error``,
+        keyed by entry name
+    :rtype: dict
+    '''
+    if outfile is None:
+        root, ext = os.path.splitext(infile)
+        outfile = root + OUTPUT_SUFFIX + ext
+    results = {}
+
+    def desmeared():
+        for entry in iter_entries(infile):
+            result = dict(iterations=None, ChiSqr=None, stop_reason=None, error=None)
+            try:
+                p = entry.parameters(params)
+                for key, value in (overrides or {}).items():
+                    setattr(p, key, value)
+                desmear.check_iterations(p)
+                q, I, dI = entry.data()
+                dsm = desmear.new_desmearing(q, I, dI, p)
+                while dsm.more_iterations_ok():
+                    dsm.iteration()
+                if p.uncertainty == 'montecarlo':
+                    desmear.monte_carlo_uncertainty(dsm)
+                entry.add_sasdata(dsm.q, dsm.C, dsm.dC)
+                result.update(iterations=dsm.iteration_count, ChiSqr=dsm.ChiSqr[-1],
+                              stop_reason=dsm.stop_reason)
+            except Exception, exc:
+                result['error'] = '%s: %s' % (exc.__class__.__name__, str(exc))
+            results[entry.name] = result
+            if not quiet:
+                print('%s: %s' % (entry.name, result['error'] or 'ChiSqr=%g' % result['ChiSqr']))
+            yield entry
+
+    write_entries(outfile, desmeared())
+    return results
+
+
+class CanSAS(fileio.FileIO):
+    '''
+    canSAS 1-D XML file: data and desmearing parameters of its first ``SASentry``
+
+    The desmearing parameters are read from the ``parameters`` SASnote
+    (elements ``slit_length``, ``start_extrapolation``, ``extrapolation_form``,
+    ``num_iterations``, and ``feedback_method``).  The smeared data
+    are the ``SASdata`` block named ``smr`` (or the first block).
+    Use :func:`desmear_entries()` for all the entries of a file.
+    '''
+
+    description = 'canSAS 1-D XML'
+    extensions = ['*.xml', ]
+
+    def _first_entry(self, filename, use):
+        '''apply *use* to the first SASentry of the file'''
+        for entry in iter_entries(filename):
+            return use(entry)
+        raise ValueError, filename + ': no SASentry'
+
+    def read(self, filename):
+        '''
+        read desmearing parameters from the first ``SASentry`` of a canSAS XML file
+
+        :param str filename: full path to the canSAS XML file
+        :returns: instance of :class:`jldesmear.api.info.Info`
+        '''
+        if not os.path.exists(filename): return None
+        self.info = self._first_entry(filename, lambda entry: entry.parameters())
+        self.info.fileio_class = self
+        self.info.filename = filename
+        self.info.parameterfile = filename
+        self.info.quiet = True
+        self.info.infile = os.path.abspath(filename)
+        root, ext = os.path.splitext(self.info.infile)
+        self.info.outfile = root + OUTPUT_SUFFIX + ext
+        self.info.extrap = extrapolation.discover_extrapolations().get(self.info.extrapname)
+        return self.info
+
+    def read_SMR(self, filename = None):
+        '''smeared SAS data of the first ``SASentry``'''
+        filename = filename or self.info.infile
+        if not os.path.exists(filename): return
+        q, E, dE = self._first_entry(filename, lambda entry: entry.data())
+        if (len(q) == 0):
+            raise Exception, "no data points!"
+        if self.info is not None and self.info.sFinal > q[-1]:
+            raise RuntimeWarning, "Fit range out of data range"
+        return q, E, dE
+
+    def save_DSM(self, filename, dsm):
+        '''
+        Save the desmeared data as a canSAS XML file: the first ``SASentry``
+        of the input file with the desmeared data as a new ``SASdata`` block
+        '''
+        def with_desmeared(entry):
+            entry.add_sasdata(dsm.q, dsm.C, dsm.dC)
+            return entry.element
+
+        entry = self._first_entry(self.info.infile, with_desmeared)
+        write_entries(filename, [entry])
+
+
+def main():
+    fn = toolbox.GetTest1DataFilename('.xml')
+    for entry in iter_entries(fn):
+        print entry
+        print entry.parameters()
+        for block in entry.element.findall(tag('SASdata')):
+            print block.get('name'), len(entry.data(block.get('name'))[0]), 'points'
+
+
+if __name__ == "__main__":
+    main()
@@ -78,10 +78,9 @@ class CommandInput(fileio.FileIO):
 
         # read a .inp file
         self.info.parameterfile = filename
-        path = os.path.dirname(filename)
-        owd = os.getcwd()
-        os.chdir(path)
-        buf = open(os.path.abspath(filename), 'r').readlines()
+        path = os.path.dirname(os.path.abspath(filename))
+        with open(filename, 'r') as f:
+            buf = f.readlines()
         if len(buf) < 7:
             msg = "not enough information in command input file: " + filename
             raise RuntimeError, msg
@@ -101,8 +100,6 @@ class CommandInput(fileio.FileIO):
         self.info.NumItr = int(get_buf_item(5))
         self.info.LakeWeighting = get_buf_item(6)
         self.info.extrap = functions[self.info.extrapname]
-
-        os.chdir(owd)
         
         return self.info
     
@@ -111,8 +108,6 @@ class CommandInput(fileio.FileIO):
         write desmearing parameters to a command input file
         '''
         path = os.path.abspath(os.path.dirname(filename))
-        owd = os.getcwd()
-        os.chdir(path)
 
         f = open(filename, 'w')
         if path == os.path.dirname(self.info.infile):
@@ -131,27 +126,25 @@ class CommandInput(fileio.FileIO):
         f.write(str(self.info.NumItr) + '\n')
         f.write(self.info.LakeWeighting + '\n')
         f.close()
-
-        os.chdir(owd)
     
     def read_SMR(self, filename = None):
         '''Open a file with 3-column smeared SAS data'''
-        #path = os.path.abspath(os.path.dirname(filename))
-        #owd = os.getcwd()
-        #os.chdir(path)
         filename = filename or self.info.infile
         if not os.path.exists(filename): return
-        #os.chdir(owd)
-        q, E, dE = toolbox.GetDat(filename)
+        q, E, dE = toolbox.GetDat(filename, sidecar=self.info.data_sidecar)
         if (len(q) == 0):
             raise Exception, "no data points!"
         if (self.info.sFinal > q[-1]):
             raise RuntimeWarning, "Fit range out of data range"
         return q, E, dE
     
-    def save_DSM(self, filename, dsm):
-        '''Save the desmeared data to a 3-column ASCII file'''
-        toolbox.SavDat(filename, dsm.q, dsm.C, dsm.dC)
+    def save_DSM(self, filename, dsm, quiet=False):
+        '''
+        Save the desmeared data to a 3-column ASCII file
+        
+        :param bool quiet: if True, do not report the name of the saved file
+        '''
+        toolbox.SavDat(filename, dsm.q, dsm.C, dsm.dC, quiet=quiet)
 
 
 # class AnyFile(FileIO):
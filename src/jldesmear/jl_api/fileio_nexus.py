@@ -0,0 +1,415 @@
+#!/usr/bin/env python
+
+'''
+fileio support for HDF5 (NeXus) containers of many datasets
+
+One HDF5 file holds many smeared datasets (*scans*), each an
+``NXentry`` group at the root of the file.  The desmeared results of each
+scan are appended to its group, so thousands of datasets are kept,
+with all their metadata and at full precision, in a single file::
+
+    /<scan>                 NXentry
+        smr                 NXdata: Q, I, Idev (smeared data)
+        parameters          NXparameters: desmearing parameters (Info attributes)
+        dsm                 NXdata: Q, I, Idev (desmeared data: C, dC)
+        desmearing          NXprocess: S, z, ChiSqr (history), iteration_count,
+                            stop_reason, parameters (as used)
+            extrapolation   NXparameters: coefficients of the fitted extrapolation
+
+The arrays are written chunked and compressed, each in a single write.
+Requires the ``h5py`` package, which is imported only when needed.
+
+Example::
+
+    for name in fileio_nexus.scan_names('many.h5'):
+        q, I, dI = fileio_nexus.read_data('many.h5', name)
+
+    fileio_nexus.desmear_scans('many.h5', overrides=dict(NumItr=20))
+
+Source Code Documentation
+^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^
+'''
+
+import copy
+import datetime
+import json
+import os
+import shutil
+import tempfile
+import numpy
+try:
+    import h5py
+except ImportError:
+    h5py = None         # HDF5 files cannot be read or written
+import desmear
+import extrapolation
+import fileio
+import info
+import toolbox
+
+
+SMEARED_DATA = 'smr'        # name of the NXdata group with the measured (smeared) data
+DESMEARED_DATA = 'dsm'      # name of the NXdata group written with the desmeared data
+PARAMETERS = 'parameters'   # name of the NXparameters group of desmearing parameters
+PROCESS = 'desmearing'      # name of the NXprocess group written with the other results
+DATA_FIELDS = ('Q', 'I', 'Idev')
+COMPRESSION = dict(chunks=True, compression='gzip', compression_opts=4, shuffle=True)
+JSON_ENCODING = 'json'      # "encoding" attribute of parameters saved as JSON text
+
+
+def require_h5py():
+    '''raise ImportError if the ``h5py`` package is not available'''
+    if h5py is None:
+        raise ImportError, 'HDF5 (NeXus) files need the h5py package'
+
+
+def _open(filename, mode='r'):
+    require_h5py()
+    return h5py.File(filename, mode)
+
+
+def _text(value):
+    '''HDF5 string attribute or dataset value as str'''
+    if isinstance(value, numpy.ndarray):
+        value = value[()]
+    if isinstance(value, bytes):
+        return value
+    return str(value)
+
+
+def _new_group(parent, name, nx_class):
+    '''new group *name* (replacing any of that name) with NeXus class *nx_class*'''
+    if name in parent:
+        del parent[name]
+    group = parent.create_group(name)
+    group.attrs['NX_class'] = nx_class
+    return group
+
+
+def _write_array(group, name, values):
+    '''write a 1-D (or larger) array, chunked and compressed, in a single write'''
+    values = numpy.asarray(values, dtype=float)
+    if values.size == 0:
+        return group.create_dataset(name, data=values)
+    return group.create_dataset(name, data=values, **COMPRESSION)
+
+
+def scan_names(filename):
+    '''
+    names of the scans (``NXentry`` groups with smeared data) in an HDF5 file
+
+    :param str filename: name of the HDF5 file
+    :rtype: [str]
+    '''
+    with _open(filename) as h5:
+        names = [str(name) for name, group in h5.items()
+                 if isinstance(group, h5py.Group) and SMEARED_DATA in group]
+    return names
+
+
+def read_data(filename, name, data=SMEARED_DATA):
+    '''
+    the arrays of an ``NXdata`` group of a scan
+
+    :param str filename: name of the HDF5 file
+    :param str name: name of the scan
+    :param str data: name of the NXdata group (default: ``SMEARED_DATA``)
+    :return: q, I, dI
+    :rtype: (numpy.ndarray, numpy.ndarray, numpy.ndarray)
+    '''
+    with _open(filename) as h5:
+        group = h5[name][data]
+        return tuple([numpy.array(group[field], dtype=float) for field in DATA_FIELDS])
+
+
+def write_data(group, q, I, dI, name=SMEARED_DATA):
+    '''
+    write (replace) an ``NXdata`` group of *Q*, *I*, *Idev*
+
+    :param obj group: h5py group of the scan
+    :return: the new NXdata group
+    '''
+    nxdata = _new_group(group, name, 'NXdata')
+    nxdata.attrs['signal'] = 'I'
+    nxdata.attrs['axes'] = 'Q'
+    for field, values in zip(DATA_FIELDS, (q, I, dI)):
+        _write_array(nxdata, field, values)
+    nxdata['I'].attrs['uncertainties'] = 'Idev'
+    return nxdata
+
+
+def read_parameters(group, defaults=None):
+    '''
+    desmearing parameters from an ``NXparameters`` group
+
+    Only the fields that are attributes of :class:`~jldesmear.jl_api.info.Info` are used.
+
+    :param obj group: h5py NXparameters group (or None)
+    :param obj defaults: Info object with the other parameters (copied)
+    :rtype: obj
+    '''
+    params = copy.copy(defaults) if defaults is not None else info.Info()
+    params.callback = None
+    for key, dataset in (group or {}).items():
+        if not hasattr(info.Info, key) or key in desmear.UNSAVED_SETTINGS:
+            continue
+        value = dataset[()]
+        if _text(dataset.attrs.get('encoding', '')) == JSON_ENCODING:
+            value = json.loads(_text(value))
+            if isinstance(value, list):
+                value = tuple(value)
+        elif isinstance(value, bytes):
+            value = str(value)
+        elif isinstance(value, numpy.bool_):
+            value = bool(value)
+        elif isinstance(value, numpy.integer):
+            value = int(value)
+        elif isinstance(value, numpy.floating):
+            value = float(value)
+        setattr(params, str(key), value)
+    return params
+
+
+def write_parameters(group, settings, name=PARAMETERS):
+    '''
+    write (replace) an ``NXparameters`` group of desmearing parameters
+
+    Each parameter is a field.  Those that are not numbers or text
+    (such as ``stopping``) are written as JSON text.  Parameters
+    that are None are not written.
+
+    :param obj group: h5py group of the scan
+    :param dict settings: parameters by name, see :func:`~jldesmear.jl_api.desmear.info_settings()`
+    :return: the new NXparameters group
+    '''
+    nxparameters = _new_group(group, name, 'NXparameters')
+    for key, value in sorted(settings.items()):
+        if value is None:
+            continue
+        if isinstance(value, (bool, int, long, float, str)):
+            nxparameters[key] = value
+        else:
+            nxparameters[key] = json.dumps(value)
+            nxparameters[key].attrs['encoding'] = JSON_ENCODING
+    return nxparameters
+
+
+def results(dsm):
+    '''
+    the results of a desmearing, as a (picklable) dictionary
+
+    :param obj dsm: Desmearing object, after its iterations
+    :return: dictionary with keys ``q``, ``I``, ``dI``, ``C``, ``dC``,
+        ``S``, ``z``, ``ChiSqr``, ``iteration_count``, ``stop_reason``,
+        ``extrap`` (see :func:`~jldesmear.jl_api.desmear.extrapolation_state()`),
+        and ``settings`` (see :func:`~jldesmear.jl_api.desmear.info_settings()`)
+    :rtype: dict
+    '''
+    return dict(
+        q = numpy.asarray(dsm.q), I = numpy.asarray(dsm.I), dI = numpy.asarray(dsm.dI),
+        C = numpy.asarray(dsm.C), dC = numpy.asarray(dsm.dC),
+        S = numpy.asarray(dsm.S), z = numpy.asarray(dsm.z),
+        ChiSqr = numpy.asarray(dsm.ChiSqr, dtype=float),
+        iteration_count = int(dsm.iteration_count),
+        stop_reason = dsm.stop_reason,
+        extrap = desmear.extrapolation_state(dsm.extrap),
+        settings = desmear.info_settings(dsm.params),
+    )
+
+
+def write_results(filename, name, result, smeared=True):
+    '''
+    append the results of desmearing a scan to an HDF5 file
+
+    The ``dsm`` and ``desmearing`` groups of the scan (created if needed)
+    are replaced.  Each array is written once.
+
+    :param str filename: name of the HDF5 file (created if needed)
+    :param str name: name of the scan
+    :param dict result: from :func:`results()`
+    :param bool smeared: if True, also write the smeared data
+        and parameters, if the scan does not have them
+    '''
+    with _open(filename, 'a') as h5:
+        if name in h5:
+            group = h5[name]
+        else:
+            group = _new_group(h5, name, 'NXentry')
+        if smeared and SMEARED_DATA not in group:
+            write_data(group, result['q'], result['I'], result['dI'])
+        if smeared and PARAMETERS not in group:
+            write_parameters(group, result['settings'])
+        write_data(group, result['q'], result['C'], result['dC'], name=DESMEARED_DATA)
+
+        process = _new_group(group, PROCESS, 'NXprocess')
+        process['program'] = 'jldesmear'
+        process['date'] = datetime.datetime.now().isoformat()
+        for key in ('S', 'z', 'ChiSqr'):
+            _write_array(process, key, result[key])
+        process['iteration_count'] = result['iteration_count']
+        process['stop_reason'] = str(result['stop_reason'])
+        write_parameters(process, result['settings'])
+        if result['extrap'] is not None:
+            nxextrap = write_parameters(process, result['extrap']['coefficients'],
+                                        name='extrapolation')
+            nxextrap.attrs['name'] = result['extrap']['name']
+
+
+def read_results(filename, name):
+    '''
+    the results of desmearing a scan, as written by :func:`write_results()`
+
+    :return: dictionary as from :func:`results()`
+    :rtype: dict
+    '''
+    q, I, dI = read_data(filename, name)
+    _, C, dC = read_data(filename, name, DESMEARED_DATA)
+    with _open(filename) as h5:
+        process = h5[name][PROCESS]
+        result = dict(q=q, I=I, dI=dI, C=C, dC=dC)
+        for key in ('S', 'z', 'ChiSqr'):
+            result[key] = numpy.array(process[key])
+        result['iteration_count'] = int(process['iteration_count'][()])
+        result['stop_reason'] = _text(process['stop_reason'][()])
+        result['extrap'] = None
+        if 'extrapolation' in process:
+            nxextrap = process['extrapolation']
+            coefficients = dict([(str(key), float(value[()])) for key, value in nxextrap.items()])
+            result['extrap'] = dict(name=_text(nxextrap.attrs['name']), coefficients=coefficients)
+        result['settings'] = desmear.info_settings(read_parameters(process[PARAMETERS]))
+    return result
+
+
+def desmear_scans(infile, outfile=None, params=None, overrides=None, quiet=True):
+    '''
+    desmear every scan of an HDF5 file, one at a time
+
+    Each scan is desmeared with the parameters of its ``parameters``
+    group (on top of *params*, then *overrides*) and the results
+    are appended to its group in *outfile*.  A scan without a number
+    of iterations fails unless ``params.stopping`` has criteria
+    (see :func:`~jldesmear.jl_api.desmear.check_iterations()`).
+
+    :param str infile: name of the HDF5 file
+    :param str outfile: name of the HDF5 file for the results (default: *infile*)
+    :param obj params: Info object with default desmearing parameters
+    :param dict overrides: (optional) Info attributes to replace those of each scan
+    :param bool quiet: if True, then no printed output from this routine
+    :return: dictionary with keys ``iterations``, ``ChiSqr``, ``stop_reason``, and ``error``,
+        keyed by scan name
+    :rtype: dict
+    '''
+    outfile = outfile or infile
+    reports = {}
+    for name in scan_names(infile):
+        report = dict(iterations=None, ChiSqr=None, stop_reason=None, error=None)
+        try:
+            with _open(infile) as h5:
+                p = read_parameters(h5[name].get(PARAMETERS), params)
+            for key, value in (overrides or {}).items():
+                setattr(p, key, value)
+            desmear.check_iterations(p)
+            q, I, dI = read_data(infile, name)
+            dsm = desmear.new_desmearing(q, I, dI, p)
+            while dsm.more_iterations_ok():
+                dsm.iteration()
+            if p.uncertainty == 'montecarlo':
+                desmear.monte_carlo_uncertainty(dsm)
+            write_results(outfile, name, results(dsm))
+            report.update(iterations=dsm.iteration_count, ChiSqr=dsm.ChiSqr[-1],
+                          stop_reason=dsm.stop_reason)
+        except Exception, exc:
+            report['error'] = '%s: %s' % (exc.__class__.__name__, str(exc))
+        reports[name] = report
+        if not quiet:
+            print('%s: %s' % (name, report['error'] or 'ChiSqr=%g' % report['ChiSqr']))
+    return reports
+
+
+class NeXus(fileio.FileIO):
+    '''
+    HDF5 (NeXus) file: data and desmearing parameters of one scan (default: the first)
+
+    Use :func:`desmear_scans()` for all the scans of a file.
+    Requires the ``h5py`` package.
+    '''
+
+    description = 'HDF5 (NeXus)'
+    extensions = ['*.h5', '*.hdf5', '*.nxs', ]
+    scan = None             # name of the scan (NXentry group)
+
+    def read(self, filename, scan=None):
+        '''
+        read desmearing parameters from a scan of an HDF5 file
+
+        :param str filename: full path to the HDF5 file
+        :param str scan: name of the scan (default: the first)
+        :returns: instance of :class:`jldesmear.api.info.Info`
+        '''
+        if not os.path.exists(filename): return None
+        names = scan_names(filename)
+        if len(names) == 0:
+            raise ValueError, filename + ': no scans with smeared data'
+        if scan is not None and scan not in names:
+            raise KeyError, '%s: no scan %s' % (filename, scan)
+        self.scan = scan or names[0]
+        with _open(filename) as h5:
+            self.info = read_parameters(h5[self.scan].get(PARAMETERS))
+        self.info.fileio_class = self
+        self.info.filename = filename
+        self.info.parameterfile = filename
+        self.info.quiet = True
+        self.info.infile = os.path.abspath(filename)
+        self.info.outfile = self.info.infile
+        self.info.extrap = extrapolation.discover_extrapolations().get(self.info.extrapname)
+        return self.info
+
+    def save(self, filename):
+        '''
+        write the desmearing parameters to the scan in an HDF5 file
+        '''
+        with _open(filename, 'a') as h5:
+            if self.scan in h5:
+                group = h5[self.scan]
+            else:
+                group = _new_group(h5, self.scan, 'NXentry')
+            write_parameters(group, desmear.info_settings(self.info))
+
+    def read_SMR(self, filename = None):
+        '''smeared SAS data of the scan'''
+        filename = filename or self.info.infile
+        if not os.path.exists(filename): return
+        q, E, dE = read_data(filename, self.scan or scan_names(filename)[0])
+        if (len(q) == 0):
+            raise Exception, "no data points!"
+        if self.info is not None and self.info.sFinal > q[-1]:
+            raise RuntimeWarning, "Fit range out of data range"
+        return q, E, dE
+
+    def save_DSM(self, filename, dsm):
+        '''Append the desmeared data and results to the scan in an HDF5 file'''
+        write_results(filename, self.scan, results(dsm))
+
+
+def main():
+    fn = toolbox.GetTest1DataFilename('.smr')
+    q, I, dI = toolbox.GetDat(fn)
+    h5file = os.path.join(tempfile.mkdtemp(), 'test1.h5')
+    params = info.Info()
+    params.slitlength = 0.08
+    params.sFinal = 0.08
+    params.extrapname = 'linear'
+    params.NumItr = 20
+    params.smear_engine = 'kernel'
+    with _open(h5file, 'w') as h5:
+        group = _new_group(h5, 'test1', 'NXentry')
+        write_data(group, q, I, dI)
+        write_parameters(group, desmear.info_settings(params))
+    print desmear_scans(h5file, quiet=False)
+    result = read_results(h5file, 'test1')
+    print result['extrap'], len(result['ChiSqr']), 'iterations'
+    shutil.rmtree(os.path.dirname(h5file))
+
+
+if __name__ == "__main__":
+    main()
@@ -463,6 +463,7 @@ class JLdesmearGui(QMainWindow):
     def onOpenCallback(self, filename, filefilter=''):
         '''open a Command Input file with SAS desmearing parameters'''
         ext = os.path.splitext(filename)[1]
+        fileio.discover_support()
         xref = fileio.ext_xref
         # do not use the filefilter term
         if ext in xref and xref[ext] == 'CommandInput':
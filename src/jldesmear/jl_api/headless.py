@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+
+'''
+Non-interactive command-line program for Jemian/Lake desmearing
+
+All desmearing parameters are given as command-line options,
+or read from a command input file (``.inp``, see
+:mod:`~jldesmear.jl_api.fileio_inp`) with any options given
+replacing the values from that file.  The program never reads
+from the console, so it may be run from scripts or a job scheduler.
+The exit status is 0 when the desmeared data were written,
+1 if desmearing failed, and 2 for errors in the command-line options.
+
+Example::
+
+    jldsmear run -i test1.smr -o test1.dsm -l 0.08 -f 0.08 -e linear -n 20
+    jldsmear run test1.inp --quiet
+    jldsmear run test1.inp -n 0 --stop converged --stop rising
+
+Source Code Documentation
+^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^
+'''
+
+
+import argparse
+import os
+import sys
+import desmear
+import extrapolation
+import fileio_inp
+import info
+import smear
+import toolbox
+
+
+def get_parser():
+    '''
+    define the command-line options
+
+    :return: parser for the command-line options
+    :rtype: argparse.ArgumentParser
+    '''
+    doc = 'Desmear SAS data without any interaction at the console'
+    parser = argparse.ArgumentParser(prog='jldsmear run', description=doc)
+    parser.add_argument('inp', nargs='?', default=None,
+                        help='command input (.inp) file with default parameters')
+    parser.add_argument('-i', '--infile', default=None,
+                        help='input (smeared) data file, columns: Q I dI')
+    parser.add_argument('-o', '--outfile', default=None,
+                        help='output (desmeared) data file (default: INFILE with .dsm extension)')
+    parser.add_argument('-l', '--slitlength', type=float, default=None,
+                        help='slit length, l_o, same units as Q')
+    parser.add_argument('-f', '--sFinal', type=float, default=None,
+                        help='fit extrapolation to data for Q >= sFinal')
+    parser.add_argument('-e', '--extrapolation', default=None, dest='extrapname',
+                        choices=sorted(extrapolation.discover_extrapolations().keys()),
+                        help='functional form of the extrapolation')
+    parser.add_argument('-w', '--weighting', default=None, dest='LakeWeighting',
+                        choices=sorted(desmear.Weighting_Methods.keys()),
+                        help='feedback weighting of the iterative corrections')
+    parser.add_argument('-m', '--method', default=None, dest='desmear_method',
+                        choices=sorted(desmear.Desmearing_Methods.keys()),
+                        help='desmearing method')
+    parser.add_argument('-r', '--regularization', default=None,
+                        choices=sorted(desmear.Regularization_Criteria.keys()),
+                        help='"direct": choice of the regularization weight')
+    parser.add_argument('--lambda', type=float, default=None, dest='regularization_weight',
+                        help='"direct": fixed regularization weight')
+    parser.add_argument('-u', '--uncertainty', default=None,
+                        choices=sorted(desmear.Uncertainty_Methods.keys()),
+                        help='estimate of the uncertainties of the desmeared intensities')
+    parser.add_argument('--replicas', type=int, default=None, dest='mc_replicas',
+                        help='"montecarlo": number of resampled datasets')
+    parser.add_argument('--seed', type=int, default=None, dest='mc_seed',
+                        help='"montecarlo": seed of the random numbers')
+    parser.add_argument('-a', '--acceleration', default=None,
+                        choices=sorted(desmear.Acceleration_Methods.keys()),
+                        help='acceleration of the Lake iteration')
+    parser.add_argument('--depth', type=int, default=None, dest='acceleration_depth',
+                        help='"anderson": number of previous corrections combined')
+    parser.add_argument('-n', '--iterations', type=int, default=None, dest='NumItr',
+                        help='number of iterations (0: until a --stop criterion is met)')
+    parser.add_argument('-s', '--stop', action='append', default=None, dest='stopping',
+                        choices=sorted(desmear.Stopping_Criteria.keys()),
+                        help='stop iterating when this criterion is met (may be repeated)')
+    parser.add_argument('--tolerance', type=float, default=None, dest='stop_tolerance',
+                        help='"converged": largest relative ChiSqr change')
+    parser.add_argument('--window', type=int, default=None, dest='stop_window',
+                        help='"converged": iterations over which ChiSqr change is measured')
+    parser.add_argument('--engine', default=None, dest='smear_engine',
+                        choices=sorted(smear.Smearing_Engines.keys()),
+                        help='how to compute the smearing')
+    parser.add_argument('--quadrature', default=None, dest='slit_quadrature',
+                        choices=sorted(smear.Slit_Quadratures.keys()),
+                        help='integration rule along the slit')
+    parser.add_argument('--nodes', type=int, default=None, dest='slit_nodes',
+                        help='number of abscissae along the slit (not used by "data" quadrature)')
+    parser.add_argument('--analytic-tail', action='store_true', default=None, dest='analytic_tail',
+                        help='kernel engines: integrate linear extrapolations exactly beyond Q max')
+    parser.add_argument('--storage', default=None, dest='kernel_storage',
+                        choices=sorted(smear.Kernel_Storage.keys()),
+                        help='storage of the kernel engine matrix')
+    parser.add_argument('--cache-MB', type=float, default=None, dest='smear_cache_MB',
+                        help='tiled engine: memory (MB) for the tiles kept between iterations')
+    parser.add_argument('-j', '--threads', type=int, default=None, dest='n_threads',
+                        help='number of threads to smear blocks of Q')
+    parser.add_argument('--kernel-cache', default=None, dest='kernel_cache_dir',
+                        help='directory of smearing kernels kept for later runs')
+    parser.add_argument('--kernel-cache-MB', type=float, default=None, dest='kernel_cache_MB',
+                        help='size limit (MB) of the --kernel-cache directory')
+    parser.add_argument('--checkpoint', type=int, default=None, dest='checkpoint_interval',
+                        help='save the state every CHECKPOINT iterations and resume from it')
+    parser.add_argument('--checkpoint-file', default=None, dest='checkpoint_file',
+                        help='name of the checkpoint file (default: OUTFILE%s)' % desmear.CHECKPOINT_EXTENSION)
+    parser.add_argument('--sidecar', action='store_true', default=None, dest='data_sidecar',
+                        help='keep a binary copy of the data file, read instead of the text when up to date')
+    parser.add_argument('-q', '--quiet', action='store_true', default=False,
+                        help='no output except for errors')
+    return parser
+
+
+def get_params(options):
+    '''
+    desmearing parameters from the command-line options
+    (and the command input file, if given)
+
+    :param obj options: parsed command-line options
+    :return: Info object with desmearing parameters
+    :raises ValueError: if required parameters are missing or not consistent,
+        or the command input file cannot be read
+    '''
+    if options.inp is not None:
+        try:
+            params = fileio_inp.CommandInput().read(os.path.abspath(options.inp))
+        except (RuntimeError, IOError, KeyError, IndexError, ValueError), exc:
+            msg = "could not read command input file: %s (%s: %s)"
+            raise ValueError, msg % (options.inp, exc.__class__.__name__, str(exc))
+        if params is None:
+            raise ValueError, "could not read command input file: " + options.inp
+    else:
+        params = info.Info()
+        params.infile = None
+        params.slitlength = None
+        params.sFinal = None
+        params.NumItr = 10
+
+    for key in ('infile', 'outfile', 'slitlength', 'sFinal', 'extrapname', 'LakeWeighting',
+                'desmear_method', 'regularization', 'regularization_weight',
+                'uncertainty', 'mc_replicas', 'mc_seed',
+                'acceleration', 'acceleration_depth',
+                'NumItr', 'stop_tolerance', 'stop_window', 'smear_engine',
+                'slit_quadrature', 'slit_nodes', 'analytic_tail', 'kernel_storage',
+                'smear_cache_MB', 'n_threads', 'kernel_cache_dir', 'kernel_cache_MB',
+                'checkpoint_interval', 'checkpoint_file', 'data_sidecar'):
+        value = getattr(options, key)
+        if value is not None:
+            setattr(params, key, value)
+    if options.stopping is not None:
+        params.stopping = tuple(options.stopping)
+    params.quiet = True
+    params.callback = None
+
+    for key in ('infile', 'slitlength', 'sFinal'):
+        if getattr(params, key) in (None, ''):
+            raise ValueError, "missing parameter: " + key
+    params.infile = os.path.abspath(params.infile)
+    if options.outfile is None and options.inp is None:
+        params.outfile = os.path.splitext(params.infile)[0] + '.dsm'
+    if params.NumItr == 0:
+        if len(params.stopping) == 0:
+            raise ValueError, "with 0 iterations, at least one --stop criterion is needed"
+        params.NumItr = info.INFINITE_ITERATIONS
+    return params
+
+
+def desmear_data(params, quiet=False):
+    '''
+    read the data, desmear, and write the result
+
+    With ``params.checkpoint_interval``, the state is saved every few 
+    iterations (see :meth:`~jldesmear.jl_api.desmear.Desmearing.save_state()`),
+    a run that was interrupted continues from its checkpoint,
+    and the checkpoint is removed when the result has been written.
+
+    :param obj params: Info object with desmearing parameters
+    :param bool quiet: if True, then no printed output from this routine
+    :return: Desmearing (or DirectDesmearing) object, after the final iteration
+    '''
+    q, E, dE = toolbox.GetDat(params.infile, sidecar=params.data_sidecar)
+    if len(q) == 0:
+        raise ValueError, "no data points in " + params.infile
+    if params.sFinal > q[-1]:
+        raise ValueError, "Fit range out of data range"
+
+    checkpoint = desmear.checkpoint_filename(params)
+    dsm = desmear.resume_desmearing(q, E, dE, params)
+    if dsm.iteration_count > 0 and not quiet:
+        print("resumed from %s at #%d" % (checkpoint, dsm.iteration_count))
+    while dsm.more_iterations_ok():
+        dsm.iteration()
+        if not quiet:
+            print("#%d  ChiSqr=%g" % (dsm.iteration_count, dsm.ChiSqr[-1]))
+        if desmear.checkpoint_due(dsm):
+            dsm.save_state(checkpoint)
+    if params.uncertainty == 'montecarlo':
+        desmear.monte_carlo_uncertainty(dsm)
+    toolbox.SavDat(params.outfile, dsm.q, dsm.C, dsm.dC, quiet=quiet)
+    if params.checkpoint_interval and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    if not quiet:
+        print("stopped: %s, %s" % (dsm.stop_reason, str(params.extrap)))
+    return dsm
+
+
+def main(args=None):
+    '''
+    command-line program: desmear one dataset without interaction
+
+    :param [str] args: command-line arguments (default: ``sys.argv[1:]``)
+    :return: exit status, 0 if the desmeared data were written
+    :rtype: int
+    '''
+    parser = get_parser()
+    options = parser.parse_args(args)
+    try:
+        params = get_params(options)
+    except ValueError, exc:
+        parser.print_usage(sys.stderr)
+        sys.stderr.write('%s: error: %s\n' % (parser.prog, str(exc)))
+        return 2
+    try:
+        desmear_data(params, options.quiet)
+    except Exception, exc:
+        sys.stderr.write('%s: desmearing failed: %s\n' % (parser.prog, str(exc)))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -13,6 +13,35 @@ desmearing parameters::
     extrap = None                   # extrapolation function object
     quiet = False                   # suppress output from desmearing operations
     callback = None                 # function object to call after each desmearing iteration
+    data_sidecar = False            # keep a binary copy of infile, see toolbox.GetDat
+    smear_engine = "loop"           # how to compute the smearing, see smear.Smearing_Engines
+    smear_block_size = None         # rows smeared at once by vectorized engines (None = automatic)
+    slit_quadrature = "data"        # integration rule along the slit, see smear.Slit_Quadratures
+    slit_nodes = 64                 # abscissae along the slit (not used by "data" rule)
+    analytic_tail = False           # kernel engines: integrate linear extrapolations exactly
+    kernel_storage = "auto"         # "kernel" engine matrix, see smear.Kernel_Storage
+    smear_cache_MB = 256            # "tiled" engine: memory for the tiles kept between iterations
+    n_threads = 1                   # threads to smear blocks of q, see smear.map_blocks
+    kernel_cache_dir = None         # directory of kernels kept between runs (None: not kept)
+    kernel_cache_MB = 2048          # size limit of kernel_cache_dir, see kernel_cache.KernelCache
+    acceleration = "none"           # acceleration of the Lake iteration, see desmear.Acceleration_Methods
+    acceleration_depth = 5          # "anderson": number of previous corrections combined
+    desmear_method = "lake"         # desmearing method, see desmear.Desmearing_Methods
+    regularization = "gcv"          # "direct": choice of weight, see desmear.Regularization_Criteria
+    regularization_weight = None    # "direct": fixed weight (None: choose by regularization)
+    direct_nonnegative = True       # "direct": non-negative least squares if C is not all positive
+    uncertainty = "none"            # estimate of dC, see desmear.Uncertainty_Methods
+    mc_replicas = 200               # "montecarlo": number of resampled datasets
+    mc_seed = None                  # "montecarlo": seed of the random numbers (None: not repeatable)
+    checkpoint_interval = 0         # iterations between automatic checkpoints (0: none)
+    checkpoint_file = None          # checkpoint (None: outfile with desmear.CHECKPOINT_EXTENSION)
+    extrap_update = "always"        # when to refit the extrapolation, see desmear.Extrapolation_Updates
+    extrap_interval = 1             # refit every extrap_interval iterations ("interval")
+    extrap_tolerance = 1e-3         # refit if C(q>=sFinal) moved more than this ("tolerance")
+    stopping = ()                   # automatic stopping criteria, see desmear.Stopping_Criteria
+    stop_window = 3                 # "converged": iterations over which ChiSqr change is measured
+    stop_tolerance = 1e-3           # "converged": largest relative ChiSqr change
+    stop_reduced_ChiSqr = 1.0       # "reduced_ChiSqr": stop when ChiSqr/N is this or less
 '''
 
 
@@ -33,6 +62,35 @@ class Info(object):
     extrap = None                   # extrapolation function object
     quiet = True                    # suppress progress indicator (spinner) output during smearing
     callback = None                 # function object to call after each desmearing iteration
+    data_sidecar = False            # keep a binary copy of infile, see toolbox.GetDat
+    smear_engine = "loop"           # how to compute the smearing, see smear.Smearing_Engines
+    smear_block_size = None         # rows smeared at once by vectorized engines (None = automatic)
+    slit_quadrature = "data"        # integration rule along the slit, see smear.Slit_Quadratures
+    slit_nodes = 64                 # abscissae along the slit (not used by "data" rule)
+    analytic_tail = False           # kernel engines: integrate linear extrapolations exactly
+    kernel_storage = "auto"         # "kernel" engine matrix, see smear.Kernel_Storage
+    smear_cache_MB = 256            # "tiled" engine: memory for the tiles kept between iterations
+    n_threads = 1                   # threads to smear blocks of q, see smear.map_blocks
+    kernel_cache_dir = None         # directory of kernels kept between runs (None: not kept)
+    kernel_cache_MB = 2048          # size limit of kernel_cache_dir, see kernel_cache.KernelCache
+    acceleration = "none"           # acceleration of the Lake iteration, see desmear.Acceleration_Methods
+    acceleration_depth = 5          # "anderson": number of previous corrections combined
+    desmear_method = "lake"         # desmearing method, see desmear.Desmearing_Methods
+    regularization = "gcv"          # "direct": choice of weight, see desmear.Regularization_Criteria
+    regularization_weight = None    # "direct": fixed weight (None: choose by regularization)
+    direct_nonnegative = True       # "direct": non-negative least squares if C is not all positive
+    uncertainty = "none"            # estimate of dC, see desmear.Uncertainty_Methods
+    mc_replicas = 200               # "montecarlo": number of resampled datasets
+    mc_seed = None                  # "montecarlo": seed of the random numbers (None: not repeatable)
+    checkpoint_interval = 0         # iterations between automatic checkpoints (0: none)
+    checkpoint_file = None          # checkpoint (None: outfile with desmear.CHECKPOINT_EXTENSION)
+    extrap_update = "always"        # when to refit the extrapolation, see desmear.Extrapolation_Updates
+    extrap_interval = 1             # refit every extrap_interval iterations ("interval")
+    extrap_tolerance = 1e-3         # refit if C(q>=sFinal) moved more than this ("tolerance")
+    stopping = ()                   # automatic stopping criteria, see desmear.Stopping_Criteria
+    stop_window = 3                 # "converged": iterations over which ChiSqr change is measured
+    stop_tolerance = 1e-3           # "converged": largest relative ChiSqr change
+    stop_reduced_ChiSqr = 1.0       # "reduced_ChiSqr": stop when ChiSqr/N is this or less
     
     parameterfile = ''              # name of file with program parameters
     fileio_class = None             # file format support class
@@ -52,6 +110,37 @@ class Info(object):
         s.append( 'LakeWeighting: %s' % self.LakeWeighting )
         s.append( 'extrap: %s' % str(self.extrap) )
         s.append( 'quiet: %s' % self.quiet )
+        s.append( 'smear_engine: %s' % self.smear_engine )
+        s.append( 'smear_block_size: %s' % str(self.smear_block_size) )
+        s.append( 'slit_quadrature: %s' % self.slit_quadrature )
+        if self.slit_quadrature != 'data':
+            s.append( 'slit_nodes: %d' % self.slit_nodes )
+        s.append( 'analytic_tail: %s' % self.analytic_tail )
+        s.append( 'kernel_storage: %s' % self.kernel_storage )
+        if self.smear_engine == 'tiled':
+            s.append( 'smear_cache_MB: %g' % self.smear_cache_MB )
+        s.append( 'n_threads: %d' % self.n_threads )
+        if self.kernel_cache_dir is not None:
+            s.append( 'kernel_cache_dir: %s' % self.kernel_cache_dir )
+            s.append( 'kernel_cache_MB: %g' % self.kernel_cache_MB )
+        s.append( 'desmear_method: %s' % self.desmear_method )
+        if self.desmear_method == 'direct':
+            s.append( 'regularization: %s' % self.regularization )
+            s.append( 'regularization_weight: %s' % str(self.regularization_weight) )
+        s.append( 'uncertainty: %s' % self.uncertainty )
+        if self.uncertainty == 'montecarlo':
+            s.append( 'mc_replicas: %d' % self.mc_replicas )
+        s.append( 'acceleration: %s' % self.acceleration )
+        if self.acceleration == 'anderson':
+            s.append( 'acceleration_depth: %d' % self.acceleration_depth )
+        if self.checkpoint_interval:
+            s.append( 'checkpoint_interval: %d' % self.checkpoint_interval )
+        s.append( 'extrap_update: %s' % self.extrap_update )
+        s.append( 'stopping: %s' % ', '.join(self.stopping) )
+        if self.extrap_update == 'interval':
+            s.append( 'extrap_interval: %d' % self.extrap_interval )
+        if self.extrap_update == 'tolerance':
+            s.append( 'extrap_tolerance: %g' % self.extrap_tolerance )
         #s.append( 'callback: %s' % str(self.callback) )
         return "\n".join(s)
 
@@ -0,0 +1,299 @@
+#!/usr/bin/env python
+
+'''
+Persistent cache of smearing kernels
+
+A :class:`~jldesmear.jl_api.smear.SmearingKernel` (used by the ``kernel``
+and ``cached`` smearing engines) depends only on the *q* grid, the slit length,
+*sFinal*, and the settings of the kernel, which are often the same for
+many datasets and many runs.  A :class:`KernelCache` keeps each kernel
+in a subdirectory of the cache directory, named by a hash of *q*
+and these parameters (the *key*).  The arrays of the kernel are
+saved as NumPy ``.npy`` files and are memory-mapped when loaded,
+so that the kernel is read from disk only as it is used and
+processes smearing on the same *q* grid share the same pages.
+When the files in the cache directory exceed its size limit,
+the kernels used least recently are removed.
+
+The ``tiled`` engine (:class:`~jldesmear.jl_api.smear.TiledKernel`)
+does not keep its kernel, so it is not cached.
+
+Example::
+
+    cache = kernel_cache.KernelCache('/tmp/kernels', size_MB=512)
+    kernel = cache.kernel('kernel', q, slitlength, sFinal, quadrature='gauss', nodes=64)
+    S = kernel.smear(C, extrap)
+
+Source Code Documentation
+^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^
+'''
+
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import numpy
+import scipy.sparse
+import smear
+
+
+CACHE_FORMAT = 1            # change when the arrays kept for a SmearingKernel change
+DEFAULT_SIZE_MB = 2048
+SETTINGS_FILE = 'settings.json'
+TEMPORARY_SUFFIX = '.tmp'
+
+# arrays of a SmearingKernel, always kept
+KERNEL_ARRAYS = ('q', 'x', 'weights', 'tail_rows', 'tail_u', 'tail_weights',
+                 'tail_beyond', 'tail_start')
+INTERP_TERMS = ('interp_row', 'interp_k', 'interp_f', 'interp_weight')
+SPARSE_MATRIX = ('matrix_data', 'matrix_indices', 'matrix_indptr')
+
+
+def default_directory():
+    '''
+    default cache directory: ``$JLDESMEAR_CACHE`` or ``~/.cache/jldesmear``
+
+    :rtype: str
+    '''
+    default = os.path.join(os.path.expanduser('~'), '.cache', 'jldesmear')
+    return os.environ.get('JLDESMEAR_CACHE', default)
+
+
+def kernel_settings(engine, slitlength, sFinal, weighted_transition=True,
+                    quadrature='data', nodes=None, analytic_tail=False, storage='auto'):
+    '''
+    parameters that determine a smearing kernel, other than *q*
+
+    :param str engine: ``kernel`` or ``cached``, other parameters as for
+        :func:`~jldesmear.jl_api.smear.make_kernel()`
+    :rtype: dict
+    '''
+    return dict(
+        format = CACHE_FORMAT,
+        engine = engine,
+        slitlength = float(slitlength),
+        sFinal = float(sFinal),
+        weighted_transition = bool(weighted_transition),
+        quadrature = quadrature,
+        nodes = None if quadrature == 'data' else int(nodes),
+        analytic_tail = bool(analytic_tail),
+        storage = storage if engine == 'kernel' else None,
+    )
+
+
+def kernel_key(q, settings):
+    '''
+    key of a smearing kernel in the cache: hash of *q* and the *settings*
+
+    :param numpy.ndarray q: magnitude of scattering vector
+    :param dict settings: from :func:`kernel_settings()`
+    :rtype: str
+    '''
+    digest = hashlib.sha1()
+    digest.update(numpy.ascontiguousarray(q, dtype=float).tostring())
+    digest.update(json.dumps(settings, sort_keys=True))
+    return digest.hexdigest()
+
+
+def kernel_arrays(kernel):
+    '''
+    arrays of a :class:`~jldesmear.jl_api.smear.SmearingKernel`, by name
+
+    :rtype: dict
+    '''
+    arrays = dict([(name, getattr(kernel, name)) for name in KERNEL_ARRAYS])
+    if kernel.limits is not None:
+        arrays['limits_lo'], arrays['limits_hi'] = kernel.limits
+    if kernel.interp_terms is not None:
+        arrays.update(zip(INTERP_TERMS, kernel.interp_terms))
+    if kernel.sparse:
+        matrix = kernel.matrix
+        arrays.update(zip(SPARSE_MATRIX, (matrix.data, matrix.indices, matrix.indptr)))
+    elif kernel.matrix is not None:
+        arrays['matrix'] = kernel.matrix
+    return arrays
+
+
+def restore_kernel(settings, arrays):
+    '''
+    :class:`~jldesmear.jl_api.smear.SmearingKernel` from its settings and arrays
+
+    :param dict settings: as saved by :meth:`KernelCache.save()`
+    :param dict arrays: from :func:`kernel_arrays()`
+    :rtype: smear.SmearingKernel
+    '''
+    kernel = smear.SmearingKernel.__new__(smear.SmearingKernel)
+    for name in KERNEL_ARRAYS:
+        setattr(kernel, name, arrays[name])
+    kernel.slitlength = settings['slitlength']
+    kernel.sFinal = settings['sFinal']
+    kernel.weighted_transition = settings['weighted_transition']
+    kernel.interpolation = {'kernel': 'linear', 'cached': 'log'}[settings['engine']]
+    kernel.quadrature = settings['quadrature']
+    kernel.nodes = settings['nodes']
+    kernel.analytic_tail = settings['analytic_tail']
+    kernel.sparse = settings['sparse']
+    kernel.block_size = settings['block_size']
+    kernel.qMax = kernel.q[-1]
+    kernel.limits = None
+    if 'limits_lo' in arrays:
+        kernel.limits = (arrays['limits_lo'], arrays['limits_hi'])
+    kernel.interp_terms = None
+    if INTERP_TERMS[0] in arrays:
+        kernel.interp_terms = [arrays[name] for name in INTERP_TERMS]
+    kernel.matrix = arrays.get('matrix')
+    if kernel.sparse:
+        NumPts = len(kernel.q)
+        terms = [arrays[name] for name in SPARSE_MATRIX]
+        kernel.matrix = scipy.sparse.csr_matrix(tuple(terms), shape=(NumPts, NumPts), copy=False)
+    kernel.tail_matrices = {}
+    return kernel
+
+
+class KernelCache(object):
+    '''
+    smearing kernels kept in a directory, for use by later processes
+
+    :param str directory: cache directory (default: :func:`default_directory()`),
+        created when needed
+    :param float size_MB: largest size of the files in the cache directory
+    '''
+
+    def __init__(self, directory=None, size_MB=DEFAULT_SIZE_MB):
+        self.directory = os.path.abspath(os.path.expanduser(directory or default_directory()))
+        self.size_bytes = size_MB * 2**20
+
+    def path(self, key):
+        '''subdirectory of the kernel with this key'''
+        return os.path.join(self.directory, key)
+
+    def kernel(self, engine, q, slitlength, sFinal, weighted_transition=True, block_size=None,
+               quadrature='data', nodes=None, analytic_tail=False, storage='auto',
+               cache_MB=smear.TILE_CACHE_MB):
+        '''
+        smearing kernel, from the cache or computed and saved in the cache
+
+        Parameters are as for :func:`~jldesmear.jl_api.smear.make_kernel()`.
+        Kernels for the ``tiled`` engine are computed, not cached.
+
+        :rtype: smear.SmearingKernel
+        '''
+        if engine not in ('kernel', 'cached'):
+            return smear.make_kernel(engine, q, slitlength, sFinal, weighted_transition,
+                                     block_size, quadrature, nodes, analytic_tail, storage,
+                                     cache_MB)
+        settings = kernel_settings(engine, slitlength, sFinal, weighted_transition,
+                                   quadrature, nodes, analytic_tail, storage)
+        key = kernel_key(q, settings)
+        kernel = self.load(key)
+        if kernel is None or not numpy.array_equal(kernel.q, q):
+            kernel = smear.make_kernel(engine, q, slitlength, sFinal, weighted_transition,
+                                       block_size, quadrature, nodes, analytic_tail, storage)
+            self.save(key, kernel, settings)
+            self.evict(keep=key)
+        return kernel
+
+    def load(self, key):
+        '''
+        memory-mapped kernel with this key
+
+        :return: kernel or None if not in the cache (or not readable)
+        :rtype: smear.SmearingKernel
+        '''
+        path = self.path(key)
+        try:
+            with open(os.path.join(path, SETTINGS_FILE), 'r') as fp:
+                settings = json.load(fp)
+            arrays = {}
+            for name in settings['arrays']:
+                filename = os.path.join(path, name + '.npy')
+                arrays[name] = numpy.load(filename, mmap_mode='r')
+            kernel = restore_kernel(settings, arrays)
+            os.utime(path, None)        # now the most recently used
+        except (IOError, OSError, ValueError, KeyError):
+            return None
+        return kernel
+
+    def save(self, key, kernel, settings):
+        '''
+        save the kernel with this key
+
+        The files are written into a temporary directory that is then
+        renamed, so that other processes find either all of the kernel or none.
+
+        :param str key: from :func:`kernel_key()`
+        :param obj kernel: :class:`~jldesmear.jl_api.smear.SmearingKernel`
+        :param dict settings: from :func:`kernel_settings()`
+        '''
+        if not os.path.exists(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError:
+                if not os.path.isdir(self.directory):
+                    raise
+        temporary = tempfile.mkdtemp(prefix=key + '.', suffix=TEMPORARY_SUFFIX,
+                                     dir=self.directory)
+        try:
+            arrays = kernel_arrays(kernel)
+            for name, array in arrays.items():
+                numpy.save(os.path.join(temporary, name + '.npy'), array)
+            settings = dict(settings)
+            settings.update(arrays=sorted(arrays.keys()),
+                            sparse=bool(kernel.sparse), block_size=int(kernel.block_size))
+            with open(os.path.join(temporary, SETTINGS_FILE), 'w') as fp:
+                json.dump(settings, fp, indent=2, sort_keys=True)
+            os.rename(temporary, self.path(key))
+        except OSError:
+            pass        # already saved by another process
+        finally:
+            if os.path.exists(temporary):
+                shutil.rmtree(temporary, True)
+
+    def entries(self):
+        '''
+        kernels in the cache, least recently used first
+
+        :return: list of (time of last use, size in bytes, key)
+        :rtype: [(float, int, str)]
+        '''
+        if not os.path.isdir(self.directory):
+            return []
+        entries = []
+        for key in os.listdir(self.directory):
+            path = self.path(key)
+            if key.endswith(TEMPORARY_SUFFIX) or not os.path.isdir(path):
+                continue
+            try:
+                size = sum([os.path.getsize(os.path.join(path, fn)) for fn in os.listdir(path)])
+                entries.append((os.path.getmtime(path), size, key))
+            except OSError:
+                pass    # removed by another process
+        return sorted(entries)
+
+    def evict(self, keep=None):
+        '''
+        remove the kernels used least recently until the cache fits its size limit
+
+        :param str keep: (optional) key of a kernel not to be removed
+        :return: keys of the kernels removed
+        :rtype: [str]
+        '''
+        entries = self.entries()
+        total = sum([size for _, size, _ in entries])
+        removed = []
+        for _, size, key in entries:
+            if total <= self.size_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(self.path(key), True)
+            total -= size
+            removed.append(key)
+        return removed
+
+    def clear(self):
+        '''remove all kernels from the cache'''
+        for _, _, key in self.entries():
+            shutil.rmtree(self.path(key), True)
@@ -20,16 +20,58 @@ For *q* values in between given data points, interpolation is
 used.  Log interpolation is tried first.  If this fails due 
 to a ValueError Exception, linear interpolation is used.
 
+The smearing may be computed by one of several engines 
+(see ``Smearing_Engines``).  The ``kernel`` engine precomputes
+the smearing operator for the *q* grid and slit length 
+(:class:`~jldesmear.api.smear.SmearingKernel`) 
+so that each desmearing iteration is a matrix-vector product.
+The ``vectorized`` engine gives the same result as the traditional
+``loop`` engine, computing many *q* at once with NumPy arrays.
+The ``cached`` engine also gives the same result, keeping the
+interpolation geometry from one call to the next in a 
+:class:`~jldesmear.api.smear.SmearingKernel`.
+When that geometry is too large to keep, the ``tiled`` engine
+computes it in tiles of rows as needed and keeps the most 
+recently used tiles, up to a fixed amount of memory
+(:class:`~jldesmear.api.smear.TiledKernel`).
+
+The integration along the slit uses the abscissae and weights
+of one of the rules in ``Slit_Quadratures``
+(:func:`~jldesmear.api.smear.slit_quadrature()`).
+The traditional rule (``data``) uses as many nodes as there are
+data points, spaced like the data, so the cost of each smearing
+grows as N^2.  The other rules use a fixed number of nodes, *M*, 
+independent of the data, so the cost grows as N*M.  With these rules,
+the weight of the extrapolation in the transition region
+(``sFinal < u <= qMax``) increases linearly with *u*
+(see :func:`~jldesmear.api.smear.transition_limits()`)
+rather than with the index of the node, so that the integrand
+does not depend on the choice of nodes.
+
+The smeared intensity of each *q* is independent of the others,
+so any of the engines may divide the *q* range into blocks
+and evaluate them with a pool of threads (``n_threads``, 
+see :func:`~jldesmear.api.smear.map_blocks()`).  The pools are
+created on first use and kept for later calls (see :func:`thread_pool()`).
+NumPy releases 
+the GIL in most of its array operations so the ``vectorized``, 
+``kernel``, ``cached``, and ``tiled`` engines can use several cores.
+The result does not depend on the number of threads.
+
 Source Code Documentation
 ^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^
 '''
 
 
+import collections
 import math
-import os                        #@UnusedImport
+import multiprocessing.pool
+import os
 import sys
 import pprint
+import threading
 import numpy
+import scipy.sparse
 from scipy.interpolate import interp1d
 import toolbox
 import extrapolation             #@UnusedImport
@@ -86,6 +128,23 @@ def Plengt (l, slitlength):
     return result
 
 
+def fit_range_start(q, sFinal):
+    '''
+    index of the first data point used to fit the extrapolation
+    
+    :param numpy.ndarray q: magnitude of scattering vector (increasing)
+    :param float sFinal: fit extrapolation to I(q) for q >= sFinal
+    :return: index of first *q* beyond *sFinal*
+    :rtype: int
+    '''
+    if sFinal > q[-1]:
+        raise Exception, "no data to fit extrapolation"
+    start = min(numpy.searchsorted(q, sFinal, side='right'), len(q) - 1)
+    if len(q) - start < 2:
+        raise Exception, "not enough data to fit"
+    return start
+
+
 def prepare_extrapolation(q, C, dC, extrapname, sFinal):
     '''
     Pick the extrapolation function for smearing
@@ -98,15 +157,7 @@ def prepare_extrapolation(q, C, dC, extrapname, sFinal):
     :return: function object of selected extrapolation
     :rtype: object
     '''
-    if sFinal > q[-1]:
-        raise Exception, "no data to fit extrapolation"
-    for i in range(len(q)):
-        start = i
-        if q[i] > sFinal:
-            break
-    if len(q) - start < 2:
-        raise Exception, "not enough data to fit"
-
+    start = fit_range_start(q, sFinal)
     functions = extrapolation.discover_extrapolations()
     if extrapname not in functions.keys():
         msg = "did not identify extrapolation function: " + extrapname
@@ -116,9 +167,799 @@ def prepare_extrapolation(q, C, dC, extrapname, sFinal):
     return extrap
 
 
-# TODO: refactor Smear into a class
+Smearing_Engines = {
+    'loop':       'integrate the slit for each q in turn',
+    'kernel':     'precomputed kernel matrix: S = K C + extrapolated tail',
+    'vectorized': 'integrate the slit for many q at once, in blocks of rows',
+    'cached':     'precomputed log-interpolation geometry: gather and interpolate log(C)',
+    'tiled':      'log-interpolation geometry computed in tiles of rows, recently used tiles kept',
+}
+
+
+Slit_Quadratures = {
+    'data':      'trapezoid rule, one node per data point, spaced like q (traditional)',
+    'trapezoid': 'trapezoid rule on evenly spaced nodes',
+    'gauss':     'Gauss-Legendre rule',
+    'log':       'trapezoid rule on nodes evenly spaced in log(x + q0), fine spacing near x=0',
+}
+
+
+def trapezoid_weights(x):
+    '''
+    weights of the trapezoid rule on the abscissae *x*
+    
+    ``numpy.sum(trapezoid_weights(x) * y)`` is the same as ``numpy.trapz(y, x)``
+    
+    :param numpy.ndarray x: integration abscissae
+    :return: integration weight for each abscissa
+    :rtype: numpy.ndarray
+    '''
+    dx = numpy.diff(x)
+    weights = numpy.zeros((len(x),))
+    weights[:-1] += 0.5 * dx
+    weights[1:] += 0.5 * dx
+    return weights
+
+
+def slit_quadrature(q, slitlength, rule='data', nodes=None):
+    '''
+    abscissae and weights for integration along the slit, :math:`0 \\le x \\le l_o`
+    
+    ``numpy.sum(dx * f(x))`` approximates the integral of *f* from 0 to *slitlength*
+    
+    * ``data``: the traditional abscissae ``x = slitlength * (q - q0) / qRange``,
+      trapezoid rule (*nodes* is ignored)
+    * ``trapezoid``: *nodes* evenly spaced abscissae, trapezoid rule
+    * ``gauss``: *nodes* Gauss-Legendre abscissae and weights
+    * ``log``: *nodes* abscissae from 0 to *slitlength*, 
+      evenly spaced in :math:`\\log(x + q_0)`, trapezoid rule
+    
+    :param numpy.ndarray q: magnitude of scattering vector
+    :param float slitlength: l_o, same units as q
+    :param str rule: one of the keys of ``Slit_Quadratures``
+    :param int nodes: number of abscissae (not used by the ``data`` rule)
+    :return: tuple of (x, dx), abscissae and their integration weights
+    :rtype: (numpy.ndarray, numpy.ndarray)
+    '''
+    if rule not in Slit_Quadratures:
+        msg = "slit quadrature must be one of " + str(sorted(Slit_Quadratures.keys()))
+        msg += ", got " + str(rule)
+        raise ValueError, msg
+    q = numpy.array(q, dtype=float)
+    if rule == 'data':
+        x = slitlength * (q - q[0]) / (q[-1] - q[0])
+        return x, trapezoid_weights(x)
+    if nodes is None or nodes < 2:
+        raise ValueError, "slit quadrature needs at least 2 nodes, got " + str(nodes)
+    if rule == 'gauss':
+        t, weights = numpy.polynomial.legendre.leggauss(nodes)
+        return 0.5 * slitlength * (t + 1), 0.5 * slitlength * weights
+    if rule == 'trapezoid':
+        x = numpy.linspace(0, slitlength, nodes)
+    else:
+        # spacing grows geometrically beyond x ~ q0 where C(sqrt(q0^2+x^2)) varies
+        x_c = max(abs(q[0]), slitlength * (q[1] - q[0]) / (q[-1] - q[0]))
+        x = x_c * ((1 + slitlength/x_c)**numpy.linspace(0, 1, nodes) - 1)
+        x[-1] = slitlength
+    return x, trapezoid_weights(x)
+
+
+def transition_limits(q, sFinal, qMax, slitlength):
+    '''
+    range of *u* in the transition region (``sFinal < u <= qMax``) for each *q*
+    
+    :param numpy.ndarray q: magnitude of scattering vector
+    :param float sFinal: fit extrapolation to I(q) for q >= sFinal
+    :param float qMax: largest *q* of the data
+    :param float slitlength: l_o, same units as q
+    :return: tuple of (lo, hi), the extrapolation fraction is 0 at *lo* and 1 at *hi*
+    :rtype: (numpy.ndarray, numpy.ndarray)
+    '''
+    lo = numpy.maximum(q, sFinal)
+    hi = numpy.minimum(numpy.sqrt(q*q + slitlength*slitlength), qMax)
+    return lo, hi
+
+
+def extrapolation_fraction(u, sFinal, qMax, weighted_transition=True, limits=None):
+    '''
+    fraction of the integrand to take from the extrapolation at each *u*
+    
+    This is the same division of the integrand into regions
+    as in :func:`get_Ic()`, for many *q* at once:
+    
+    * ``u <= sFinal``: 0, interpolate from existing data
+    * ``sFinal < u <= qMax``: smooth transition from 0 to 1
+      (0 if *weighted_transition* is False or less than two points)
+    * ``qMax < u``: 1, extrapolate from model
+    
+    :param numpy.ndarray u: 2-D array of ``sqrt(q^2 + x^2)``, one row per *q*, 
+        increasing along each row
+    :param float sFinal: fit extrapolation to I(q) for q >= sFinal
+    :param float qMax: largest *q* of the data
+    :param bool weighted_transition: if True, make a weighted transition between sFinal <= q < qMax
+    :param tuple limits: (optional) (lo, hi) from :func:`transition_limits()`, one of each per row: 
+        transition increases linearly in *u* from *lo* to *hi*, 
+        rather than with the column (the default)
+    :return: 2-D array (same shape as *u*) of the extrapolation fraction
+    :rtype: numpy.ndarray
+    '''
+    fraction = numpy.where(qMax < u, 1.0, 0.0)
+    if weighted_transition:
+        mid = numpy.multiply(sFinal < u, u <= qMax)
+        if limits is None:
+            n_mid = mid.sum(axis=1)
+            first = (u <= sFinal).sum(axis=1)     # column of first point in transition
+            columns = numpy.arange(u.shape[1])
+            span = numpy.maximum(n_mid - 1, 1).astype(float)
+            ramp = (columns[None, :] - first[:, None]) / span[:, None]
+            ramp = numpy.where(mid, ramp, 0)
+            ramp[n_mid < 2] = 0
+        else:
+            lo, hi = limits
+            span = numpy.where(hi > lo, hi - lo, 1)
+            ramp = numpy.clip((u - lo[:, None]) / span[:, None], 0, 1)
+        fraction = numpy.where(mid, ramp, fraction)
+    return fraction
+
+
+Kernel_Storage = {
+    'dense':  'numpy array, N x N',
+    'sparse': 'scipy.sparse CSR matrix, only the band of C sampled by each row',
+    'auto':   'sparse if the band is less than SPARSE_DENSITY of the matrix, otherwise dense',
+}
+SPARSE_DENSITY = 0.25
+
+# default memory (MB) for the tiles kept by a TiledKernel
+TILE_CACHE_MB = 256
+
+
+def kernel_band(q, slitlength):
+    '''
+    columns of the (linear) smearing operator that may be nonzero in each row
+    
+    Row *i* samples *C* only for :math:`q_i \\le u \\le \\sqrt{q_i^2+l_o^2}`.
+    When the slit length is small compared with the *q* range,
+    the operator is upper-banded.
+    
+    :param numpy.ndarray q: magnitude of scattering vector (increasing)
+    :param float slitlength: l_o, same units as q
+    :return: tuple of (first, last) column of each row
+    :rtype: (numpy.ndarray, numpy.ndarray)
+    '''
+    q = numpy.asarray(q, dtype=float)
+    NumPts = len(q)
+    u_max = numpy.minimum(numpy.sqrt(q*q + slitlength*slitlength), q[-1])
+    first = numpy.clip(numpy.searchsorted(q, q, side='right') - 1, 0, NumPts-2)
+    last = numpy.minimum(numpy.searchsorted(q, u_max, side='right'), NumPts-1)
+    return first, last
+
 
-def Smear(q, C, dC, extrapname, sFinal, slitlength, quiet = False, weighted_transition=True):
+def kernel_density(q, slitlength):
+    '''
+    upper limit of the fraction of the (linear) smearing operator that is nonzero
+    
+    :rtype: float
+    '''
+    first, last = kernel_band(q, slitlength)
+    return numpy.sum(last - first + 1) / float(len(q))**2
+
+
+_thread_pools = {}                  # thread_pool(): pools by (process id, number of threads)
+_thread_pools_lock = threading.Lock()
+_pool_thread = threading.local()    # pool_map(): marks the threads of the pools
+
+
+def thread_pool(n_threads):
+    '''
+    pool of *n_threads* threads, shared by all calls that ask for that many
+
+    The pool is created on first use and kept, so that each smearing
+    does not pay to start and stop its threads.  A process started
+    by ``fork`` creates its own pools.
+
+    :param int n_threads: number of threads
+    :rtype: multiprocessing.pool.ThreadPool
+    '''
+    key = (os.getpid(), n_threads)
+    with _thread_pools_lock:
+        pool = _thread_pools.get(key)
+        if pool is None:
+            pool = multiprocessing.pool.ThreadPool(n_threads)
+            _thread_pools[key] = pool
+    return pool
+
+
+def pool_map(func, items, n_threads=1):
+    '''
+    ``[func(item) for item in items]``, evaluated by the pool of *n_threads* threads
+
+    Called from a thread of one of the pools, the items are evaluated
+    in that thread, since waiting for the pool there could wait forever.
+
+    :param obj func: function of one item
+    :param [obj] items: arguments of *func*
+    :param int n_threads: number of threads
+    :return: results of *func*, in order of *items*
+    :rtype: list
+    '''
+    if n_threads <= 1 or len(items) < 2 or getattr(_pool_thread, 'active', False):
+        return [func(item) for item in items]
+
+    def task(item):
+        _pool_thread.active = True
+        return func(item)
+
+    return thread_pool(n_threads).map(task, items)
+
+
+def map_blocks(func, NumPts, block_size, n_threads=1):
+    '''
+    evaluate ``func(start, stop)`` for blocks of rows and join the results in order of rows
+    
+    With more than one thread, the blocks are evaluated by a pool of 
+    threads (see :func:`pool_map()`) and made small enough 
+    that there are several blocks for each thread.
+    
+    :param obj func: function of (start, stop), returns rows ``start:stop`` 
+        (the last axis of the result)
+    :param int NumPts: number of rows
+    :param int block_size: largest number of rows in a block
+    :param int n_threads: number of threads
+    :return: results of *func*, joined along the last axis
+    :rtype: numpy.ndarray
+    '''
+    if n_threads > 1:
+        block_size = max(1, min(block_size, -(-NumPts // (4 * n_threads))))
+    blocks = [(start, min(start + block_size, NumPts)) for start in range(0, NumPts, block_size)]
+    parts = pool_map(lambda block: func(*block), blocks, n_threads)
+    return numpy.concatenate(parts, axis=-1)
+
+
+def rows_of(terms, start, stop):
+    '''
+    the terms of rows ``start:stop``
+    
+    :param tuple terms: arrays of terms, the first is the row of each term, in increasing order
+    :return: slices of each of the *terms*
+    :rtype: tuple
+    '''
+    first, last = numpy.searchsorted(terms[0], [start, stop])
+    return tuple([a[first:last] for a in terms])
+
+
+class SmearingKernel(object):
+    '''
+    precomputed slit-smearing operator for a fixed *q* grid and slit length
+    
+    The integration abscissae, the slit-length weighting function
+    :func:`Plengt()`, the geometry :math:`u = \\sqrt{q^2+x^2}`,
+    and the division into interpolated, transition, and extrapolated
+    regions depend only on *q*, *slitlength*, and *sFinal*.
+    These are computed once and reduced to a weight matrix *K*
+    and a list of extrapolated terms so that smearing becomes
+    
+    .. math::
+    
+        S = K \\cdot C + \\sum w_{tail} I_{extrap}(u_{tail})
+    
+    With ``interpolation='linear'``, interpolation between data points 
+    is linear in *C* (rather than the log interpolation of :func:`get_Ic()`)
+    so that the smearing of the measured range is a matrix product.
+    
+    Each row of *K* is nonzero only in the band of *C* sampled
+    by that row (see :func:`kernel_band()`).  When this band is narrow,
+    *K* is kept as a ``scipy.sparse`` CSR matrix (see ``Kernel_Storage``), 
+    so that memory and the matrix-vector product scale with the 
+    width of the band rather than N^2.  (The extrapolated terms 
+    of the rows with ``sqrt(q^2+l_o^2) > sFinal`` are kept for each 
+    abscissa, so for large N use a slit quadrature with fewer nodes
+    than the ``data`` rule.)
+    
+    With ``interpolation='log'``, the bracketing data points and
+    interpolation fractions of each *u* are kept instead of *K*.
+    Each smearing then needs only ``log(C)`` and a gather and 
+    linear interpolation, giving the same result as :func:`get_Ic()`.
+    
+    With ``analytic_tail=True``, extrapolations that are linear in their
+    coefficients (those that define ``basis``, such as ``constant``,
+    ``linear``, and ``Porod``) are reduced to a matrix *T* of shape 
+    ``(len(q), len(extrap.basis))``, computed once for each extrapolation,
+    so that smearing becomes
+    
+    .. math::
+    
+        S = K \\cdot C + T \\cdot c_{extrap}
+    
+    The part of *T* beyond *qMax* is integrated exactly 
+    (``extrap.basis_integrals()``), assuming that :func:`Plengt()` is 
+    constant along the slit.  The transition region is integrated
+    with the weights of the quadrature.  Other extrapolations 
+    (such as ``powerlaw``) are evaluated at each of the extrapolated terms.
+    
+    :param numpy.ndarray q: magnitude of scattering vector
+    :param float slitlength: l_o, same units as q
+    :param float sFinal: fit extrapolation to I(q) for q >= sFinal
+    :param bool weighted_transition: if True, make a weighted transition between sFinal <= q < qMax
+    :param int block_size: number of rows of *K* computed at once (limits temporary memory)
+    :param str interpolation: ``linear`` or ``log``
+    :param str quadrature: integration rule along the slit, one of the keys of ``Slit_Quadratures``
+    :param int nodes: number of abscissae along the slit (not used by the ``data`` rule)
+    :param bool analytic_tail: if True, integrate the extrapolation beyond *qMax* exactly,
+        when the extrapolation is linear in its coefficients
+    :param str storage: storage of *K* for ``linear`` interpolation, 
+        one of the keys of ``Kernel_Storage``
+    
+    The smearing methods accept ``n_threads`` to compute blocks 
+    of rows with a pool of threads (see :func:`map_blocks()`).
+    '''
+    
+    def __init__(self, q, slitlength, sFinal, weighted_transition=True, block_size=None,
+                 interpolation='linear', quadrature='data', nodes=None, analytic_tail=False,
+                 storage='auto'):
+        if storage not in Kernel_Storage:
+            msg = "kernel storage must be one of " + str(sorted(Kernel_Storage.keys()))
+            raise ValueError, msg + ", got " + str(storage)
+        if interpolation not in ('linear', 'log'):
+            raise ValueError, "interpolation must be 'linear' or 'log', got " + str(interpolation)
+        self.q = numpy.array(q, dtype=float)
+        self.slitlength = slitlength
+        self.sFinal = sFinal
+        self.weighted_transition = weighted_transition
+        self.interpolation = interpolation
+        self.quadrature = quadrature
+        self.nodes = nodes
+        self.analytic_tail = analytic_tail
+        NumPts = len(self.q)
+        self.qMax = self.q[-1]
+        self.x, dx = slit_quadrature(self.q, slitlength, quadrature, nodes)
+        # 2 * P_l(x) dx: symmetrical about zero
+        self.weights = 2 * Plengt(self.x, slitlength) * dx
+        self.limits = None
+        if quadrature != 'data':
+            self.limits = transition_limits(self.q, sFinal, self.qMax, slitlength)
+        self.matrix = None
+        self.interp_terms = None    # (row, k, f, weight) of interpolated terms, for log
+        self.sparse = False
+        if interpolation == 'linear':
+            if storage == 'auto':
+                self.sparse = kernel_density(self.q, slitlength) < SPARSE_DENSITY
+            else:
+                self.sparse = storage == 'sparse'
+            if not self.sparse:
+                self.matrix = numpy.zeros((NumPts, NumPts))
+        if block_size is None:
+            block_size = max(1, 2**20 // len(self.x))
+            if self.matrix is not None:
+                # limit the temporary rows of K
+                block_size = min(block_size, max(1, 2**22 // NumPts))
+        self.block_size = block_size
+        interp_terms, tail_terms = [], []
+        n_within = numpy.zeros((NumPts,), dtype=int)    # abscissae with u <= qMax, each row
+        for start in range(0, NumPts, block_size):
+            stop = min(start + block_size, NumPts)
+            interp, tail, n_within[start:stop] = self._build_rows(start, stop)
+            if interpolation == 'linear' and not self.sparse:
+                first, window = interp
+                self.matrix[start:stop, first:first + window.shape[1]] = window
+            else:
+                interp_terms.append(interp)
+            tail_terms.append(tail)
+        if self.sparse:
+            self.matrix = scipy.sparse.vstack(interp_terms, format='csr')
+        elif interpolation == 'log':
+            self.interp_terms = [numpy.concatenate(t) for t in zip(*interp_terms)]
+        self.tail_rows, self.tail_u, self.tail_weights, self.tail_beyond = [
+            numpy.concatenate(t) for t in zip(*tail_terms)]
+
+        # analytic tail: integrate beyond the quadrature cells of the abscissae with u <= qMax
+        cells = numpy.concatenate(([0], numpy.cumsum(dx)))
+        self.tail_start = numpy.where(n_within < len(self.x), cells[n_within], slitlength)
+        self.tail_matrices = {}     # T, for each extrapolation name
+
+    def _build_rows(self, start, stop):
+        '''
+        compute rows ``start:stop`` of the kernel
+        
+        :return: (interpolated terms, (row, u, weight, beyond) of the extrapolated terms,
+            number of abscissae with ``u <= qMax`` in each row)
+            where the interpolated terms are K[start:stop] for ``linear`` 
+            (CSR matrix if ``sparse``, otherwise (first column, columns of the band)) 
+            or (row, k, f, weight) for ``log`` interpolation
+            and *beyond* is True for terms with ``u > qMax``
+        '''
+        q = self.q
+        NumPts = len(q)
+        n_rows = stop - start
+        u = numpy.sqrt(q[start:stop, None]**2 + self.x[None, :]**2)
+        limits = None
+        if self.limits is not None:
+            limits = [a[start:stop] for a in self.limits]
+        fraction = extrapolation_fraction(u, self.sFinal, self.qMax, 
+                                          self.weighted_transition, limits)
+        row = numpy.repeat(numpy.arange(n_rows), len(self.x)).reshape(u.shape)
+
+        # interpolate from existing data: u is between q[k] and q[k+1]
+        inside = fraction < 1
+        u_in = u[inside]
+        k = numpy.searchsorted(q, u_in, side='right') - 1
+        k = numpy.clip(k, 0, NumPts-2)
+        dq = q[k+1] - q[k]
+        f = numpy.where(dq > 0, (u_in - q[k]) / numpy.where(dq > 0, dq, 1), 0)
+        w_in = (self.weights[None, :] * (1 - fraction))[inside]
+        # columns of the band of these rows
+        first = k.min() if k.size > 0 else 0
+        width = k.max() + 2 - first if k.size > 0 else 1
+        if self.interpolation == 'linear' and self.sparse and n_rows * width > 4 * k.size:
+            # few terms in a wide band: sum the terms of each (row, column), in order
+            index = row[inside] * NumPts + k
+            index, position = numpy.unique(numpy.concatenate((index, index + 1)), 
+                                           return_inverse=True)
+            data = numpy.bincount(position, numpy.concatenate((w_in * (1 - f), w_in * f)))
+            indptr = numpy.searchsorted(index, numpy.arange(n_rows + 1) * NumPts)
+            interp = scipy.sparse.csr_matrix((data, index % NumPts, indptr), 
+                                             shape=(n_rows, NumPts))
+        elif self.interpolation == 'linear':
+            index = row[inside] * width + k - first
+            window = numpy.bincount(index, w_in * (1 - f), minlength=n_rows*width)
+            window += numpy.bincount(index + 1, w_in * f, minlength=n_rows*width)
+            window = window.reshape((n_rows, width))
+            if self.sparse:
+                window = scipy.sparse.csr_matrix(window)
+                interp = scipy.sparse.csr_matrix(
+                    (window.data, window.indices + first, window.indptr), 
+                    shape=(n_rows, NumPts))
+            else:
+                interp = (first, window)
+        else:
+            interp = (row[inside] + start, k, f, w_in)
+
+        # extrapolate from model beyond range of available data
+        outside = fraction > 0
+        tail = (
+            row[outside] + start, 
+            u[outside], 
+            (self.weights[None, :] * fraction)[outside],
+            u[outside] > self.qMax,
+        )
+        return interp, tail, (u <= self.qMax).sum(axis=1)
+
+    def agrees(self, q, slitlength, sFinal, weighted_transition=True, interpolation=None,
+               quadrature='data', nodes=None, analytic_tail=False):
+        '''
+        Is this kernel suitable for the given terms?
+        
+        :param str interpolation: ``linear``, ``log``, or None (either)
+        :return: True if the kernel was computed with these terms
+        :rtype: bool
+        '''
+        same = self.slitlength == slitlength and self.sFinal == sFinal
+        same = same and self.weighted_transition == weighted_transition
+        same = same and interpolation in (None, self.interpolation)
+        same = same and self.quadrature == quadrature
+        same = same and (quadrature == 'data' or self.nodes == nodes)
+        same = same and self.analytic_tail == analytic_tail
+        same = same and len(q) == len(self.q) 
+        return same and numpy.array_equal(q, self.q)
+
+    def _interpolated(self, C, start=0, stop=None, logC=None):
+        '''smear rows ``start:stop`` of the measured range of C (terms without extrapolation)'''
+        stop = stop or len(self.q)
+        if self.interpolation == 'linear':
+            if start == 0 and stop == len(self.q):
+                return self.matrix.dot(C)
+            return self.matrix[start:stop].dot(C)
+        row, k, f, weight = rows_of(self.interp_terms, start, stop)
+        if logC is None:
+            logC = numpy.log(C)
+        lo = logC[k]
+        Ic = numpy.exp(lo + f * (logC[k+1] - lo))
+        return numpy.bincount(row - start, weight * Ic, minlength=stop - start)
+
+    def tail_matrix(self, extrap):
+        '''
+        matrix *T* of the extrapolated terms, for extrapolations linear in their coefficients
+        
+        Computed on first use for each extrapolation (by name) and kept.
+        
+        :param obj extrap: extrapolation function object
+        :return: *T*, shape ``(len(q), len(extrap.basis))``, 
+            or None if not ``analytic_tail`` or *extrap* has no ``basis``
+        :rtype: numpy.ndarray
+        '''
+        if not self.analytic_tail or extrap.basis is None:
+            return None
+        if extrap.name not in self.tail_matrices:
+            NumPts = len(self.q)
+            # transition region: quadrature
+            mid = ~self.tail_beyond
+            values = extrap.basis_functions(self.tail_u[mid])
+            weights = self.tail_weights[mid]
+            T = numpy.zeros((NumPts, len(extrap.basis)))
+            for k, f_k in enumerate(values.T):
+                T[:, k] = numpy.bincount(self.tail_rows[mid], weights * f_k, minlength=NumPts)
+            # beyond qMax: exact
+            slit = numpy.ones_like(self.q) * self.slitlength
+            integrals = extrap.basis_integrals(self.q, self.tail_start, slit)
+            T += 2 * Plengt(0, self.slitlength) * integrals
+            self.tail_matrices[extrap.name] = T
+        return self.tail_matrices[extrap.name]
+
+    def _tail(self, extrap, start=0, stop=None):
+        '''smear the extrapolated terms of rows ``start:stop``'''
+        stop = stop or len(self.q)
+        T = self.tail_matrix(extrap)
+        if T is not None:
+            return T[start:stop].dot(extrap.coefficient_vector())
+        row, u, weight = rows_of((self.tail_rows, self.tail_u, self.tail_weights), start, stop)
+        return numpy.bincount(row - start, weight * extrap.calc(u), minlength=stop - start)
+
+    def smear(self, C, extrap, n_threads=1):
+        '''
+        Smear the data of C(q) into S(q)
+        
+        :param numpy.ndarray C: unsmeared data on the *q* grid of the kernel
+        :param obj extrap: extrapolation function object, already fitted
+        :param int n_threads: number of threads
+        :return: S, smeared version of C
+        :rtype: numpy.ndarray
+        '''
+        return self.smear_many(C, [extrap], n_threads)[0]
+
+    def smear_many(self, C, extraps, n_threads=1):
+        '''
+        Smear several datasets at once
+        
+        :param numpy.ndarray C: unsmeared data, one row per dataset, 
+            on the *q* grid of the kernel
+        :param [obj] extraps: fitted extrapolation function object for each row of *C*
+        :param int n_threads: number of threads
+        :return: S, smeared version of C (same shape as *C*)
+        :rtype: numpy.ndarray
+        '''
+        C = numpy.atleast_2d(C)
+        logC = None
+        if self.interpolation == 'log':
+            logC = numpy.log(C)
+        T = None
+        if self.tail_u.size > 0:
+            for extrap in extraps:
+                self.tail_matrix(extrap)    # before any threads start
+            names = set([extrap.name for extrap in extraps])
+            T = self.tail_matrix(extraps[0]) if len(names) == 1 else None
+            if T is not None:
+                coefficients = numpy.array([extrap.coefficient_vector() for extrap in extraps])
+
+        def smear_block(start, stop):
+            if self.interpolation == 'linear':
+                if start == 0 and stop == len(self.q):
+                    S = self.matrix.dot(numpy.transpose(C))
+                else:
+                    S = self.matrix[start:stop].dot(numpy.transpose(C))
+                S = numpy.atleast_2d(S.T)
+            else:
+                S = numpy.array([self._interpolated(None, start, stop, row) for row in logC])
+            if self.tail_u.size > 0:
+                if T is not None:
+                    S += coefficients.dot(T[start:stop].T)
+                else:
+                    for row, extrap in enumerate(extraps):
+                        S[row] += self._tail(extrap, start, stop)
+            return S
+
+        NumPts = len(self.q)
+        block_size = self.block_size if n_threads > 1 else NumPts
+        return map_blocks(smear_block, NumPts, block_size, n_threads)
+
+
+class TiledKernel(SmearingKernel):
+    '''
+    slit-smearing operator computed in tiles of rows, on demand
+    
+    Gives the same result as the ``cached`` engine (log interpolation
+    of *C*, as in :func:`get_Ic()`) but the interpolation geometry
+    and the extrapolated terms are not all kept.  Each tile 
+    (``block_size`` rows) is computed when first needed and kept 
+    in a least-recently-used cache of at most *cache_MB* megabytes.
+    When all the tiles fit, each smearing after the first is as fast
+    as the ``cached`` engine.  When they do not, the tiles used least
+    recently are discarded and computed again when next needed,
+    so memory stays bounded for very long scans.  Successive smearings 
+    pass through the tiles in alternate directions, starting with 
+    those kept from the previous pass.
+    
+    ``analytic_tail`` is not available with tiles.
+    
+    :param numpy.ndarray q: magnitude of scattering vector
+    :param float slitlength: l_o, same units as q
+    :param float sFinal: fit extrapolation to I(q) for q >= sFinal
+    :param bool weighted_transition: if True, make a weighted transition between sFinal <= q < qMax
+    :param int block_size: number of rows in each tile
+    :param str quadrature: integration rule along the slit, one of the keys of ``Slit_Quadratures``
+    :param int nodes: number of abscissae along the slit (not used by the ``data`` rule)
+    :param float cache_MB: memory for the tiles kept from one smearing to the next
+    '''
+    
+    def __init__(self, q, slitlength, sFinal, weighted_transition=True, block_size=None,
+                 quadrature='data', nodes=None, cache_MB=TILE_CACHE_MB):
+        self.q = numpy.array(q, dtype=float)
+        self.slitlength = slitlength
+        self.sFinal = sFinal
+        self.weighted_transition = weighted_transition
+        self.interpolation = 'log'
+        self.quadrature = quadrature
+        self.nodes = nodes
+        self.analytic_tail = False
+        self.sparse = False
+        self.qMax = self.q[-1]
+        self.x, dx = slit_quadrature(self.q, slitlength, quadrature, nodes)
+        # 2 * P_l(x) dx: symmetrical about zero
+        self.weights = 2 * Plengt(self.x, slitlength) * dx
+        self.limits = None
+        if quadrature != 'data':
+            self.limits = transition_limits(self.q, sFinal, self.qMax, slitlength)
+        if block_size is None:
+            block_size = max(1, 2**20 // len(self.x))
+        self.block_size = block_size
+
+        self.cache_bytes = int(cache_MB * 2**20)   # limit
+        self.tiles = collections.OrderedDict()      # first row: tile, least recently used first
+        self.tile_bytes = 0
+        self.lock = threading.Lock()                # for the tiles, when smearing with threads
+        self.hits = 0
+        self.misses = 0
+        self.reverse = True         # direction of the previous pass through the tiles
+
+    def _build_tile(self, start, stop):
+        '''
+        compute the tile of rows ``start:stop``
+        
+        :return: ((row, k, f, weight) of the interpolated terms, 
+            (row, u, weight) of the extrapolated terms),
+            where *row* counts from *start*
+        '''
+        interp, tail = self._build_rows(start, stop)[:2]
+        row, k, f, weight = interp
+        interp = ((row - start).astype(numpy.int32), k.astype(numpy.int32), f, weight)
+        row, u, weight = tail[:3]
+        tail = ((row - start).astype(numpy.int32), u, weight)
+        return interp, tail
+
+    def tile(self, start):
+        '''
+        tile of rows starting at *start*, from the cache or computed now
+        
+        :param int start: first row of the tile, a multiple of ``block_size``
+        :return: tile, as from :meth:`_build_tile()`
+        '''
+        with self.lock:
+            if start in self.tiles:
+                self.hits += 1
+                tile = self.tiles.pop(start)
+                self.tiles[start] = tile        # now the most recently used
+                return tile
+            self.misses += 1
+        stop = min(start + self.block_size, len(self.q))
+        tile = self._build_tile(start, stop)
+        size = sum([a.nbytes for terms in tile for a in terms])
+        if size <= self.cache_bytes:
+            with self.lock:
+                if start in self.tiles:
+                    return self.tiles[start]    # computed meanwhile by another thread
+                while self.tiles and self.tile_bytes + size > self.cache_bytes:
+                    discarded = self.tiles.popitem(last=False)[1]
+                    self.tile_bytes -= sum([a.nbytes for terms in discarded for a in terms])
+                self.tiles[start] = tile
+                self.tile_bytes += size
+        return tile
+
+    def _smear_tile(self, tile, logC, extrap, n_rows):
+        '''smear the rows of one tile'''
+        (row, k, f, weight), (t_row, t_u, t_weight) = tile
+        lo = logC[k]
+        Ic = numpy.exp(lo + f * (logC[k+1] - lo))
+        S = numpy.bincount(row, weight * Ic, minlength=n_rows)
+        if t_u.size > 0:
+            S += numpy.bincount(t_row, t_weight * extrap.calc(t_u), minlength=n_rows)
+        return S
+
+    def smear_many(self, C, extraps, n_threads=1):
+        '''
+        Smear several datasets at once, computing or recalling each tile once
+        
+        :param numpy.ndarray C: unsmeared data, one row per dataset, 
+            on the *q* grid of the kernel
+        :param [obj] extraps: fitted extrapolation function object for each row of *C*
+        :param int n_threads: number of threads, each smearing whole tiles
+        :return: S, smeared version of C (same shape as *C*)
+        :rtype: numpy.ndarray
+        '''
+        logC = numpy.log(numpy.atleast_2d(C))
+        NumPts = len(self.q)
+        S = numpy.zeros_like(logC)
+        starts = range(0, NumPts, self.block_size)
+        # alternate directions: begin with the tiles kept from the previous pass
+        self.reverse = not self.reverse
+        if self.reverse:
+            starts.reverse()
+
+        def smear_tile(start):
+            stop = min(start + self.block_size, NumPts)
+            tile = self.tile(start)
+            for i, extrap in enumerate(extraps):
+                S[i, start:stop] = self._smear_tile(tile, logC[i], extrap, stop - start)
+
+        pool_map(smear_tile, starts, n_threads)
+        return S
+
+
+def make_kernel(engine, q, slitlength, sFinal, weighted_transition=True, block_size=None,
+                quadrature='data', nodes=None, analytic_tail=False, storage='auto',
+                cache_MB=TILE_CACHE_MB):
+    '''
+    smearing kernel for one of the engines that keep one
+    
+    :param str engine: ``kernel``, ``cached``, or ``tiled``
+    :return: :class:`SmearingKernel` (``linear`` interpolation for ``kernel``,
+        ``log`` for ``cached``) or :class:`TiledKernel` (``tiled``),
+        other parameters as for :func:`Smear()`
+    '''
+    if engine == 'tiled':
+        return TiledKernel(q, slitlength, sFinal, weighted_transition, block_size,
+                           quadrature=quadrature, nodes=nodes, cache_MB=cache_MB)
+    interpolation = {'kernel': 'linear', 'cached': 'log'}[engine]
+    return SmearingKernel(q, slitlength, sFinal, weighted_transition, block_size,
+                          interpolation=interpolation, 
+                          quadrature=quadrature, nodes=nodes,
+                          analytic_tail=analytic_tail, storage=storage)
+
+
+def smear_rows(q, logC, x, w, start, stop, sFinal, extrap, weighted_transition=True, 
+               dx=None, limits=None):
+    '''
+    Smear rows ``start:stop`` of the data in one 2-D NumPy pass
+    
+    Same integrand as :func:`get_Ic()` (log interpolation, transition, 
+    extrapolation) but evaluated for all *q* in the block at once 
+    on the grid :math:`u = \\sqrt{q^2+x^2}`
+    and integrated along the slit for all rows at once.
+    
+    :param numpy.ndarray q: magnitude of scattering vector
+    :param numpy.ndarray logC: natural logarithm of unsmeared data, log(C(q))
+    :param numpy.ndarray x: integration abscissae along the slit
+    :param numpy.ndarray w: slit-length weighting function, P_l(x)
+    :param int start: first row (index of *q*) to smear
+    :param int stop: smear rows up to, but not including, this one
+    :param float sFinal: fit extrapolation to I(q) for q >= sFinal
+    :param obj extrap: extrapolation function object, already fitted
+    :param bool weighted_transition: if True, make a weighted transition between sFinal <= q < qMax
+    :param numpy.ndarray dx: integration weights of *x* (default: trapezoid rule)
+    :param tuple limits: (optional) (lo, hi) from :func:`transition_limits()`, for all *q*
+    :return: S[start:stop]
+    :rtype: numpy.ndarray
+    '''
+    u = numpy.sqrt(q[start:stop, None]**2 + x[None, :]**2)     # circular-symmetric
+    if limits is not None:
+        limits = [a[start:stop] for a in limits]
+    fraction = extrapolation_fraction(u, sFinal, q[-1], weighted_transition, limits)
+    Ic = numpy.zeros_like(u)
+
+    # interpolate from existing data
+    inside = fraction < 1
+    Ic[inside] = (1 - fraction[inside]) * numpy.exp(numpy.interp(u[inside], q, logC))
+
+    # extrapolate from model beyond range of available data
+    outside = fraction > 0
+    Ic[outside] += fraction[outside] * extrap.calc(u[outside])
+
+    if dx is None:
+        return 2 * numpy.trapz(w[None, :] * Ic, x, axis=1)  # symmetrical about zero
+    return 2 * numpy.dot(Ic, w * dx)  # symmetrical about zero
+
+
+def Smear(q, C, dC, extrapname, sFinal, slitlength, quiet = False, weighted_transition=True, 
+          engine='loop', kernel=None, block_size=None, extrap=None,
+          quadrature='data', nodes=None, analytic_tail=False, storage='auto',
+          cache_MB=TILE_CACHE_MB, n_threads=1):
     '''
     Smear the data of C(q) into S(q) using the slit-length
     weighting function :func:`~jldesmear.api.smear.Plengt()` and an extrapolation
@@ -145,41 +986,100 @@ def Smear(q, C, dC, extrapname, sFinal, slitlength, quiet = False, weighted_tran
     :param float slitlength: l_o, same units as q
     :param bool quiet: if True, then no printed output from this routine
     :param bool weighted_transition: if True, make a weighted transition between sFinal <= q < qMax
+    :param str engine: one of the keys of ``Smearing_Engines``
+    :param obj kernel: (optional) :class:`SmearingKernel` for this *q*, *sFinal*, 
+        and *slitlength*, used by the ``kernel`` and ``cached`` engines 
+        (or :class:`TiledKernel`, used by the ``tiled`` engine)
+        (otherwise it is computed here)
+    :param int block_size: number of rows computed at once by the ``vectorized``, 
+        ``kernel``, and ``tiled`` engines (default: automatic, limits temporary memory)
+    :param obj extrap: (optional) extrapolation function object, already fitted,
+        to use instead of fitting the extrapolation to C here
+    :param str quadrature: integration rule along the slit, one of the keys of ``Slit_Quadratures``
+    :param int nodes: number of abscissae along the slit (not used by the ``data`` rule)
+    :param bool analytic_tail: if True, the ``kernel`` and ``cached`` engines 
+        integrate the extrapolation beyond *qMax* exactly 
+        (see :class:`SmearingKernel`)
+    :param str storage: storage of the ``kernel`` engine matrix, 
+        one of the keys of ``Kernel_Storage``
+    :param float cache_MB: memory (MB) for the tiles kept by the ``tiled`` engine
+    :param int n_threads: number of threads to smear blocks of *q* 
+        (see :func:`map_blocks()`)
     :return: tuple of (S, extrap)
     :rtype: (numpy.ndarray, object)
     :var numpy.ndarray S: smeared version of C
     '''
+    if engine not in Smearing_Engines:
+        msg = "smearing engine must be one of " + str(sorted(Smearing_Engines.keys()))
+        msg += ", got " + str(engine)
+        raise ValueError, msg
+
+    # select and fit the extrapolation
+    if extrap is None:
+        if extrapolation.functions is None:
+            extrapolation.discover_extrapolations()
+        try:
+            extrap = prepare_extrapolation(q, C, dC, extrapname, sFinal)
+        except Exception:
+            message = "prepare_extrapolation had a problem: " + str(sys.exc_info)
+            raise Exception, message
+
+    if engine in ('kernel', 'cached', 'tiled'):
+        if kernel is None:
+            kernel = make_kernel(engine, q, slitlength, sFinal, weighted_transition, block_size,
+                                 quadrature, nodes, analytic_tail, storage, cache_MB)
+        return kernel.smear(C, extrap, n_threads), extrap
+
     # make the slit-length weighting function
     NumPts = len(q)
-    q0 = q[0]
     qMax = q[-1]
-    qRange = qMax - q0
-    x = slitlength * (q - q0) / qRange      # use "x" rather than "l" to avoid typos
+    # use "x" rather than "l" to avoid typos
+    x, dx = slit_quadrature(q, slitlength, quadrature, nodes)
     w = Plengt(x, slitlength)               # w = P_l(l) or P_l(x)
+    if quadrature == 'data':
+        dx = None                           # numpy.trapz(), as always
+        limits = None
+    else:
+        limits = transition_limits(q, sFinal, qMax, slitlength)
 
-    # prepare for interpolation of existing data, log(I)
-    interp = interp1d(q, numpy.log(C))
+    if engine == 'vectorized':
+        if block_size is None:
+            block_size = max(1, 2**20 // len(x))
+        logC = numpy.log(C)
 
-    # select and fit the extrapolation
-    if extrapolation.functions is None:
-        extrapolation.discover_extrapolations()
-    try:
-        extrap = prepare_extrapolation(q, C, dC, extrapname, sFinal)
-    except Exception:
-        message = "prepare_extrapolation had a problem: " + str(sys.exc_info)
-        raise Exception, message
+        def smear_block(start, stop):
+            if not quiet and n_threads <= 1: toolbox.Spinner(start // block_size)
+            return smear_rows(q, logC, x, w, start, stop, 
+                              sFinal, extrap, weighted_transition, dx, limits)
 
-    S = numpy.ndarray((NumPts,))     # slit-smeared intensity (to be the result)
+        return map_blocks(smear_block, NumPts, block_size, n_threads), extrap
 
-    for i, qNow in enumerate(q):
-        if not quiet: toolbox.Spinner(i)
-        Ic = w * get_Ic(qNow, sFinal, qMax, x, interp, extrap, weighted_transition)
-        S[i] = 2 * numpy.trapz(Ic, x)  # symmetrical about zero
+    # prepare for interpolation of existing data, log(I)
+    interp = interp1d(q, numpy.log(C))
+
+    def smear_loop(start, stop):
+        S = numpy.ndarray((stop - start,))     # slit-smeared intensity (to be the result)
+        for i in range(start, stop):
+            if not quiet and n_threads <= 1: toolbox.Spinner(i)
+            if dx is None:
+                Ic = w * get_Ic(q[i], sFinal, qMax, x, interp, extrap, weighted_transition)
+                S[i - start] = 2 * numpy.trapz(Ic, x)  # symmetrical about zero
+            else:
+                Ic = w * get_Ic(q[i], sFinal, qMax, x, interp, extrap, weighted_transition,
+                                (limits[0][i], limits[1][i]))
+                S[i - start] = 2 * numpy.sum(Ic * dx)
+        return S
 
-    return S, extrap
+    return map_blocks(smear_loop, NumPts, NumPts, n_threads), extrap
 
-def get_Ic(qNow, sFinal, qMax, x, interp, extrap, weighted_transition=True):
-    '''return the corrected intensity based on circular symmetry'''
+def get_Ic(qNow, sFinal, qMax, x, interp, extrap, weighted_transition=True, limits=None):
+    '''
+    return the corrected intensity based on circular symmetry
+    
+    :param tuple limits: (optional) (lo, hi) of the transition region for *qNow*,
+        from :func:`transition_limits()`: weight of the extrapolation increases 
+        linearly in *u* from *lo* to *hi*, rather than with each abscissa
+    '''
     u = numpy.sqrt(qNow*qNow + x*x) # circular-symmetric
 
     # divide integrand into different regions
@@ -189,12 +1089,15 @@ def get_Ic(qNow, sFinal, qMax, x, interp, extrap, weighted_transition=True):
     
     condition = numpy.multiply(sFinal < u, u <= qMax)
     u_mid = numpy.extract(condition, u)
-    if u_mid.size < 2 or not weighted_transition:
+    if not weighted_transition or (u_mid.size < 2 and limits is None):
         Ic_mid = numpy.exp(interp(u_mid))
     else:
         # make smooth transition between sFinal < q < qMax
-        #weight = (u_mid - u_mid.min()) / (u_mid.max() - u_mid.min())
-        weight = numpy.linspace(0, 1.0, u_mid.size)
+        if limits is None:
+            weight = numpy.linspace(0, 1.0, u_mid.size)
+        else:
+            lo, hi = limits
+            weight = numpy.clip((u_mid - lo) / max(hi - lo, sys.float_info.min), 0, 1)
         Ic_mid_in = numpy.exp(interp(u_mid))
         Ic_mid_ex = extrap.calc(u_mid)
         Ic_mid = (1-weight) * Ic_mid_in + weight * Ic_mid_ex
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+
+import unittest
+import numpy
+import StatsReg
+import toolbox
+import os       #@UnusedImport
+
+
+REGISTERS = ('count', 'weight', 'sumX', 'sumXX', 'sumY', 'sumYY', 'sumXY')
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        q, I, dI = toolbox.GetDat(toolbox.GetTest1DataFilename('.smr'))
+        start = toolbox.find_first_index(q, 0.08)
+        self.x, self.y, self.z = q[start:], I[start:], dI[start:]
+
+    def assertSameRegisters(self, reg, expected):
+        for name in REGISTERS:
+            value, reference = getattr(reg, name), getattr(expected, name)
+            self.assertTrue(abs(value - reference) <= 1e-12 * abs(reference),
+                            '%s: %r != %r' % (name, value, reference))
+
+    def test_AddArrays(self):
+        expected = StatsReg.StatsRegClass()
+        for x, y in zip(self.x, self.y):
+            expected.Add(x, y)
+        reg = StatsReg.StatsRegClass()
+        self.assertEqual(reg.AddArrays(self.x, self.y), len(self.x))
+        self.assertSameRegisters(reg, expected)
+        for result in ('LinearRegression', 'LinearRegressionVariance', 'CorrelationCoefficient'):
+            self.assertTrue(numpy.allclose(getattr(reg, result)(), getattr(expected, result)(),
+                                           rtol=1e-10, atol=0))
+
+    def test_AddArrays_weighted(self):
+        expected = StatsReg.StatsRegClass()
+        for x, y, z in zip(self.x, self.y, self.z):
+            expected.AddWeighted(x, y, z)
+        reg = StatsReg.StatsRegClass()
+        reg.AddArrays(self.x, self.y, 1/self.z**2)
+        self.assertSameRegisters(reg, expected)
+        self.assertTrue(numpy.allclose(reg.LinearRegression(), expected.LinearRegression(),
+                                       rtol=1e-10, atol=0))
+
+        # a weight of zero adds nothing but the count
+        weights = 1/self.z**2
+        weights[::2] = 0
+        expected = StatsReg.StatsRegClass()
+        for x, y, z in zip(self.x[1::2], self.y[1::2], self.z[1::2]):
+            expected.AddWeighted(x, y, z)
+        reg = StatsReg.StatsRegClass()
+        reg.AddArrays(self.x, self.y, weights)
+        self.assertEqual(reg.count, len(self.x))
+        reg.count = expected.count
+        self.assertSameRegisters(reg, expected)
+
+    def test_SubtractArrays(self):
+        expected = StatsReg.StatsRegClass()
+        for x, y, z in zip(self.x[:10], self.y[:10], self.z[:10]):
+            expected.AddWeighted(x, y, z)
+        reg = StatsReg.StatsRegClass()
+        reg.AddArrays(self.x, self.y, 1/self.z**2)
+        full = dict([(name, getattr(reg, name)) for name in REGISTERS])
+        reg.SubtractArrays(self.x[10:], self.y[10:], 1/self.z[10:]**2)
+        self.assertEqual(reg.count, 10)
+        for name in REGISTERS:
+            # the difference of two sums: as accurate as the full sum
+            self.assertTrue(abs(getattr(reg, name) - getattr(expected, name)) 
+                            <= 1e-12 * abs(full[name]), name)
+
+        reg.SubtractArrays(self.x[:10], self.y[:10], 1/self.z[:10]**2)
+        self.assertEqual(reg.count, 0)
+        for name in REGISTERS:
+            self.assertTrue(abs(getattr(reg, name)) <= 1e-12 * abs(full[name]), name)
+
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+
+import unittest
+import shutil
+import sys
+import tempfile
+import StringIO
+import batch
+import fileio_nexus
+import toolbox
+import os       #@UnusedImport
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        for ext in ('.inp', '.smr'):
+            shutil.copy(toolbox.GetTest1DataFilename(ext), self.directory)
+        with open(os.path.join(self.directory, 'missing.inp'), 'w') as fp:
+            fp.write('\n'.join(['missing.smr', 'missing.dsm', '0.08', 'linear', '0.08', '5', 'fast', '']))
+        self.stdout = sys.stdout
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        shutil.rmtree(self.directory)
+
+    def test_find_inputs(self):
+        filenames = batch.find_inputs([self.directory, os.path.join(self.directory, 'test1.inp')])
+        self.assertEqual([os.path.basename(fn) for fn in filenames], ['missing.inp', 'test1.inp'])
+        self.assertEqual(batch.find_inputs([os.path.join(self.directory, 'test1.smr')]), [])
+
+    def test_run(self):
+        filenames = batch.find_inputs([self.directory])
+        output_dir = os.path.join(self.directory, 'output')
+        os.mkdir(output_dir)
+        sys.stdout = StringIO.StringIO()
+        results = batch.run(filenames, processes=1, output_dir=output_dir,
+                            overrides=dict(NumItr=3, smear_engine='kernel'))
+        printed = sys.stdout.getvalue()
+        sys.stdout = self.stdout
+        self.assertEqual(printed, '')       # workers are quiet
+
+        missing, test1 = results
+        self.assertEqual(test1['error'], None)
+        self.assertEqual(test1['iterations'], 3)
+        self.assertEqual(test1['stop_reason'], 'NumItr')
+        self.assertEqual(test1['outfile'], os.path.join(output_dir, 'test1.dsm'))
+        q, C, dC = toolbox.GetDat(test1['outfile'])
+        self.assertEqual(len(q), len(toolbox.GetDat(toolbox.GetTest1DataFilename('.smr'))[0]))
+        self.assertFalse(os.path.exists(os.path.join(self.directory, 'test1.dsm')))
+
+        self.assertTrue(missing['error'].startswith('IOError: data file not found'))
+        self.assertEqual(missing['iterations'], None)
+        self.assertFalse(os.path.exists(os.path.join(output_dir, 'missing.dsm')))
+
+        lines = batch.summary(results).splitlines()
+        self.assertEqual(len(lines), 4)
+        self.assertTrue(lines[2].startswith('missing.inp') and 'IOError' in lines[2])
+        self.assertTrue(lines[3].startswith('test1.inp') and lines[3].endswith('ok (NumItr)'))
+
+    def test_main(self):
+        sys.stdout = StringIO.StringIO()
+        status = batch.main([self.directory, '-n', '1', '--max-iterations', '2'])
+        printed = sys.stdout.getvalue()
+        sys.stdout = self.stdout
+        self.assertEqual(status, 1)         # one file failed
+        self.assertFalse('Saved data' in printed)
+        self.assertTrue('2 file(s), 1 failed' in printed)
+        self.assertTrue(os.path.exists(os.path.join(self.directory, 'test1.dsm')))
+
+        os.remove(os.path.join(self.directory, 'missing.inp'))
+        sys.stdout = StringIO.StringIO()
+        status = batch.main([self.directory, '-n', '1', '--max-iterations', '2'])
+        sys.stdout = self.stdout
+        self.assertEqual(status, 0)
+        sys.stdout = StringIO.StringIO()
+        status = batch.main([os.path.join(self.directory, 'output')])
+        sys.stdout = self.stdout
+        self.assertEqual(status, 1)         # no .inp files
+
+    def test_find_scans_without_h5py(self):
+        h5file = os.path.join(self.directory, 'scans.h5')
+        open(h5file, 'w').close()
+        h5py = fileio_nexus.h5py
+        fileio_nexus.h5py = None
+        try:
+            self.assertEqual(batch.find_scans([self.directory]), [])     # not HDF5 files
+            self.assertRaises(ImportError, batch.find_scans, [h5file])
+            try:
+                batch.find_scans([h5file])
+            except ImportError, exc:
+                self.assertTrue(str(exc).startswith(h5file + ': '))
+            sys.stdout = StringIO.StringIO()
+            status = batch.main([self.directory, h5file, '-n', '1'])
+            printed = sys.stdout.getvalue()
+            sys.stdout = self.stdout
+        finally:
+            fileio_nexus.h5py = h5py
+        self.assertEqual(status, 1)
+        self.assertTrue(printed.startswith(h5file + ': '))
+        self.assertTrue('h5py' in printed)
+
+
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
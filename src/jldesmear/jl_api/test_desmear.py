@@ -2,8 +2,12 @@
 
 
 import unittest
+import numpy
+import shutil
+import tempfile
 import info
 import desmear
+import smear
 import toolbox
 import os       #@UnusedImport
 
@@ -48,6 +52,257 @@ class Test(unittest.TestCase):
         for index, expected in dataset.items():
             self.assertAlmostEquals(dsm.ChiSqr[index], expected)
 
+    def test_extrap_update(self):
+        q, E, dE = toolbox.GetDat(toolbox.GetTest1DataFilename('.smr'))
+        expected = {
+            'always': [0, 1, 2, 3, 4, 5],
+            'interval': [0, 2, 4],
+            'frozen': [0],
+        }
+        for policy, fits in expected.items():
+            params = info.Info()
+            params.slitlength = 0.08
+            params.sFinal = 0.08
+            params.extrapname = "linear"
+            params.extrap_update = policy
+            params.extrap_interval = 2
+            dsm = desmear.Desmearing(q, E, dE, params)
+            for _ in range(5):
+                dsm.iteration()
+            self.assertEqual(dsm.extrap_fits, fits)
+            self.assertTrue(params.extrap is dsm.extrap)
+
+        # tolerance: refit only once C(q >= sFinal) has moved more than extrap_tolerance
+        params.extrap_update = 'tolerance'
+        params.extrap_tolerance = 0.1
+        dsm = desmear.Desmearing(q, E, dE, params)
+        start = smear.fit_range_start(q, params.sFinal)
+        for _ in range(10):
+            C_at_fit, fits = numpy.array(dsm._extrap_C), list(dsm.extrap_fits)
+            dsm.iteration()         # refits after the new C, when due
+            change = numpy.max(numpy.abs(dsm.C[start:] / C_at_fit - 1))
+            if change > params.extrap_tolerance:
+                fits.append(dsm.iteration_count)
+            self.assertEqual(dsm.extrap_fits, fits)
+        self.assertEqual(dsm.extrap_fits, [0, 2, 5, 9])
+
+        C_fit = numpy.array([0.0, 1.0, 2.0])
+        self.assertFalse(desmear.refit_due(params, 1, 0, C_fit, C_fit))
+        self.assertFalse(desmear.refit_due(params, 1, 0, C_fit * 1.05, C_fit))
+        self.assertTrue(desmear.refit_due(params, 1, 0, C_fit * 1.15, C_fit))
+        self.assertTrue(desmear.refit_due(params, 1, 0, C_fit + [1e-9, 0, 0], C_fit))
+
+    def test_stopping(self):
+        q, E, dE = toolbox.GetDat(toolbox.GetTest1DataFilename('.smr'))
+        params = info.Info()
+        params.slitlength = 0.08
+        params.sFinal = 0.08
+        params.extrapname = "linear"
+        dsm = desmear.Desmearing(q, E, dE, params)
+
+        dsm.ChiSqr = [1000., 500., 400., 399.9, 399.8, 399.7]
+        self.assertEqual(dsm.converged(), None)
+        params.stopping = ('converged', )
+        self.assertEqual(dsm.converged(), 'converged')
+        params.stop_window = 5
+        self.assertEqual(dsm.converged(), None)
+
+        params.stopping = ('rising', )
+        self.assertEqual(dsm.converged(), None)
+        dsm.ChiSqr.append(400.)
+        self.assertEqual(dsm.converged(), 'rising')
+
+        params.stopping = ('reduced_ChiSqr', )
+        self.assertEqual(dsm.converged(), None)
+        dsm.ChiSqr.append(0.9 * len(q))
+        self.assertEqual(dsm.converged(), 'reduced_ChiSqr')
+
+        params.NumItr = 3
+        params.stopping = ()
+        dsm.first_step()
+        while dsm.more_iterations_ok():
+            dsm.iteration()
+        self.assertEqual(dsm.iteration_count, 3)
+        self.assertEqual(dsm.stop_reason, 'NumItr')
+
+    def test_anderson(self):
+        q, E, dE = toolbox.GetDat(toolbox.GetTest1DataFilename('.smr'))
+        ChiSqr = {}
+        for acceleration in sorted(desmear.Acceleration_Methods.keys()):
+            params = info.Info()
+            params.slitlength = 0.08
+            params.sFinal = 0.08
+            params.extrapname = "linear"
+            params.smear_engine = 'cached'
+            params.acceleration = acceleration
+            dsm = desmear.Desmearing(q, E, dE, params)
+            for _ in range(20):
+                dsm.iteration()
+            self.assertTrue((dsm.C > 0).all())
+            ChiSqr[acceleration] = dsm.ChiSqr[-1]
+        self.assertTrue(ChiSqr['anderson'] < ChiSqr['none'] / 3)
+
+        params.smear_engine = 'kernel'
+        params.NumItr = 10
+        dsm = desmear.Desmearing(q, E, dE, params)
+        while dsm.more_iterations_ok():
+            dsm.iteration()
+        batch = desmear.BatchDesmearing(q, [E, 2*E], [dE, 2*dE], params)
+        batch.traditional()
+        self.assertTrue(numpy.allclose(batch.C[0], dsm.C, rtol=1e-8))
+        self.assertTrue(numpy.allclose(batch.C[1], 2*dsm.C, rtol=1e-8))
+
+    def test_DirectDesmearing(self):
+        q, E, dE = toolbox.GetDat(toolbox.GetTest1DataFilename('.smr'))
+        params = info.Info()
+        params.slitlength = 0.08
+        params.sFinal = 0.08
+        params.extrapname = "linear"
+        params.smear_engine = 'kernel'
+        lake = desmear.Desmearing(q, E, dE, params)
+        for _ in range(30):
+            lake.iteration()
+
+        params.desmear_method = 'direct'
+        for criterion in sorted(desmear.Regularization_Criteria.keys()):
+            params.regularization = criterion
+            dsm = desmear.new_desmearing(q, E, dE, params)
+            self.assertTrue(isinstance(dsm, desmear.DirectDesmearing))
+            dsm.traditional()
+            self.assertEqual(dsm.iteration_count, 1)
+            self.assertEqual(dsm.stop_reason, 'solved')
+            self.assertTrue((dsm.C > 0).all())
+            self.assertTrue(dsm.ChiSqr[-1] < 2 * len(q))
+            ratio = dsm.C / lake.C
+            self.assertTrue(abs(numpy.median(ratio) - 1) < 0.01)
+
+        params.regularization_weight = 1e3      # very smooth C/I
+        smooth = desmear.new_desmearing(q, E, dE, params)
+        smooth.traditional()
+        self.assertEqual(smooth.regularization_weight, 1e3)
+        self.assertTrue(smooth.ChiSqr[-1] > dsm.ChiSqr[-1])
+
+    def test_monte_carlo_uncertainty(self):
+        q, E, dE = toolbox.GetDat(toolbox.GetTest1DataFilename('.smr'))
+        params = info.Info()
+        params.slitlength = 0.08
+        params.sFinal = 0.08
+        params.extrapname = "linear"
+        params.smear_engine = 'kernel'
+        params.NumItr = 5
+        params.mc_seed = 7
+        dsm = desmear.Desmearing(q, E, dE, params)
+        while dsm.more_iterations_ok():
+            dsm.iteration()
+        C = numpy.array(dsm.C)
+        dC = desmear.monte_carlo_uncertainty(dsm, 20)
+        self.assertTrue(dsm.dC is dC)
+        self.assertTrue((dC > 0).all())
+        self.assertTrue(numpy.array_equal(dsm.C, C))
+        self.assertTrue(numpy.allclose(desmear.monte_carlo_uncertainty(dsm, 20), dC))
+        self.assertRaises(ValueError, desmear.monte_carlo_uncertainty, dsm, 1)
+
+        # replicas are desmeared with the operator of the central solution
+        for engine, analytic_tail in (('loop', False), ('kernel', False), ('kernel', True)):
+            params.smear_engine = engine
+            params.analytic_tail = analytic_tail
+            dsm = desmear.Desmearing(q, E, dE, params)
+            while dsm.more_iterations_ok():
+                dsm.iteration()
+            random = numpy.random.RandomState(3)
+            I_replicas = E + dE * random.standard_normal((3, len(E)))
+            C = []
+            for I in I_replicas:
+                replica = desmear.new_desmearing(q, I, dE, params)
+                while replica.more_iterations_ok():
+                    replica.iteration()
+                C.append(replica.C)
+            expected = numpy.std(C, axis=0, ddof=1)
+            dC = desmear.monte_carlo_uncertainty(dsm, 3, seed=3)
+            self.assertTrue(numpy.allclose(dC, expected, rtol=1e-8, atol=0), engine)
+        params.analytic_tail = False
+
+        # linear solution: agrees with the propagated uncertainties
+        params.desmear_method = 'direct'
+        dsm = desmear.new_desmearing(q, E, dE, params)
+        dsm.traditional()
+        propagated = numpy.array(dsm.dC)
+        ratio = desmear.monte_carlo_uncertainty(dsm, 400) / propagated
+        self.assertTrue(abs(numpy.median(ratio) - 1) < 0.1)
+
+    def test_checkpoint(self):
+        q, E, dE = toolbox.GetDat(toolbox.GetTest1DataFilename('.smr'))
+        params = info.Info()
+        params.slitlength = 0.08
+        params.sFinal = 0.08
+        params.extrapname = "linear"
+        params.smear_engine = 'cached'
+        params.acceleration = 'anderson'
+        params.extrap_update = 'interval'
+        params.extrap_interval = 3
+        params.NumItr = 12
+        dsm = desmear.Desmearing(q, E, dE, params)
+        while dsm.more_iterations_ok():
+            dsm.iteration()
+
+        directory = tempfile.mkdtemp()
+        try:
+            params.outfile = os.path.join(directory, 'test1.dsm')
+            params.checkpoint_interval = 5
+            filename = desmear.checkpoint_filename(params)
+            first = desmear.Desmearing(q, E, dE, params)
+            for _ in range(5):
+                first.iteration()
+            first.save_state(filename)
+
+            resumed = desmear.Desmearing.load_state(filename)
+            self.assertEqual(resumed.iteration_count, 5)
+            self.assertEqual(resumed.params.extrap_interval, 3)
+            while resumed.more_iterations_ok():
+                resumed.iteration()
+            self.assertTrue(numpy.array_equal(resumed.C, dsm.C))
+            self.assertEqual(list(resumed.ChiSqr), list(dsm.ChiSqr))
+            self.assertEqual(resumed.extrap_fits, dsm.extrap_fits)
+
+            again = desmear.resume_desmearing(q, E, dE, params)
+            self.assertEqual(again.iteration_count, 5)
+            params.slitlength = 0.09        # not the same desmearing
+            again = desmear.resume_desmearing(q, E, dE, params)
+            self.assertEqual(again.iteration_count, 0)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_BatchDesmearing(self):
+        q, E, dE = toolbox.GetDat(toolbox.GetTest1DataFilename('.smr'))
+        params = info.Info()
+        params.slitlength = 0.08
+        params.sFinal = 0.08
+        params.extrapname = "linear"
+        params.NumItr = 5
+        params.smear_engine = 'kernel'
+        dsm = desmear.Desmearing(q, E, dE, params)
+        while dsm.more_iterations_ok():
+            dsm.iteration()
+
+        batch = desmear.BatchDesmearing(q, [E, 2*E], [dE, 2*dE], params)
+        batch.traditional()
+        self.assertEqual(list(batch.iteration_count), [5, 5])
+        self.assertEqual(batch.stop_reason, ['NumItr', 'NumItr'])
+        self.assertFalse(batch.active.any())
+        self.assertTrue(numpy.allclose(batch.C[0], dsm.C, rtol=1e-10))
+        self.assertTrue(numpy.allclose(batch.C[1], 2*dsm.C, rtol=1e-10))
+        self.assertAlmostEqual(batch.ChiSqr[0][-1] / dsm.ChiSqr[-1], 1)
+
+        # default engine (loop): the same operator as Desmearing
+        params.smear_engine = info.Info.smear_engine
+        params.analytic_tail = True         # not used by the loop engine
+        dsm = desmear.Desmearing(q, E, dE, params)
+        while dsm.more_iterations_ok():
+            dsm.iteration()
+        batch = desmear.BatchDesmearing(q, E, dE, params)
+        batch.traditional()
+        self.assertTrue(numpy.allclose(batch.C[0], dsm.C, rtol=1e-10, atol=0))
+
 
 def callback (dsm):
     '''
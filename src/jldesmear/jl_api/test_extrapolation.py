@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+
+
+import unittest
+import math
+import numpy
+import extrapolation
+import StatsReg
+import toolbox
+import os       #@UnusedImport
+
+
+# the per-point transforms used before the fit was vectorized
+SCALAR_TRANSFORMS = {
+    'constant': lambda x, y: (x, y),
+    'linear':   lambda x, y: (x, y),
+    'powerlaw': lambda x, y: (math.log(x), math.log(y)),
+    'Porod':    lambda x, y: (math.pow(x, 4), math.pow(x, 4) * y),
+}
+
+
+class ScalarLinear(extrapolation.discover_extrapolations()['linear']):
+    '''linear extrapolation from a plugin that still adds one point at a time'''
+
+    def fit_add(self, reg, x, y, z):
+        reg.AddWeighted(x, y, z)
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        q, I, dI = toolbox.GetDat(toolbox.GetTest1DataFilename('.smr'))
+        start = toolbox.find_first_index(q, 0.08)
+        self.q, self.I, self.dI = q[start:], I[start:], dI[start:]
+
+    def assertSameCoefficients(self, extrap, expected):
+        self.assertEqual(sorted(extrap.coefficients.keys()), sorted(expected.coefficients.keys()))
+        for key, value in expected.coefficients.items():
+            self.assertTrue(abs(extrap.coefficients[key] - value) <= 1e-10 * abs(value),
+                            '%s %s: %r != %r' % (extrap.name, key, extrap.coefficients[key], value))
+
+    def scalar_fit(self, name, q, I):
+        '''fit as before: one point at a time'''
+        expected = extrapolation.functions[name]()
+        reg = StatsReg.StatsRegClass()
+        for x, y in zip(q, I):
+            reg.Add(*SCALAR_TRANSFORMS[name](x, y))
+        expected.fit_result(reg)
+        return expected
+
+    def test_fit(self):
+        functions = extrapolation.discover_extrapolations()
+        self.assertEqual(sorted(functions.keys()), sorted(SCALAR_TRANSFORMS.keys()))
+        for name in sorted(functions.keys()):
+            extrap = functions[name]()
+            extrap.fit(self.q, self.I, self.dI)
+            self.assertSameCoefficients(extrap, self.scalar_fit(name, self.q, self.I))
+
+            # dI is not used by these fits, even if zero
+            zero = functions[name]()
+            zero.fit(self.q, self.I, numpy.zeros_like(self.dI))
+            self.assertEqual(zero.coefficients, extrap.coefficients)
+
+            # lists, as well as arrays
+            listed = functions[name]()
+            listed.fit(list(self.q), list(self.I), list(self.dI))
+            self.assertSameCoefficients(listed, extrap)
+
+    def test_fit_add(self):
+        # a plugin that overrides fit_add() gets each point
+        extrap = ScalarLinear()
+        extrap.fit(self.q, self.I, self.dI)
+        reg = StatsReg.StatsRegClass()
+        reg.AddArrays(self.q, self.I, 1/self.dI**2)
+        expected = ScalarLinear()
+        expected.fit_result(reg)
+        self.assertSameCoefficients(extrap, expected)
+        self.assertNotEqual(extrap.coefficients, self.scalar_fit('linear', self.q, self.I).coefficients)
+
+        extrap = ScalarLinear()
+        self.assertRaises(ZeroDivisionError, extrap.fit, self.q, self.I, numpy.zeros(len(self.q)).tolist())
+
+
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+
+import unittest
+import numpy
+import shutil
+import tempfile
+import fileio
+import fileio_cansas
+import info
+import toolbox
+import os       #@UnusedImport
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.xmlfile = toolbox.GetTest1DataFilename('.xml')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_discover(self):
+        self.assertTrue('CanSAS' in fileio.discover_support())
+        self.assertEqual(fileio.ext_xref['.xml'], 'CanSAS')
+
+    def test_read(self):
+        entries = list(fileio_cansas.iter_entries(self.xmlfile))
+        self.assertEqual(len(entries), 1)
+
+        cansas = fileio_cansas.CanSAS()
+        params = cansas.read(self.xmlfile)
+        self.assertEqual(params.slitlength, 0.08)
+        self.assertEqual(params.sFinal, 0.08)
+        self.assertEqual(params.extrapname, 'linear')
+        self.assertEqual(params.NumItr, 20)
+        self.assertEqual(params.LakeWeighting, 'fast')
+        for ext, data in zip(('.smr', '.dsm'), (cansas.read_SMR(), None)):
+            expected = toolbox.GetDat(toolbox.GetTest1DataFilename(ext))
+            if data is None:
+                entry = next(fileio_cansas.iter_entries(self.xmlfile))
+                data = entry.data('dsm')
+            for column, values in zip(data, expected):
+                self.assertTrue(numpy.array_equal(column, values))
+
+    def test_desmear_entries(self):
+        # several entries, written one at a time
+        entry = next(fileio_cansas.iter_entries(self.xmlfile))
+        manyfile = os.path.join(self.directory, 'many.xml')
+        elements = []
+        for i in range(3):
+            entry.element.set('name', 'entry%d' % i)
+            elements.append(fileio_cansas.ElementTree.fromstring(
+                fileio_cansas.ElementTree.tostring(entry.element)))
+        self.assertEqual(fileio_cansas.write_entries(manyfile, elements), 3)
+
+        params = info.Info()
+        params.smear_engine = 'kernel'
+        results = fileio_cansas.desmear_entries(manyfile, params=params, overrides=dict(NumItr=3))
+        self.assertEqual(sorted(results.keys()), ['entry0', 'entry1', 'entry2'])
+        for result in results.values():
+            self.assertEqual(result['error'], None)
+            self.assertEqual(result['iterations'], 3)
+
+        outfile = os.path.join(self.directory, 'many' + fileio_cansas.OUTPUT_SUFFIX + '.xml')
+        q = toolbox.GetDat(toolbox.GetTest1DataFilename('.smr'))[0]
+        for entry in fileio_cansas.iter_entries(outfile):
+            names = [block.get('name') for block in entry.element.findall(fileio_cansas.tag('SASdata'))]
+            self.assertEqual(names, ['smr', 'dsm'])
+            C = entry.data(fileio_cansas.DESMEARED_DATA)
+            self.assertTrue(numpy.array_equal(C[0], q))
+            self.assertTrue((C[1] > 0).all())
+
+    def test_no_parameters(self):
+        # an entry without the parameters note would iterate without end
+        entry = next(fileio_cansas.iter_entries(self.xmlfile))
+        entry.element.set('name', 'bare')
+        for note in entry.element.findall(fileio_cansas.tag('SASnote')):
+            entry.element.remove(note)
+        barefile = os.path.join(self.directory, 'bare.xml')
+        fileio_cansas.write_entries(barefile, [entry.element])
+
+        params = info.Info()
+        params.slitlength = 0.08
+        params.sFinal = 0.08
+        params.smear_engine = 'kernel'
+        self.assertEqual(entry.parameters(params).NumItr, info.INFINITE_ITERATIONS)
+        results = fileio_cansas.desmear_entries(barefile, params=params)
+        self.assertTrue(results['bare']['error'].startswith('ValueError'))
+        self.assertEqual(results['bare']['iterations'], None)
+
+        params.stopping = ('converged', 'rising')
+        result = fileio_cansas.desmear_entries(barefile, params=params)['bare']
+        self.assertEqual(result['error'], None)
+        self.assertTrue(result['stop_reason'] in params.stopping)
+
+
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+
+import unittest
+import numpy
+import shutil
+import tempfile
+import batch
+import desmear
+import fileio
+import fileio_nexus
+import info
+import toolbox
+import os       #@UnusedImport
+
+
+@unittest.skipIf(fileio_nexus.h5py is None, 'h5py is not available')
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.h5file = os.path.join(self.directory, 'many.h5')
+        self.q, self.I, self.dI = toolbox.GetDat(toolbox.GetTest1DataFilename('.smr'))
+        params = info.Info()
+        params.slitlength = 0.08
+        params.sFinal = 0.08
+        params.extrapname = 'linear'
+        params.NumItr = 3
+        params.smear_engine = 'kernel'
+        params.stopping = ('rising', )
+        with fileio_nexus.h5py.File(self.h5file, 'w') as h5:
+            for i, name in enumerate(('scan1', 'scan2')):
+                group = h5.create_group(name)
+                fileio_nexus.write_data(group, self.q, (i+1)*self.I, (i+1)*self.dI)
+                fileio_nexus.write_parameters(group, desmear.info_settings(params))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_discover(self):
+        self.assertTrue('NeXus' in fileio.discover_support())
+        self.assertEqual(fileio.ext_xref['.h5'], 'NeXus')
+
+    def test_read(self):
+        self.assertEqual(fileio_nexus.scan_names(self.h5file), ['scan1', 'scan2'])
+        nexus = fileio_nexus.NeXus()
+        params = nexus.read(self.h5file, 'scan2')
+        self.assertEqual(params.slitlength, 0.08)
+        self.assertEqual(params.NumItr, 3)
+        self.assertEqual(params.stopping, ('rising', ))
+        self.assertEqual(params.extrap, fileio_nexus.extrapolation.discover_extrapolations()['linear'])
+        q, I, dI = nexus.read_SMR()
+        self.assertTrue(numpy.array_equal(q, self.q))
+        self.assertTrue(numpy.array_equal(I, 2*self.I))
+
+    def test_desmear_scans(self):
+        reports = fileio_nexus.desmear_scans(self.h5file)
+        self.assertEqual(sorted(reports.keys()), ['scan1', 'scan2'])
+        result = fileio_nexus.read_results(self.h5file, 'scan1')
+        self.assertEqual(reports['scan1']['error'], None)
+        self.assertEqual(result['iteration_count'], 3)
+        self.assertEqual(result['stop_reason'], 'NumItr')
+        self.assertEqual(len(result['ChiSqr']), 4)
+        self.assertEqual(result['ChiSqr'][-1], reports['scan1']['ChiSqr'])
+        self.assertEqual(result['extrap']['name'], 'linear')
+        self.assertEqual(result['settings']['stopping'], ('rising', ))
+
+        # same as desmearing in memory, at full precision
+        params = fileio_nexus.read_parameters(None, None)
+        for key, value in result['settings'].items():
+            setattr(params, key, value)
+        dsm = desmear.Desmearing(self.q, self.I, self.dI, params)
+        while dsm.more_iterations_ok():
+            dsm.iteration()
+        self.assertTrue(numpy.array_equal(result['C'], dsm.C))
+        self.assertTrue(numpy.array_equal(result['S'], dsm.S))
+
+    def test_batch(self):
+        output_dir = os.path.join(self.directory, 'output')
+        container = os.path.join(self.directory, 'inputs.h5')
+        os.mkdir(output_dir)
+        scans = batch.find_scans([self.h5file, self.directory], output_dir)
+        self.assertEqual([scan[1] for scan in scans], ['scan1', 'scan2'])
+        results = batch.run(scans, processes=1, overrides=dict(NumItr=2))
+        results += batch.run(batch.find_inputs([toolbox.GetTest1DataFilename('.inp')]),
+                             processes=1, overrides=dict(NumItr=2, smear_engine='kernel'),
+                             container=container)
+        for result in results:
+            self.assertEqual(result['error'], None)
+            self.assertFalse('data' in result)
+        outfile = os.path.join(output_dir, 'many.h5')
+        self.assertEqual(fileio_nexus.scan_names(outfile), ['scan1', 'scan2'])
+        self.assertEqual(fileio_nexus.read_results(outfile, 'scan2')['iteration_count'], 2)
+        self.assertEqual(fileio_nexus.scan_names(container), ['test1'])
+
+    def test_no_iteration_limit(self):
+        # scans without NumItr (or without parameters) would iterate without end
+        with fileio_nexus.h5py.File(self.h5file, 'a') as h5:
+            del h5['scan1'][fileio_nexus.PARAMETERS]['NumItr']
+            del h5['scan1'][fileio_nexus.PARAMETERS]['stopping']
+            del h5['scan2'][fileio_nexus.PARAMETERS]
+        params = info.Info()
+        params.slitlength = 0.08
+        params.sFinal = 0.08
+        params.smear_engine = 'kernel'
+        reports = fileio_nexus.desmear_scans(self.h5file, params=params)
+        for report in reports.values():
+            self.assertTrue(report['error'].startswith('ValueError'))
+        for result in batch.run(batch.find_scans([self.h5file]), processes=1):
+            self.assertTrue(result['error'].startswith('ValueError'))
+
+        params.stopping = ('rising', 'converged')
+        reports = fileio_nexus.desmear_scans(self.h5file, params=params)
+        for report in reports.values():
+            self.assertEqual(report['error'], None)
+            self.assertTrue(report['stop_reason'] in params.stopping)
+
+
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+
+import unittest
+import shutil
+import sys
+import tempfile
+import StringIO
+import headless
+import info
+import toolbox
+import os       #@UnusedImport
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        for ext in ('.inp', '.smr'):
+            shutil.copy(toolbox.GetTest1DataFilename(ext), self.directory)
+        self.infile = os.path.join(self.directory, 'test1.smr')
+        self.stdout, self.stderr = sys.stdout, sys.stderr
+
+    def tearDown(self):
+        sys.stdout, sys.stderr = self.stdout, self.stderr
+        shutil.rmtree(self.directory)
+
+    def run_main(self, args):
+        ''':return: exit status, stdout, stderr of headless.main()'''
+        sys.stdout, sys.stderr = StringIO.StringIO(), StringIO.StringIO()
+        try:
+            status = headless.main(args)
+            return status, sys.stdout.getvalue(), sys.stderr.getvalue()
+        finally:
+            sys.stdout, sys.stderr = self.stdout, self.stderr
+
+    def get_params(self, args):
+        return headless.get_params(headless.get_parser().parse_args(args))
+
+    def test_get_params(self):
+        params = self.get_params(['-i', self.infile, '-l', '0.08', '-f', '0.09', '-e', 'powerlaw',
+                                  '-n', '7', '-s', 'converged', '-s', 'rising', '--engine', 'kernel'])
+        self.assertEqual(params.infile, self.infile)
+        self.assertEqual(params.outfile, os.path.join(self.directory, 'test1.dsm'))
+        self.assertEqual(params.slitlength, 0.08)
+        self.assertEqual(params.sFinal, 0.09)
+        self.assertEqual(params.extrapname, 'powerlaw')
+        self.assertEqual(params.NumItr, 7)
+        self.assertEqual(params.stopping, ('converged', 'rising'))
+        self.assertEqual(params.smear_engine, 'kernel')
+        self.assertEqual(params.LakeWeighting, info.Info.LakeWeighting)
+        self.assertTrue(params.quiet)
+        self.assertEqual(params.callback, None)
+
+        # .inp file, with options replacing its values
+        inp = os.path.join(self.directory, 'test1.inp')
+        params = self.get_params([inp, '-n', '3', '-o', 'other.dsm'])
+        self.assertEqual(params.infile, self.infile)
+        self.assertEqual(params.outfile, 'other.dsm')
+        self.assertEqual(params.slitlength, 0.08)
+        self.assertEqual(params.extrapname, 'linear')
+        self.assertEqual(params.NumItr, 3)
+
+        params = self.get_params([inp, '-n', '0', '-s', 'converged'])
+        self.assertEqual(params.NumItr, info.INFINITE_ITERATIONS)
+        self.assertRaises(ValueError, self.get_params, [inp, '-n', '0'])
+        self.assertRaises(ValueError, self.get_params, ['-i', self.infile, '-l', '0.08'])
+
+    def test_main(self):
+        outfile = os.path.join(self.directory, 'out.dsm')
+        args = ['-i', self.infile, '-o', outfile, '-l', '0.08', '-f', '0.08', '-e', 'linear',
+                '--engine', 'kernel', '-n', '3']
+        status, out, err = self.run_main(args + ['--quiet'])
+        self.assertEqual((status, out, err), (0, '', ''))
+        self.assertEqual(len(toolbox.GetDat(outfile)[0]), len(toolbox.GetDat(self.infile)[0]))
+
+        status, out, err = self.run_main(args)
+        self.assertEqual(status, 0)
+        self.assertTrue('#3  ChiSqr=' in out and 'stopped: NumItr' in out)
+
+        # errors in the options
+        status, out, err = self.run_main(args + ['-n', '0'])
+        self.assertEqual(status, 2)
+        self.assertTrue('at least one --stop criterion' in err)
+        status, out, err = self.run_main(['-i', self.infile, '-l', '0.08'])
+        self.assertEqual(status, 2)
+        self.assertTrue('missing parameter: sFinal' in err)
+
+        # errors in the command input file
+        inp = os.path.join(self.directory, 'corrupt.inp')
+        for lines in (['test1.smr', 'test1.dsm', '0.08'],
+                      ['test1.smr', 'test1.dsm', '0.08', 'no_such_form', '0.08', '5', 'fast'],
+                      ['test1.smr', 'test1.dsm', '0.08', 'linear', '', '5', 'fast']):
+            with open(inp, 'w') as fp:
+                fp.write('\n'.join(lines + ['']))
+            status, out, err = self.run_main([inp, '--quiet'])
+            self.assertEqual(status, 2)
+            self.assertTrue('could not read command input file: ' + inp in err)
+
+        # the result cannot be written
+        args[3] = os.path.join(self.directory, 'no such directory', 'out.dsm')
+        status, out, err = self.run_main(args + ['--quiet'])
+        self.assertEqual((status, out), (1, ''))
+        self.assertTrue(err.startswith('jldsmear run: desmearing failed'))
+        self.assertEqual(len(err.splitlines()), 1)
+        status, out, err = self.run_main(args)
+        self.assertEqual(status, 1)
+        self.assertFalse('SavDat' in out)
+        self.assertTrue('SavDat: error while opening or writing' in err)
+
+
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
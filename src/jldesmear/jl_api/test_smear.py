@@ -2,10 +2,16 @@
 
 
 import unittest
+import numpy
 import smear
 import toolbox
+import extrap_constant
+import extrapolation
 import extrap_linear    #@UnusedImport
 import os               #@UnusedImport
+import shutil
+import tempfile
+import kernel_cache
 
 
 datafile = toolbox.GetTest1DataFilename('.dsm')
@@ -38,6 +44,234 @@ class Test(unittest.TestCase):
         self.assertFalse('m' in coeff)
         self.assertAlmostEquals( coeff['B'], 38.589860526315789 )
 
+    def test_vectorized(self):
+        q, C, dC = toolbox.GetDat(datafile)
+        sFinal = 0.08
+        slitlength = 0.08
+        for extrapname in ("constant", "linear", "Porod", "powerlaw"):
+            S = smear.Smear(q, C, dC, extrapname, sFinal, slitlength, quiet = True)[0]
+            S_vec = smear.Smear(q, C, dC, extrapname, sFinal, slitlength, quiet = True,
+                                engine = 'vectorized', block_size = 37)[0]
+            self.assertTrue(numpy.allclose(S_vec, S, rtol=1e-12, atol=0))
+            S_cached = smear.Smear(q, C, dC, extrapname, sFinal, slitlength, quiet = True,
+                                   engine = 'cached', block_size = 37)[0]
+            self.assertTrue(numpy.allclose(S_cached, S, rtol=1e-12, atol=0))
+
+    def test_TiledKernel(self):
+        q, C, dC = toolbox.GetDat(datafile)
+        sFinal = 0.08
+        slitlength = 0.08
+        extrap = smear.prepare_extrapolation(q, C, dC, "linear", sFinal)
+        S_cached = smear.Smear(q, C, dC, "linear", sFinal, slitlength, quiet = True,
+                               engine = 'cached', extrap = extrap)[0]
+        # room for only a few of the tiles: some are discarded and computed again
+        kernel = smear.TiledKernel(q, slitlength, sFinal, block_size = 16, cache_MB = 0.25)
+        for _ in range(2):
+            S = smear.Smear(q, C, dC, "linear", sFinal, slitlength, quiet = True,
+                            engine = 'tiled', kernel = kernel, extrap = extrap)[0]
+            self.assertTrue(numpy.allclose(S, S_cached, rtol=1e-12, atol=0))
+        self.assertTrue(0 < len(kernel.tiles) < len(range(0, len(q), 16)))
+        self.assertTrue(kernel.tile_bytes <= kernel.cache_bytes)
+        self.assertTrue(kernel.hits > 0)
+        self.assertTrue(kernel.misses > len(range(0, len(q), 16)))
+
+        # all tiles kept: computed only once
+        kernel = smear.TiledKernel(q, slitlength, sFinal, block_size = 16)
+        S_many = kernel.smear_many(numpy.array([C, C]), [extrap, extrap])
+        S = kernel.smear(C, extrap)
+        self.assertTrue(numpy.allclose(S_many[1], S_cached, rtol=1e-12, atol=0))
+        self.assertTrue(numpy.allclose(S, S_cached, rtol=1e-12, atol=0))
+        self.assertEqual(kernel.misses, len(kernel.tiles))
+
+        # two threads miss the same tile: it is cached (and counted) once
+        kernel = smear.TiledKernel(q, slitlength, sFinal, block_size = 16)
+        build_tile = kernel._build_tile
+        def build_tile_raced(start, stop):
+            kernel._build_tile = build_tile
+            first = kernel.tile(start)          # the other thread, which finishes first
+            self.assertTrue(start in kernel.tiles)
+            tile = build_tile(start, stop)
+            self.assertFalse(tile is first)
+            return tile
+        kernel._build_tile = build_tile_raced
+        tile = kernel.tile(16)
+        self.assertTrue(tile is kernel.tiles[16])
+        self.assertEqual(len(kernel.tiles), 1)
+        self.assertEqual(kernel.tile_bytes, sum([a.nbytes for terms in tile for a in terms]))
+
+    def test_threads(self):
+        q, C, dC = toolbox.GetDat(datafile)
+        sFinal = 0.08
+        slitlength = 0.08
+        extrap = smear.prepare_extrapolation(q, C, dC, "linear", sFinal)
+        for engine in sorted(smear.Smearing_Engines.keys()):
+            for quadrature in ('data', 'gauss'):
+                S = smear.Smear(q, C, dC, "linear", sFinal, slitlength, quiet = True,
+                                engine = engine, extrap = extrap, block_size = 37,
+                                quadrature = quadrature, nodes = 48)[0]
+                S_threads = smear.Smear(q, C, dC, "linear", sFinal, slitlength, quiet = True,
+                                        engine = engine, extrap = extrap, block_size = 37,
+                                        quadrature = quadrature, nodes = 48, n_threads = 3)[0]
+                self.assertTrue(numpy.allclose(S_threads, S, rtol=1e-12, atol=0))
+        kernel = smear.SmearingKernel(q, slitlength, sFinal, block_size = 37, analytic_tail = True)
+        S_many = kernel.smear_many(numpy.array([C, 2*C]), [extrap, extrap])
+        S_threads = kernel.smear_many(numpy.array([C, 2*C]), [extrap, extrap], n_threads = 3)
+        self.assertTrue(numpy.allclose(S_threads, S_many, rtol=1e-12, atol=0))
+
+    def test_thread_pool(self):
+        q, C, dC = toolbox.GetDat(datafile)
+        extrap = smear.prepare_extrapolation(q, C, dC, "linear", 0.08)
+        pool = smear.thread_pool(2)
+        self.assertIs(smear.thread_pool(2), pool)
+        self.assertEqual(smear.pool_map(lambda i: smear.pool_map(abs, [-i, i], 2), range(-3, 4), 2),
+                         [[3, 3], [2, 2], [1, 1], [0, 0], [1, 1], [2, 2], [3, 3]])
+
+        # each smearing uses the same pool, rather than starting a new one
+        pools = len(smear._thread_pools)
+        kernel = smear.make_kernel('kernel', q, 0.08, 0.08)
+        for engine in ('vectorized', 'kernel', 'tiled'):
+            for _ in range(3):
+                smear.Smear(q, C, dC, "linear", 0.08, 0.08, quiet = True, 
+                            engine = engine, block_size = 37, n_threads = 2)
+                kernel.smear(C, extrap, 2)
+        self.assertEqual(len(smear._thread_pools), pools)
+        self.assertIs(smear.thread_pool(2), pool)
+
+    def test_kernel_cache(self):
+        q, C, dC = toolbox.GetDat(datafile)
+        sFinal = 0.08
+        slitlength = 0.08
+        extrap = smear.prepare_extrapolation(q, C, dC, "linear", sFinal)
+        directory = tempfile.mkdtemp()
+        try:
+            cache = kernel_cache.KernelCache(directory)
+            for engine, storage in (('kernel', 'dense'), ('kernel', 'sparse'), ('cached', 'auto')):
+                for quadrature in ('data', 'gauss'):
+                    built = cache.kernel(engine, q, slitlength, sFinal, quadrature = quadrature,
+                                         nodes = 48, storage = storage, analytic_tail = True)
+                    loaded = cache.kernel(engine, q, slitlength, sFinal, quadrature = quadrature,
+                                          nodes = 48, storage = storage, analytic_tail = True)
+                    self.assertTrue(isinstance(loaded.x, numpy.memmap))
+                    self.assertTrue(loaded.agrees(q, slitlength, sFinal, quadrature = quadrature,
+                                                  nodes = 48, analytic_tail = True))
+                    self.assertTrue(numpy.allclose(loaded.smear(C, extrap), built.smear(C, extrap),
+                                                   rtol=1e-14, atol=0))
+            entries = cache.entries()
+            self.assertEqual(len(entries), 6)
+            for i, (_, size, key) in enumerate(entries):
+                os.utime(cache.path(key), (1e9 + i, 1e9 + i))
+
+            # least recently used are removed first
+            cache.size_bytes = sum([size for _, size, _ in entries[2:]])
+            self.assertEqual(cache.evict(), [key for _, _, key in entries[:2]])
+            self.assertEqual(len(cache.entries()), 4)
+            cache.clear()
+            self.assertEqual(cache.entries(), [])
+        finally:
+            shutil.rmtree(directory)
+
+    def test_SmearingKernel(self):
+        q, C, dC = toolbox.GetDat(datafile)
+        sFinal = 0.08
+        slitlength = 0.08
+        kernel = smear.SmearingKernel(q, slitlength, sFinal)
+        self.assertTrue(kernel.agrees(q, slitlength, sFinal))
+        self.assertFalse(kernel.agrees(q, slitlength, 0.07))
+
+        # integral of P_l(l) is 1, so smearing a constant is that constant
+        extrap = extrap_constant.Extrapolation()
+        extrap.SetCoefficients({'B': 1.0})
+        S = kernel.smear(numpy.ones_like(q), extrap)
+        self.assertTrue(numpy.allclose(S, 1.0))
+
+        S, extrap = smear.Smear(q, C, dC, "constant", sFinal, slitlength, quiet = True)
+        S_kernel = smear.Smear(q, C, dC, "constant", sFinal, slitlength, quiet = True, 
+                               engine = 'kernel', kernel = kernel)[0]
+        # kernel interpolates linearly rather than log-linearly
+        self.assertTrue(numpy.allclose(S_kernel, S, rtol=0.02))
+
+    def test_sparse_kernel(self):
+        q, C, dC = toolbox.GetDat(datafile)
+        sFinal = 0.08
+        slitlength = 0.02
+        first, last = smear.kernel_band(q, slitlength)
+        self.assertTrue((first <= last).all())
+        self.assertTrue(0 < smear.kernel_density(q, slitlength) < 1)
+
+        extrap = smear.prepare_extrapolation(q, C, dC, "linear", sFinal)
+        dense = smear.SmearingKernel(q, slitlength, sFinal, storage='dense')
+        sparse = smear.SmearingKernel(q, slitlength, sFinal, storage='sparse', block_size=17)
+        self.assertFalse(dense.sparse)
+        self.assertTrue(sparse.sparse)
+        self.assertTrue(numpy.allclose(sparse.smear(C, extrap), dense.smear(C, extrap),
+                                       rtol=1e-12, atol=0))
+        # no terms outside of the band
+        rows, columns = sparse.matrix.nonzero()
+        self.assertTrue((columns >= first[rows]).all() and (columns <= last[rows]).all())
+        self.assertRaises(ValueError, smear.SmearingKernel, q, slitlength, sFinal, storage='banded')
+
+    def test_slit_quadrature(self):
+        q, C, dC = toolbox.GetDat(datafile)
+        sFinal = 0.08
+        slitlength = 0.08
+        for rule in sorted(smear.Slit_Quadratures.keys()):
+            x, dx = smear.slit_quadrature(q, slitlength, rule, 64)
+            self.assertAlmostEquals(numpy.sum(dx), slitlength)
+            self.assertTrue(x.min() >= 0 and x.max() <= slitlength)
+        x, dx = smear.slit_quadrature(q, slitlength, 'gauss', 8)
+        self.assertAlmostEquals(numpy.sum(dx * x**3), slitlength**4 / 4)
+        self.assertRaises(ValueError, smear.slit_quadrature, q, slitlength, 'simpson', 64)
+
+        # all engines agree for the same quadrature
+        S = smear.Smear(q, C, dC, "linear", sFinal, slitlength, quiet = True,
+                        quadrature = 'gauss', nodes = 48)[0]
+        for engine in ('vectorized', 'cached'):
+            S_engine = smear.Smear(q, C, dC, "linear", sFinal, slitlength, quiet = True,
+                                   engine = engine, quadrature = 'gauss', nodes = 48)[0]
+            self.assertTrue(numpy.allclose(S_engine, S, rtol=1e-12, atol=0))
+        # near the traditional trapezoid rule, before the transition to extrapolation
+        S_data = smear.Smear(q, C, dC, "linear", sFinal, slitlength, quiet = True)[0]
+        S_log = smear.Smear(q, C, dC, "linear", sFinal, slitlength, quiet = True,
+                            engine = 'vectorized', quadrature = 'log', nodes = 128)[0]
+        measured = q <= sFinal
+        self.assertTrue(numpy.allclose(S_log[measured], S_data[measured], rtol=0.03))
+
+    def test_analytic_tail(self):
+        q = toolbox.GetDat(toolbox.GetTest1DataFilename('.smr'))[0]
+        sFinal = 0.08
+        slitlength = 0.08
+        functions = extrapolation.discover_extrapolations()
+        self.assertEqual(functions['powerlaw'].basis, None)
+
+        # basis integrals agree with numerical integration
+        a = numpy.array([0.1, 0.01, 0.0])
+        b = numpy.array([0.3, 0.3, 0.08])
+        qq = numpy.array([1e-3, 0.05, 0.2])
+        for name in ('constant', 'linear', 'Porod'):
+            extrap = functions[name]()
+            integrals = extrap.basis_integrals(qq, a, b)
+            for i in range(len(qq)):
+                x = numpy.linspace(a[i], b[i], 200001)
+                f = extrap.basis_functions(numpy.sqrt(qq[i]**2 + x*x))
+                self.assertTrue(numpy.allclose(integrals[i], numpy.trapz(f, x, axis=0), rtol=1e-6))
+
+        # smearing a Porod law: exact beyond qMax
+        extrap = functions['Porod']()
+        extrap.SetCoefficients({'B': 2.0, 'Cp': 1e-7})
+        C = extrap.calc(q)
+        exact = extrap.basis_integrals(q, 0*q, 0*q + slitlength).dot(extrap.coefficient_vector())
+        exact /= slitlength
+        kernel = smear.SmearingKernel(q, slitlength, sFinal, interpolation='log', analytic_tail=True)
+        self.assertTrue(kernel.agrees(q, slitlength, sFinal, analytic_tail=True))
+        self.assertFalse(kernel.agrees(q, slitlength, sFinal))
+        S = kernel.smear(C, extrap)
+        tail = kernel.tail_start < slitlength
+        self.assertTrue(tail.any())
+        self.assertTrue(numpy.allclose(S[tail], exact[tail], rtol=1e-7))
+        self.assertEqual(kernel.tail_matrix(extrap).shape, (len(q), 2))
+        S_many = kernel.smear_many(numpy.array([C, 2*C]), [extrap, extrap])
+        self.assertTrue(numpy.allclose(S_many[0], S, rtol=1e-12))
+
     def test_Plengt(self):
         dataset = {}
         dataset[ (-0.1, .5) ] = 1.0
@@ -2,6 +2,16 @@
 
 
 import unittest
+import glob
+import numpy
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import extrapolation
+import fileio
+import fileio_inp
 import toolbox
 import os           #@UnusedImport
 
@@ -26,6 +36,107 @@ class Test(unittest.TestCase):
         # test some more stuff here ...
         self.assertRaises(Exception, toolbox.GetDat, missing_datafile)
 
+    def test_ReadColumns(self):
+        data_dir = os.path.dirname(expected_datafile)
+        for extension in ('.smr', '.dsm', '.dl', '.pin'):
+            for filename in glob.glob(os.path.join(data_dir, '*' + extension)):
+                expected = numpy.loadtxt(filename, comments='#', unpack=True)
+                for chunk_bytes in (100, toolbox.READ_CHUNK_BYTES):
+                    columns = toolbox.ReadColumns(filename, chunk_bytes=chunk_bytes)
+                    self.assertEqual(len(columns), len(expected))
+                    for column, values in zip(columns, expected):
+                        self.assertTrue(numpy.array_equal(column, values))
+
+        cases = (
+            ('# Q I dI\n1 2 3\n\n4 5 6  # comment\n7 8\n', 5, 'expected 3 columns'),
+            ('1 2 3\r\n4 x 6\r\n', 2, 'not a number'),
+            ('1 2 3\n4 5 6abc', 2, 'not a number'),
+            ('# nothing\n', None, 'no data'),
+        )
+        fd, filename = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            for text, line, message in cases:
+                with open(filename, 'w') as fp:
+                    fp.write(text)
+                try:
+                    toolbox.GetDat(filename)
+                    self.fail('no error reading ' + repr(text))
+                except toolbox.DataFileError, exc:
+                    self.assertEqual(exc.line, line)
+                    self.assertTrue(message in str(exc))
+        finally:
+            os.remove(filename)
+        self.assertRaises(RuntimeError, toolbox.GetDat, missing_datafile)
+
+    def test_sidecar(self):
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, 'test1.smr')
+            shutil.copy(expected_datafile, filename)
+            expected = toolbox.GetDat(filename)
+            self.assertEqual(toolbox.ReadSidecar(filename), None)
+            toolbox.GetDat(filename, sidecar=True)
+            self.assertTrue(os.path.exists(filename + toolbox.SIDECAR_EXTENSION))
+            columns = toolbox.GetDat(filename, sidecar=True)
+            self.assertTrue(isinstance(columns[0], numpy.memmap))
+            for column, values in zip(columns, expected):
+                self.assertTrue(numpy.array_equal(column, values))
+
+            # same size, new contents: stale
+            with open(filename) as fp:
+                text = fp.read()
+            with open(filename, 'w') as fp:
+                fp.write(text.replace('0.000371484', '0.000371485'))
+            self.assertEqual(toolbox.ReadSidecar(filename), None)
+            self.assertEqual(toolbox.GetDat(filename, sidecar=True)[0][0], 0.000371485)
+            self.assertEqual(toolbox.ReadSidecar(filename)[0][0], 0.000371485)
+
+            # touched, same contents: still up to date
+            past = time.time() - 100
+            os.utime(filename, (past, past))
+            self.assertNotEqual(toolbox.ReadSidecar(filename), None)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_import_plugin(self):
+        self.assertTrue(toolbox.import_plugin('extrap_linear').Extrapolation 
+                        is extrapolation.discover_extrapolations()['linear'])
+
+        # discovery and .inp files from many threads, cwd and sys.path unchanged
+        cwd, path = os.getcwd(), list(sys.path)
+        saved = extrapolation.functions, fileio.formats, fileio.ext_xref
+        directory = tempfile.mkdtemp()
+        results = []
+
+        def discover(i):
+            functions = sorted(extrapolation.discover_extrapolations().keys())
+            formats = sorted(fileio.discover_support().keys())
+            cmd_inp = fileio_inp.CommandInput()
+            params = cmd_inp.read(toolbox.GetTest1DataFilename('.inp'))
+            cmd_inp.save(os.path.join(directory, 'test%d.inp' % i))
+            params = fileio_inp.CommandInput().read(os.path.join(directory, 'test%d.inp' % i))
+            results.append((functions, formats, params.infile))
+
+        try:
+            extrapolation.functions = fileio.formats = fileio.ext_xref = None
+            threads = [threading.Thread(target=discover, args=(i,)) for i in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            extrapolation.functions, fileio.formats, fileio.ext_xref = saved
+            shutil.rmtree(directory)
+        self.assertEqual(os.getcwd(), cwd)
+        self.assertEqual(sys.path, path)
+        self.assertEqual(results, [results[0]] * 8)
+        functions, formats, infile = results[0]
+        self.assertEqual(functions, sorted(extrapolation.discover_extrapolations().keys()))
+        self.assertEqual(formats, sorted(fileio.discover_support().keys()))
+        self.assertTrue('CommandInput' in formats)
+        self.assertEqual(infile, expected_datafile)
+
     def test_find_first_index(self):
         x = toolbox.GetDat(expected_datafile)[0]
         self.assertEquals( toolbox.find_first_index(x, 0.08), 211 )
@@ -11,14 +11,32 @@ so that they may be improved, as needed.
 '''
 
 
+import hashlib
+import importlib
+import json
 import os
 import sys
 import math     #@UnusedImport
 import string
+import tempfile
+import threading
+import time
+import warnings
 import numpy
 import scipy    #@UnusedImport
 
 
+READ_CHUNK_BYTES = 2**20    # ReadColumns(): text parsed at once
+WHITESPACE = numpy.array([ord(c) for c in ' \t\r\n\v\f'], dtype=numpy.uint8)
+COMMENT = ord('#')
+NEWLINE = ord('\n')
+_warnings_lock = threading.Lock()     # the warnings filters are shared by all threads
+
+SIDECAR_EXTENSION = '.npy'  # GetDat(): binary copy of the data, next to the text file
+SIDECAR_FORMAT = 1
+MTIME_RESOLUTION = 2.0      # seconds: a file changed this soon after its sidecar is checked by hash
+
+
 def AskQuestion(question, answer):
     '''
     request a string, float, or int from the command line
@@ -120,30 +138,230 @@ def isDataLine (line):
             isData = True
     return isData
 
+class DataFileError(RuntimeError):
+    '''
+    a data file could not be read
+    
+    :param str filename: name of the data file
+    :param int line: number (starting at 1) of the offending line, or None
+    :param str message: what is wrong
+    '''
 
-def GetDat (infile):
+    def __init__(self, filename, line, message):
+        self.filename = filename
+        self.line = line
+        where = filename if line is None else '%s, line %d' % (filename, line)
+        RuntimeError.__init__(self, where + ': ' + message)
+
+
+def _parse_chunk(text, columns):
+    '''
+    parse a chunk of white-space-separated text (complete lines)
+    
+    :param str text: lines of text
+    :param int columns: expected number of columns (None: from the first data line)
+    :return: (values, shape (rows, columns); columns; 
+        None or (line, counted from 0, and message) of the first error)
+    '''
+    buf = numpy.frombuffer(text, dtype=numpy.uint8)
+    newline = buf == NEWLINE
+    line_of = numpy.cumsum(newline) - newline      # line of each character
+    if COMMENT in buf:
+        # blank out "#" and the rest of its line
+        hashes = numpy.cumsum(buf == COMMENT)
+        line_start = numpy.concatenate(([0], numpy.flatnonzero(newline) + 1))
+        before = numpy.concatenate(([0], hashes))[line_start]
+        comment = hashes - before[line_of] > 0
+        buf = numpy.where(comment & ~newline, numpy.uint8(32), buf)
+        text = buf.tostring()
+    space = numpy.in1d(buf, WHITESPACE)
+    starts = numpy.flatnonzero(~space & numpy.concatenate(([True], space[:-1])))
+    tokens = numpy.bincount(line_of[starts], minlength=int(line_of[-1]) + 1 if buf.size else 0)
+    rows = numpy.flatnonzero(tokens)
+    if rows.size == 0:
+        return numpy.zeros((0, columns or 0)), columns, None
+    if columns is None:
+        columns = int(tokens[rows[0]])
+    wrong = rows[tokens[rows] != columns]
+    if wrong.size > 0:
+        line = int(wrong[0])
+        return None, columns, (line, 'expected %d columns, found %d' % (columns, tokens[line]))
+    with _warnings_lock, warnings.catch_warnings():
+        warnings.simplefilter('ignore')         # reported below, with the line number
+        # parsing stops at the first text that is not a number: 
+        # a final 0 shows whether that was the end of the chunk
+        values = numpy.fromstring(text + ' 0', dtype=float, sep=' ')
+    if values.size != starts.size + 1:
+        line = int(line_of[starts[min(values.size, starts.size - 1)]])
+        return None, columns, (line, 'not a number')
+    return values[:-1].reshape((-1, columns)), columns, None
+
+
+def ReadColumns (infile, columns=None, chunk_bytes=READ_CHUNK_BYTES):
+    '''
+    read columns of numbers from a wss (white-space-separated) file
+    
+    As ``numpy.loadtxt(infile, comments='#', unpack=True)`` 
+    but the text is parsed in chunks of complete lines
+    (about *chunk_bytes* each), each converted in bulk
+    into arrays that are allocated once for the whole file
+    (from its size) and enlarged only if needed.
+    Blank lines are skipped and a "#" comments out the rest of its line.
+    Every data line must have the same number of columns.
+    
+    :param string infile: name of input data file
+    :param int columns: expected number of columns (default: as the first data line)
+    :param int chunk_bytes: size of the chunks of text
+    :return: one array for each column
+    :rtype: (numpy.ndarray, ...)
+    :raises DataFileError: if the file cannot be read, 
+        with the number of the offending line
+    '''
+    try:
+        size = os.path.getsize(infile)
+        fp = open(infile, 'rb')
+    except (IOError, OSError), exc:
+        raise DataFileError(infile, None, exc.strerror or str(exc))
+    data = None
+    count = 0           # rows read
+    lines = 0           # lines read, before this chunk
+    with fp:
+        while True:
+            text = fp.read(chunk_bytes)
+            if len(text) == 0:
+                break
+            if not text.endswith('\n'):
+                text += fp.readline()           # complete the last line
+            values, columns, error = _parse_chunk(text, columns)
+            if error is not None:
+                line, message = error
+                raise DataFileError(infile, lines + line + 1, message)
+            if len(values) > 0:
+                if data is None:
+                    estimate = int(1.05 * size * len(values) / len(text)) + 1
+                    data = numpy.empty((columns, max(estimate, len(values))))
+                if count + len(values) > data.shape[1]:
+                    grown = numpy.empty((columns, max(2 * data.shape[1], count + len(values))))
+                    grown[:, :count] = data[:, :count]
+                    data = grown
+                data[:, count:count+len(values)] = values.T
+                count += len(values)
+            lines += text.count('\n')
+    if data is None:
+        raise DataFileError(infile, None, 'no data')
+    return tuple(data[:, :count])
+
+
+def _file_digest(filename, chunk_bytes=READ_CHUNK_BYTES):
+    ''':return: SHA-1 hex digest of the contents of a file'''
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(chunk_bytes), ''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def ReadSidecar (infile):
+    '''
+    columns of a data file from its sidecar (see :func:`WriteSidecar()`), 
+    if the sidecar is up to date
+    
+    The sidecar is up to date if the size of *infile* is unchanged
+    and either its modification time is unchanged (and was well 
+    before the sidecar was written) or its contents 
+    have the same SHA-1 digest.  The columns are memory-mapped.
+    
+    :param string infile: name of input data file
+    :return: columns or None if there is no sidecar or it is stale
+    :rtype: (numpy.ndarray, ...)
+    '''
+    try:
+        record = numpy.load(infile + SIDECAR_EXTENSION, mmap_mode='r')
+        key = json.loads(str(record['key'][0]))
+        stat = os.stat(infile)
+    except (IOError, OSError, ValueError, KeyError, IndexError):
+        return None
+    if key.get('format') != SIDECAR_FORMAT or key.get('size') != stat.st_size:
+        return None
+    settled = stat.st_mtime < key['written'] - MTIME_RESOLUTION
+    if not (settled and stat.st_mtime == key['mtime']):
+        if _file_digest(infile) != key['sha1']:
+            return None
+    return tuple(record['data'][0])
+
+
+def WriteSidecar (infile, columns, stat=None, digest=None):
+    '''
+    write a binary copy (the *sidecar*) of the columns read from a data file
+    
+    The sidecar (``infile + SIDECAR_EXTENSION``) is a NumPy ``.npy`` file
+    with one record: the columns and the size, modification time, and SHA-1
+    digest of *infile*.  It is written to a temporary file that
+    is then renamed.  Nothing is written if the directory is not writable.
+    
+    :param string infile: name of input data file
+    :param [numpy.ndarray] columns: as read from *infile*
+    :param obj stat: ``os.stat(infile)`` before *columns* were read (default: now)
+    :param str digest: SHA-1 digest of *infile* (default: computed)
+    '''
+    stat = stat or os.stat(infile)
+    key = dict(format=SIDECAR_FORMAT, size=stat.st_size, mtime=stat.st_mtime,
+               sha1=digest or _file_digest(infile), written=time.time())
+    key = json.dumps(key, sort_keys=True)
+    data = numpy.array(columns, dtype=float)
+    dtype = [('key', 'S%d' % len(key)), ('data', float, data.shape)]
+    record = numpy.zeros((1,), dtype=dtype)
+    record['key'][0] = key
+    record['data'][0] = data
+    filename = infile + SIDECAR_EXTENSION
+    try:
+        fd, temporary = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(os.path.abspath(infile)))
+    except (IOError, OSError):
+        return
+    try:
+        with os.fdopen(fd, 'wb') as fp:
+            numpy.save(fp, record)
+        if os.path.exists(filename) and sys.platform == 'win32':
+            os.remove(filename)         # rename does not replace a file on Windows
+        os.rename(temporary, filename)
+    except (IOError, OSError):
+        pass
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+
+def GetDat (infile, sidecar=False):
     '''
     read three-column data from a wss (white-space-separated) file
     
     Data appear as Q  I  dI with one data point per line.
     A "#" may be used to comment out any line.
+    See :func:`ReadColumns()`.
+    
+    With *sidecar*, the data are read from the sidecar 
+    (see :func:`ReadSidecar()`) when it is up to date, 
+    otherwise they are read from *infile* and a new sidecar is written.
     
     :param string infile: name of input data file
+    :param bool sidecar: use (and keep) a binary copy of the data
     :return: x, y, dy
     :rtype: (numpy.ndarray, numpy.ndarray, numpy.ndarray)
+    :raises DataFileError: (a RuntimeError) if the file cannot be read
     '''
-    try:
-        x, y, dy = numpy.loadtxt(infile, 
-                      dtype=numpy.float, 
-                      comments='#',
-                      unpack=True)
-        return x, y, dy
-    except:
-        message = "GetDat: error while opening or reading: " + infile
-        raise RuntimeError, message
-
-
-def SavDat (outfile, x, y, dy):
+    columns = ReadSidecar(infile) if sidecar else None
+    if columns is None or len(columns) != 3:
+        stat = os.stat(infile) if sidecar and os.path.exists(infile) else None
+        columns = ReadColumns(infile, columns=3)
+        if stat is not None:
+            digest = _file_digest(infile)
+            if os.stat(infile).st_mtime == stat.st_mtime:      # not changed while reading
+                WriteSidecar(infile, columns, stat, digest)
+    x, y, dy = columns
+    return x, y, dy
+
+
+def SavDat (outfile, x, y, dy, quiet = False):
     '''
     save three column ASCII data in tab-separated file
 
@@ -151,16 +369,20 @@ def SavDat (outfile, x, y, dy):
     :param numpy.ndarray x: column 1 data array
     :param numpy.ndarray y: column 2 data array 
     :param numpy.ndarray dy: column 3 data array
+    :param bool quiet: if True, do not report the name of the saved file
+        (or an error, which is reported on ``stderr``)
     '''
     try:
         numpy.savetxt(outfile, 
                       numpy.transpose([x, y, dy]),
                       fmt='%g',
                       delimiter='\t')
-        print("Saved data in file: %s\n" % outfile)
+        if not quiet:
+            print("Saved data in file: %s\n" % outfile)
         return outfile
     except:
-        print "SavDat: error while opening or writing: " + outfile
+        if not quiet:
+            sys.stderr.write("SavDat: error while opening or writing: " + outfile + "\n")
         raise
 
 
@@ -192,6 +414,24 @@ def find_first_index(x, target):
     return None
 
 
+def import_plugin(modulename):
+    '''
+    import a module of this package (such as a plugin) by name
+
+    The module is imported relative to this package, so neither
+    the working directory nor ``sys.path`` is changed.
+    When this package is not installed (its modules are imported
+    from the directory on ``sys.path``), the module is imported by name.
+
+    :param str modulename: name of the module, such as ``extrap_linear``
+    :return: the module
+    '''
+    package = __name__.rpartition('.')[0]
+    if len(package) > 0:
+        return importlib.import_module('.' + modulename, package)
+    return importlib.import_module(modulename)
+
+
 def GetTest1DataFilename(ext='.smr'):
     '''find the test1 data in the package'''
     path = os.path.dirname(__file__)
@@ -22,13 +22,38 @@ def desmear_gui():
     jldesmear.jl_api.gui.main()
 
 
+def desmear_batch(args=None):
+    '''desmear many datasets (.inp files) in a pool of worker processes'''
+    import jldesmear.jl_api.batch
+    sys.exit(jldesmear.jl_api.batch.main(args))
+
+
+def desmear_run(args=None):
+    '''non-interactive command-line interface, all parameters from options'''
+    import jldesmear.jl_api.headless
+    sys.exit(jldesmear.jl_api.headless.main(args))
+
+
+SUBCOMMANDS = {
+    'batch': desmear_batch,
+    'run': desmear_run,
+}
+
+
 def decide_ui():
     '''get arguments passed on command line, if any'''
     doc = '''
 Iterative desmearing of SAS data
 using the technique of JA Lake 
 as implemented by PR Jemian'''
-    parser = argparse.ArgumentParser(description=doc)
+    if len(sys.argv) > 1 and sys.argv[1] in SUBCOMMANDS:
+        # subcommand parses the remaining arguments itself
+        subcommand = SUBCOMMANDS[sys.argv[1]]
+        return lambda: subcommand(sys.argv[2:])
+
+    parser = argparse.ArgumentParser(description=doc,
+                 epilog='subcommands: ' + ', '.join(sorted(SUBCOMMANDS)) 
+                        + ' (use "SUBCOMMAND -h" for help)')
     parser.add_argument('-g', '--gui', action='store_true', default=False,
                         dest='interface',
                         help='Use the graphical rather than command-line interface')